@@ -1,103 +1,262 @@
-import pyodbc
+import argparse
 import pandas as pd
 
-def format_nm(nm):
-    s = str(nm).lstrip("0")
-    if len(s) <= 6:
-        return s
-    prefix = s[:len(s)-6]
-    infix = s[len(s)-6:len(s)-3]
-    sufix = s[-3:]
-    return f"{prefix}.{infix}.{sufix}"
+from cache_local import SnapshotCache
+from catalogo_colunas import ColumnCatalog
+from extracao_odbc import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_MAX_SEMIJOIN_KEYS,
+    MARC_COLUMNS,
+    MARC_WHERE,
+    ExtractionStats,
+    LazyConnection,
+    build_select,
+    choose_join_strategy,
+    fetch_column,
+    fetch_scalar,
+    fetch_semijoin,
+    iter_batches,
+)
+from extracao_paralela import fetch_plants, parse_matnr_splits, run_partitions, semijoin_partitions
+import motor_polars
+from motor_polars import DEFAULT_ENGINE, ENGINES
+from rastreamento import TRACER, span
+from relatorio_excel import ExcelStreamWriter, write_report
+from tipos_sap import compact_frame
+from transformacoes import RENAME_MARC_MARA, format_nm_series
 
-def main():
-    connection_string = "DSN=TDVCPBIP;dataSource=S10231;"
-    
-    try:
-        conn = pyodbc.connect(connection_string)
-        print("Connected using DSN 'TDVCPBIP' with dataSource=S10231.")
-    except Exception as e:
-        print("Connection error:", e)
-        return
-    
-    sql_marc = """
-    SELECT
-        WERKS,
-        MATNR,
-        DISGR,
-        DISMM,
-        DISLS,
-        MINBE,
-        MABST,
-        VSPVB,
-        PLIFZ,
-        LGRAD
-    FROM MARC
-    WHERE WERKS IN ('2032','2096','2914')
+OUTPUT_FILE = "parametros_de_ressuprimento_MARC.xlsx"
+
+# Filter identifying the cached MARA extract: the materials carried by the queried plants.
+MARA_COLUMNS = ['MATNR', 'MEINS']
+MARA_WHERE = f"MATNR IN (SELECT MATNR FROM MARC WHERE {MARC_WHERE})"
+
+SQL_MARC_KEY_COUNT = f"""
+SELECT COUNT(DISTINCT MATNR)
+FROM MARC
+WHERE {MARC_WHERE}
+"""
+
+SQL_MARC_KEYS = f"""
+SELECT DISTINCT MATNR
+FROM MARC
+WHERE {MARC_WHERE}
+"""
+
+def usable_columns():
+    """MARC and MARA columns without the ones the column catalog knows to be unreadable."""
+    catalog = ColumnCatalog()
+    return catalog.usable_columns("MARC", MARC_COLUMNS), catalog.usable_columns("MARA", MARA_COLUMNS)
+
+def marc_sql(marc_columns):
+    """MARC rows of the queried plants."""
+    return build_select("MARC", marc_columns, MARC_WHERE)
+
+def mara_sql(mara_columns):
+    """Base query for the MARA lookup; the MATNR IN (...) filter is appended per key batch."""
+    return build_select("MARA", mara_columns)
+
+def marc_mara_sql(marc_columns, mara_columns):
+    """Same rows as marc_sql with the MARA fields (MEINS) joined on the server."""
+    select_list = [f"MARC.[{col}]" for col in marc_columns]
+    select_list += [f"MARA.[{col}]" for col in mara_columns if col != "MATNR"]
+    return (f"SELECT {', '.join(select_list)}\nFROM MARC\n"
+            f"LEFT JOIN MARA ON MARA.MATNR = MARC.MATNR\nWHERE MARC.{MARC_WHERE}")
+
+def transform(df_marc, df_mara=None):
+    # Merge MARC and MARA using WERKS and MATNR as keys (already done when the server joined them)
+    df = df_marc
+    if df_mara is not None:
+        with span("merge"):
+            df = df.merge(df_mara, on='MATNR', how='left')
+
+    # Rename columns
+    df = df.rename(columns=RENAME_MARC_MARA)
+
+    # Apply the NM formatting function
+    df["NM"] = format_nm_series(df["NM"])
+    return df
+
+def plan_mara_lookup(conn, max_semijoin_keys):
+    """
+    Decides how MEINS is fetched based on how many distinct materials the plants carry.
+    Returns (sql, df_mara): either the server-side join and no lookup frame, or the plain
+    MARC query and the MARA rows fetched with MATNR IN (...) batches. Both select only the
+    columns the column catalog allows.
+    """
+    marc_columns, mara_columns = usable_columns()
+    key_count = fetch_scalar(conn, SQL_MARC_KEY_COUNT)
+    strategy = choose_join_strategy(key_count, max_semijoin_keys)
+    print(f"{key_count} distinct materials in MARC, fetching MARA with a {strategy}.")
+    if strategy == "join":
+        return marc_mara_sql(marc_columns, mara_columns), None
+
+    keys = fetch_column(conn, SQL_MARC_KEYS)
+    df_mara = fetch_semijoin(conn, mara_sql(mara_columns), "MATNR", keys)
+    print("Data retrieved from MARA table.")
+    return marc_sql(marc_columns), df_mara
+
+def read_extracts(db, cache, max_semijoin_keys, refresh=False, workers=1, matnr_splits=()):
     """
-    
-    sql_mara = """
-    SELECT
-        MATNR,
-        MEINS
-    FROM MARA
+    Reads MARC and the matching MARA rows, through the local cache unless cache is None,
+    connecting only on a miss. On a MARA miss the keys come from the (possibly cached)
+    MARC frame: few keys are fetched with MATNR IN (...) batches, many with a server-side
+    semi-join subquery. With workers > 1, MARC is split per plant and the MARA batches
+    run in parallel on a connection pool. Columns the column catalog knows to be unreadable
+    are left out of the queries.
     """
-    
+    marc_columns, mara_columns = usable_columns()
+
+    def read(table, columns, where, fetch):
+        if cache is None:
+            return fetch()
+        return cache.read(table, columns, where, fetch, refresh)
+
+    def fetch_marc():
+        df = fetch_plants(db, "MARC", marc_columns, "WERKS", workers, matnr_splits)
+        print("Data retrieved from MARC table.")
+        return df
+
+    def fetch_mara():
+        strategy = choose_join_strategy(len(keys), max_semijoin_keys)
+        print(f"{len(keys)} distinct materials in MARC, fetching MARA with a {strategy}.")
+        if strategy == "join":
+            conn = db.get()
+            with span("read_sql", table="MARA"):
+                df = compact_frame(pd.read_sql(build_select("MARA", mara_columns, MARA_WHERE), conn))
+        elif workers > 1 and keys:
+            df = run_partitions(semijoin_partitions(mara_sql(mara_columns), "MATNR", keys), workers)
+        else:
+            df = fetch_semijoin(db.get(), mara_sql(mara_columns), "MATNR", keys)
+        print("Data retrieved from MARA table.")
+        return df
+
+    df_marc = read("MARC", marc_columns, MARC_WHERE, fetch_marc)
+    keys = df_marc["MATNR"].dropna().unique().tolist()
+    df_mara = read("MARA", mara_columns, MARA_WHERE, fetch_mara)
+    return df_marc, df_mara
+
+def run_polars(db, cache, refresh=False, workers=1, matnr_splits=()):
+    """
+    Polars engine: reads MARC and MARA as Arrow tables (or scans their cached Parquet files)
+    and runs the MARA join, the renames and the NM formatting as one lazy query plan.
+    MARA is always read with the MARC subquery filter, so the join itself happens in Polars.
+    """
+    marc_columns, mara_columns = usable_columns()
+
+    def fetch_marc():
+        result = motor_polars.fetch_plants_arrow(db, "MARC", marc_columns, "WERKS", workers, matnr_splits)
+        print("Data retrieved from MARC table.")
+        return result
+
+    def fetch_mara():
+        with span("read_arrow", table="MARA"):
+            result = motor_polars.fetch_arrow(db.get(), build_select("MARA", mara_columns, MARA_WHERE))
+        print("Data retrieved from MARA table.")
+        return result
+
+    marc = motor_polars.read_lazy(cache, "MARC", marc_columns, MARC_WHERE, fetch_marc, refresh)
+    mara = motor_polars.read_lazy(cache, "MARA", mara_columns, MARA_WHERE, fetch_mara, refresh)
+    return motor_polars.transform_marc_mara(marc, mara)
+
+def run_streaming(conn, batch_size, max_semijoin_keys):
+    """
+    Fetches MARC in batches of batch_size rows, transforms each batch and appends it
+    straight to the Excel output, so only one batch is held in memory at a time.
+    """
+    sql, df_mara = plan_mara_lookup(conn, max_semijoin_keys)
+
+    stats = ExtractionStats("MARC streaming extraction")
+    writer = ExcelStreamWriter(OUTPUT_FILE, "Transformed")
+    try:
+        for batch in iter_batches(conn, sql, batch_size):
+            writer.write_batch(transform(batch, df_mara))
+            stats.add(len(batch))
+    finally:
+        writer.close()
+    stats.report()
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract MARC/MARA replenishment parameters.")
+    parser.add_argument("--stream", action="store_true",
+                        help="fetch MARC with cursor.fetchmany and write each batch as it arrives")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"rows per fetchmany call in streaming mode (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--max-semijoin-keys", type=int, default=DEFAULT_MAX_SEMIJOIN_KEYS,
+                        help="above this many MARC materials, join MARA on the server instead of "
+                             f"fetching it with MATNR IN (...) batches (default: {DEFAULT_MAX_SEMIJOIN_KEYS})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="query the DSN directly instead of reading through the local cache")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="ignore cached extracts and store fresh ones")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="split MARC per plant and the MARA batches across this many parallel connections")
+    parser.add_argument("--matnr-splits", default="",
+                        help="comma-separated MATNR boundaries to further split each plant partition")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="library doing the join and formatting; polars runs them as one "
+                             f"multi-threaded lazy query (default: {DEFAULT_ENGINE})")
+    args = parser.parse_args()
+    matnr_splits = parse_matnr_splits(args.matnr_splits)
+    if args.engine == "polars" and motor_polars.pl is None:
+        parser.error("--engine polars needs the polars package")
+    if args.engine == "polars" and args.stream:
+        parser.error("--stream writes pandas batches; use it with --engine pandas")
+
+    db = LazyConnection()
+
+    if args.engine == "polars":
+        try:
+            cache = None if args.no_cache else SnapshotCache()
+            lazy = run_polars(db, cache, args.refresh_cache, args.workers, matnr_splits)
+            df = motor_polars.collect(lazy)
+            print("Data retrieved from MARC and MARA tables.")
+        except Exception as e:
+            print("Error retrieving data:", e)
+            return
+        finally:
+            db.close()
+        write_report(df, OUTPUT_FILE, "Transformed")
+        print(f"Transformed MARC data saved as '{OUTPUT_FILE}'.")
+        TRACER.finish("1_parametros_de_ressuprimento_MARC")
+        return
+
+    if args.stream:
+        # Streaming keeps memory flat, so it always reads MARC straight from the DSN.
+        try:
+            run_streaming(db.get(), args.batch_size, args.max_semijoin_keys)
+        except Exception as e:
+            print("Error retrieving data:", e)
+            return
+        finally:
+            db.close()
+        print(f"Transformed MARC data saved as '{OUTPUT_FILE}'.")
+        TRACER.finish("1_parametros_de_ressuprimento_MARC")
+        return
+
     try:
-        df_marc = pd.read_sql(sql_marc, conn)
-        df_mara = pd.read_sql(sql_mara, conn)
+        if args.no_cache and args.workers <= 1 and not matnr_splits:
+            conn = db.get()
+            sql, df_mara = plan_mara_lookup(conn, args.max_semijoin_keys)
+            with span("read_sql", table="MARC"):
+                df_marc = compact_frame(pd.read_sql(sql, conn))
+        else:
+            cache = None if args.no_cache else SnapshotCache()
+            df_marc, df_mara = read_extracts(db, cache, args.max_semijoin_keys, args.refresh_cache,
+                                             args.workers, matnr_splits)
         print("Data retrieved from MARC and MARA tables.")
     except Exception as e:
         print("Error retrieving data:", e)
-        conn.close()
         return
     finally:
-        conn.close()
-    
-    # Merge MARC and MARA using WERKS and MATNR as keys
-    df = df_marc.merge(df_mara, on='MATNR', how='left')
-    
-    # Rename columns
-    df = df.rename(columns={
-        "WERKS": "Centro",
-        "MATNR": "NM",
-        "DISGR": "Grupo MRP",
-        "DISMM": "Tipo de MRP",
-        "MEINS": "Unid.medida basica",
-        "DISLS": "RegraCalcTamLotes",
-        "MINBE": "PR",
-        "MABST": "EM",
-        "VSPVB": "SupM",
-        "PLIFZ": "Lead time",
-        "LGRAD": "Grau atend. (%)"
-    })
-    
-    # Apply the NM formatting function
-    df["NM"] = df["NM"].apply(format_nm)
-    
+        db.close()
+
+    df = transform(df_marc, df_mara)
+
     # Save to Excel
-    output_file = "parametros_de_ressuprimento_MARC.xlsx"
-    writer = pd.ExcelWriter(output_file, engine="xlsxwriter")
-    df.to_excel(writer, sheet_name="Transformed", index=False)
-    
-    workbook = writer.book
-    worksheet = writer.sheets["Transformed"]
-    header_format = workbook.add_format({
-        "bold": True,
-        "text_wrap": True,
-        "valign": "top",
-        "fg_color": "#D7E4BC",
-        "border": 1
-    })
-    
-    # Format header and adjust column width
-    for col_num, col_name in enumerate(df.columns):
-        worksheet.write(0, col_num, col_name, header_format)
-        max_width = max(df[col_name].astype(str).apply(len).max(), len(col_name))
-        worksheet.set_column(col_num, col_num, max_width + 2)
-    
-    writer.close()
-    print(f"Transformed MARC data saved as '{output_file}'.")
+    write_report(df, OUTPUT_FILE, "Transformed")
+    print(f"Transformed MARC data saved as '{OUTPUT_FILE}'.")
+    TRACER.finish("1_parametros_de_ressuprimento_MARC")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,9 +1,23 @@
+import argparse
 import win32com.client
+import pythoncom
 import time
 import logging
 import os
+import queue
+import re
+import sys
+import threading
 import polars as pl
 import pandas as pd
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from diario_progresso import ProgressJournal
+from rastreamento import TRACER, TracedGuiObject, span, traced
+from saida_parquet import HISTORY_EXCEL_FILE, HISTORY_FILE, HISTORY_ODBC_FILE, parquet_to_excel, write_dataset
+from sap_espera import WaitEngine
+from valores_exibidos import type_display_columns
 
 # Configure logging to write to a file and the console.
 logging.basicConfig(
@@ -15,49 +29,182 @@ logging.basicConfig(
     ]
 )
 
+CENTERS = ["2914", "2096", "2032", "20AI", "20AF"]  # Lista de centros
+
+# Prefixo dos arquivos exportados; cada sessão usa o seu próprio (EXPORT_S1_<material>.xlsx)
+EXPORT_PREFIX = "EXPORT"
+
+# Sessões SAP GUI abertas na mesma conexão para dividir a lista de materiais.
+# O SAP limita a 6 sessões por conexão (rdisp/max_alt_modes).
+DEFAULT_SESSIONS = 4
+
+# Materiais colados de uma vez na seleção múltipla de EM_MATNR; cada lote é uma execução
+# e uma exportação da ME2M. Lotes maiores reduzem as idas ao SAP, mas geram relatórios maiores.
+DEFAULT_BATCH_SIZE = 50
+
+# As sessões SAP só conduzem a ME2M e entregam o resultado a uma fila limitada;
+# um grupo de leitores lê a exportação, marca o Material e grava no diário em paralelo.
+DEFAULT_PARSERS = 2
+DEFAULT_QUEUE_SIZE = 8
+
+# IDs dos controles usados como sinal de que cada tela está pronta
+EASY_ACCESS_TREE = "wnd[0]/usr/cntlIMAGE_CONTAINER/shellcont/shell/shellcont[0]/shell"
+SELECTION_TABLE = "wnd[1]/usr/tabsTAB_STRIP/tabpSIVA/ssubSCREEN_HEADER:SAPLALDB:3010/tblSAPLALDBSINGLE"
+
+# Grade ALV (GuiGridView) com o resultado da ME2M em "BEST ALV"
+RESULT_GRID = "wnd[0]/usr/cntlGRIDCONTROL/shellcont/shell"
+
+# Sem pedidos a ME2M fica na tela de seleção com esta mensagem na barra de status (em minúsculas,
+# português ou inglês); qualquer outra tela sem a lista é erro
+STATUS_BAR = "wnd[0]/sbar"
+NO_DATA_MESSAGES = ("nenhum documento", "no suitable")
+
+
+def normalize_material(material):
+    """
+    Chave de comparação do material: sem letras, só os dígitos sem zeros à esquerda, já que a
+    ME2M pode exibir o número com a máscara do perfil ("10.123.456"); com letras, o texto sem
+    zeros à esquerda.
+    """
+    material = str(material).strip()
+    if not re.search("[A-Za-z]", material):
+        material = re.sub(r"\D", "", material)
+    return material.lstrip("0")
+
+
+def material_keys(values):
+    """normalize_material aplicada a uma coluna inteira."""
+    text = values.cast(pl.Utf8).str.strip_chars()
+    return pl.select(
+        pl.when(text.str.contains("[A-Za-z]")).then(text).otherwise(text.str.replace_all(r"\D", ""))
+        .str.strip_chars_start("0")
+    ).to_series()
+
+
+def split_by_material(df, materials):
+    """
+    Separa a exportação de um lote em {material: DataFrame} pela coluna "Material",
+    comparando com normalize_material. Materiais sem pedidos ficam de fora; linhas que não são
+    de nenhum material do lote também, e quem chama compara as contagens.
+    """
+    if len(materials) == 1 and "Material" not in df.columns:
+        return {materials[0]: df.with_columns(pl.lit(materials[0]).alias("Material"))}
+    if "Material" not in df.columns:
+        logging.error("Export has no 'Material' column; cannot split batch of %s materials.", len(materials))
+        return {}
+
+    keys = material_keys(df["Material"])
+    results = {}
+    for material in materials:
+        rows = df.filter(keys == normalize_material(material))
+        if rows.height:
+            results[material] = rows.with_columns(pl.lit(material).alias("Material"))
+    return results
+
+
 class SAPAutomation:
 
-    def connect_to_sap(self):
+    def __init__(self, use_grid=True):
+        self.waits = WaitEngine()
+        # Ler o resultado direto da grade ALV; a exportação para .xlsx fica como alternativa
+        self.use_grid = use_grid
+
+    def get_connection(self):
+        sap_gui = win32com.client.GetObject("SAPGUI")
+        application = sap_gui.GetScriptingEngine
+        return application.Children(0)
+
+    @traced("connect_to_sap")
+    def connect_to_sap(self, session_index=0):
         try:
-            sap_gui = win32com.client.GetObject("SAPGUI")
-            application = sap_gui.GetScriptingEngine
-            session = application.Children(0).Children(0)
-            logging.info("Connected to SAP session successfully.")
+            session = self.get_connection().Children(session_index)
+            logging.info("Connected to SAP session %s successfully.", session_index)
             return session
         except Exception as e:
             logging.error("Error connecting to SAP: %s", e)
             raise Exception("Unable to connect to SAP GUI. Ensure SAP is running and scripting is enabled.") from e
 
-    def execute_transaction(self, session, material, centers):
+    def open_sessions(self, count, timeout=30):
+        """Abre sessões na conexão atual até existirem `count` e retorna quantas estão disponíveis."""
+        connection = self.get_connection()
+        while connection.Children.Count < count:
+            before = connection.Children.Count
+            try:
+                connection.Children(0).CreateSession()
+            except Exception as e:
+                logging.warning("Could not open a new SAP session: %s", e)
+                break
+            deadline = time.time() + timeout
+            while connection.Children.Count <= before and time.time() < deadline:
+                time.sleep(0.5)
+            if connection.Children.Count <= before:
+                logging.warning("Timed out waiting for SAP session %s to open.", before)
+                break
+        available = min(count, connection.Children.Count)
+        logging.info("%s SAP sessions available.", available)
+        return available
+
+    def fill_selection(self, session, values):
+        """Preenche a tabela da janela de seleção múltipla, rolando quando passa das linhas visíveis."""
+        table = session.findById(SELECTION_TABLE)
+        visible = max(1, table.visibleRowCount)
+        position = 0
+        for i, value in enumerate(values):
+            if i - position >= visible:
+                # Rolar para o próximo bloco; os índices das células são relativos à área visível
+                position = i
+                table.verticalScrollbar.position = position
+                table = self.waits.wait_for_control(session, SELECTION_TABLE, "rolar seleção")
+            field_path = f"{SELECTION_TABLE}/ctxtRSCSEL_255-SLOW_I[1,{i - position}]"
+            session.findById(field_path).text = value
+            session.findById(field_path).setFocus()
+            session.findById(field_path).caretPosition = len(value)
+
+    def execute_transaction(self, session, materials, centers, export_prefix=EXPORT_PREFIX, label=None):
+        """
+        Executa a ME2M para um lote de materiais e retorna a grade lida como DataFrame, o caminho
+        da planilha exportada (ver load_result) ou None.
+        Um único material vai direto em EM_MATNR-LOW; um lote vai pela seleção múltipla.
+        """
+        if isinstance(materials, str):
+            materials = [materials]
+        label = label or materials[0]
         try:
-            logging.info(f"Starting transaction ME2M for material {material} and centers {centers}.")
+            logging.info(f"Starting transaction ME2M for {len(materials)} material(s) ({label}) and centers {centers}.")
             
             # Garantir que estamos na tela inicial
             session.findById("wnd[0]/tbar[0]/btn[3]").press()
-            time.sleep(2)
+            tree = self.waits.wait_for_control(session, EASY_ACCESS_TREE, "tela inicial")
             
             # Abrir a transação ME2M
             session.findById("wnd[0]").resizeWorkingPane(99, 38, 0)
-            session.findById("wnd[0]/usr/cntlIMAGE_CONTAINER/shellcont/shell/shellcont[0]/shell").doubleClickNode("F00003")
+            tree.doubleClickNode("F00003")
+            self.waits.wait_for_control(session, "wnd[0]/usr/ctxtEM_MATNR-LOW", "abrir ME2M")
             
-            # Definir o número do material
-            session.findById("wnd[0]/usr/ctxtEM_MATNR-LOW").text = material
-            session.findById("wnd[0]/usr/ctxtEM_MATNR-LOW").caretPosition = len(material)
+            if len(materials) == 1:
+                # Definir o número do material
+                material = materials[0]
+                session.findById("wnd[0]/usr/ctxtEM_MATNR-LOW").text = material
+                session.findById("wnd[0]/usr/ctxtEM_MATNR-LOW").caretPosition = len(material)
+            else:
+                # Colar o lote na seleção múltipla de materiais
+                session.findById("wnd[0]/usr/btn%_EM_MATNR_%_APP_%-VALU_PUSH").press()
+                self.waits.wait_for_control(session, SELECTION_TABLE, "seleção de materiais")
+                self.fill_selection(session, materials)
+                session.findById("wnd[1]/tbar[0]/btn[8]").press()
+                # Os controles da wnd[0] existem com o popup ainda aberto: esperar ele fechar
+                self.waits.wait_for_window_closed(session, "confirmar materiais")
             
             # Abrir a janela de seleção de centros
             session.findById("wnd[0]/usr/btn%_EM_WERKS_%_APP_%-VALU_PUSH").press()
-            time.sleep(1)
+            self.waits.wait_for_control(session, SELECTION_TABLE, "seleção de centros")
             
             # Selecionar os centros
-            for i, center in enumerate(centers):
-                field_path = f"wnd[1]/usr/tabsTAB_STRIP/tabpSIVA/ssubSCREEN_HEADER:SAPLALDB:3010/tblSAPLALDBSINGLE/ctxtRSCSEL_255-SLOW_I[1,{i}]"
-                session.findById(field_path).text = center
-                session.findById(field_path).setFocus()
-                session.findById(field_path).caretPosition = len(center)
+            self.fill_selection(session, centers)
             
             # Confirmar seleção
             session.findById("wnd[1]/tbar[0]/btn[8]").press()
-            time.sleep(1)
+            self.waits.wait_for_window_closed(session, "confirmar centros")
             
             # Definir "Abrangência da lista"
             session.findById("wnd[0]/usr/ctxtLISTU").text = "BEST ALV"
@@ -66,92 +213,428 @@ class SAPAutomation:
             
             # Executar a transação
             session.findById("wnd[0]/tbar[1]/btn[8]").press()
-            logging.info(f"Transaction ME2M completed for material {material} and centers {centers}.")
-            time.sleep(2)
+            self.waits.wait_idle(session, "executar ME2M")
+            logging.info(f"Transaction ME2M completed for {label} and centers {centers}.")
             
-            # Exportar a planilha e armazenar na memória
-            return self.export_spreadsheet(session, material)
+            # Sem pedidos a ME2M permanece na tela de seleção, sem o botão de exportação.
+            # O DataFrame vazio distingue "sem pedidos" de um erro (None), que é repetido
+            if session.findById("wnd[0]/tbar[1]/btn[43]", False) is None:
+                if no_orders_listed(session):
+                    logging.warning(f"No purchase orders listed for {label}.")
+                    return pl.DataFrame()
+                logging.error(f"ME2M showed no list for {label}: {status_message(session)!r}")
+                return None
+            
+            if self.use_grid:
+                df = self.read_grid(session)
+                if df is not None:
+                    # Voltar para a tela de seleção, como depois da exportação
+                    session.findById("wnd[0]/tbar[0]/btn[3]").press()
+                    self.waits.wait_idle(session, "fechar lista")
+                    return df
+                logging.warning(f"Could not read the ALV grid for {label}; falling back to the spreadsheet export.")
+            
+            # Exportar a planilha; a leitura fica com os leitores do pipeline
+            return self.export_spreadsheet(session, label, export_prefix)
             
         except Exception as e:
             logging.error("Error executing transaction: %s", e)
             return None
 
-    def export_spreadsheet(self, session, material):
+    @traced("grid read")
+    def read_grid(self, session):
+        """
+        Lê a grade ALV do resultado direto pelo GuiGridView, sem passar pelo disco.
+        As linhas são carregadas por blocos (firstVisibleRow); retorna None se a grade não puder ser lida.
+        """
+        try:
+            grid = session.findById(RESULT_GRID, False)
+            if grid is None:
+                return None
+            order = grid.ColumnOrder
+            columns = [order(i) for i in range(order.Count)]
+
+            # Os títulos exibidos são os mesmos cabeçalhos da planilha exportada
+            titles = []
+            for column in columns:
+                title = grid.GetDisplayedColumnTitle(column) or column
+                while title in titles:
+                    title = f"{title}_{column}"
+                titles.append(title)
+
+            # GetCellValue devolve o texto exibido; o tipo da coluna diz como convertê-lo
+            data_types = []
+            for column in columns:
+                try:
+                    data_types.append(grid.GetColumnDataType(column))
+                except Exception:
+                    data_types.append(None)
+
+            row_count = grid.RowCount
+            block = max(1, grid.VisibleRowCount)
+            values = [[] for _ in columns]
+            for start in range(0, row_count, block):
+                # Rolar a grade faz o SAP GUI carregar o bloco de linhas
+                grid.firstVisibleRow = start
+                for row in range(start, min(start + block, row_count)):
+                    for i, column in enumerate(columns):
+                        values[i].append(grid.GetCellValue(row, column))
+
+            logging.info(f"Read {row_count} rows x {len(columns)} columns from the ALV grid.")
+            df = pl.DataFrame({title: column_values for title, column_values in zip(titles, values)},
+                              schema={title: pl.Utf8 for title in titles})
+            return type_display_columns(df, data_types)
+        except Exception as e:
+            logging.warning("Error reading the ALV grid: %s", e)
+            return None
+
+    def export_spreadsheet(self, session, material, export_prefix=EXPORT_PREFIX):
         try:
             logging.info("Exporting spreadsheet from SAP.")
             
             # Clicar no botão de exportação
             session.findById("wnd[0]/tbar[1]/btn[43]").press()
-            time.sleep(2)
+            self.waits.wait_for_control(session, "wnd[1]/tbar[0]/btn[0]", "diálogo de exportação")
             
             # Selecionar formato de planilha
             session.findById("wnd[1]/tbar[0]/btn[0]").press()
-            time.sleep(2)
+            self.waits.wait_for_control(session, "wnd[1]/usr/ctxtDY_FILENAME", "formato da planilha")
             
             # Nome temporário para manter apenas na memória
-            temp_filename = f"EXPORT_{material}.xlsx"
+            temp_filename = f"{export_prefix}_{material}.xlsx"
             
             file_field = "wnd[1]/usr/ctxtDY_FILENAME"
             try:
                 file_input = session.findById(file_field)
                 file_input.text = temp_filename
                 file_input.caretPosition = len(temp_filename)
-                time.sleep(1)
             except Exception:
                 logging.error("Filename field not found. Check SAP GUI Scripting Recorder for correct ID.")
                 return None
             
+            # Confirmar exportação
+            # O SAP grava o arquivo na pasta do campo DY_PATH (ou na pasta atual, se não houver)
+            path_input = session.findById("wnd[1]/usr/ctxtDY_PATH", False)
+            export_path = os.path.join(path_input.text, temp_filename) if path_input is not None and path_input.text else temp_filename
+            
             # Confirmar exportação
             session.findById("wnd[1]/tbar[0]/btn[11]").press()
-            time.sleep(5)  # Espera extra para garantir que o SAP conclua a exportação
+            # Esperar o arquivo aparecer e parar de crescer
+            self.waits.wait_for_file(export_path, "gravar exportação")
+            self.waits.wait_for_window_closed(session, "fechar diálogo de exportação")
             
-            logging.info(f"Spreadsheet export completed successfully: {temp_filename}")
+            logging.info(f"Spreadsheet export completed successfully: {export_path}")
             
             # Fechar janela de exportação
             session.findById("wnd[0]/tbar[0]/btn[3]").press()
-            time.sleep(2)
+            self.waits.wait_idle(session, "fechar exportação")
             
-            return temp_filename
+            return export_path
             
         except Exception as e:
             logging.error("Error exporting spreadsheet: %s", e)
             return None
 
 
+def status_message(session):
+    sbar = session.findById(STATUS_BAR, False)
+    return (sbar.Text or "") if sbar is not None else ""
+
+
+def no_orders_listed(session):
+    """
+    True se a ME2M ficou sem lista por não haver pedidos: nenhum popup (wnd[1]) aberto e a
+    mensagem de "nenhum documento" na barra de status, que não é de erro.
+    """
+    if session.findById("wnd[1]", False) is not None:
+        return False
+    sbar = session.findById(STATUS_BAR, False)
+    if sbar is None or sbar.MessageType in ("E", "A"):
+        return False
+    text = (sbar.Text or "").lower()
+    return any(message in text for message in NO_DATA_MESSAGES)
+
+
+def load_result(result):
+    """
+    Retorna o DataFrame de um resultado de execute_transaction, lendo e removendo a exportação.
+    None indica erro; um DataFrame vazio, que a ME2M não listou pedidos.
+    """
+    if result is None or isinstance(result, pl.DataFrame):
+        return result
+    if not os.path.exists(result):
+        return None
+    with span("read_excel", file=result):
+        df = pl.read_excel(result)
+    os.remove(result)  # Remover arquivo temporário após leitura
+    return df
+
+
+class PipelineStats:
+    """Tempos por etapa e profundidade da fila, para saber se o gargalo é o SAP ou a leitura."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.depths = []
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.durations[stage].append(seconds)
+
+    def sample_depth(self, depth):
+        with self.lock:
+            self.depths.append(depth)
+
+    def log_report(self):
+        for stage, values in self.durations.items():
+            logging.info("Stage '%s': %s items, total %.1f s, mean %.2f s, max %.2f s.",
+                         stage, len(values), sum(values), sum(values) / len(values), max(values))
+        if self.depths:
+            logging.info("Queue depth: mean %.1f, max %s over %s puts.",
+                         sum(self.depths) / len(self.depths), max(self.depths), len(self.depths))
+        # Sessões esperando a fila cheia indicam leitura lenta; leitores esperando a fila vazia, SAP lento
+        put_wait = sum(self.durations.get("sap: queue full", []))
+        get_wait = sum(self.durations.get("parse: queue empty", []))
+        bottleneck = "parsing" if put_wait > get_wait else "SAP GUI"
+        logging.info("Bottleneck: %s (sessions blocked %.1f s, parsers idle %.1f s).", bottleneck, put_wait, get_wait)
+
+
+def harvest_materials(session_index, materials, centers, work_queue, stats,
+                      batch_size=DEFAULT_BATCH_SIZE, use_grid=True):
+    """
+    Executa a ME2M em lotes de batch_size materiais na sessão indicada e entrega
+    (lote, resultado) à fila de leitura, sem esperar o resultado ser lido.
+    """
+    # Cada thread precisa inicializar o COM antes de acessar o SAP GUI.
+    pythoncom.CoInitialize()
+    try:
+        automation = SAPAutomation(use_grid)
+        # Cada passo do SAP GUI (findById, press, sendVKey...) vira um span do rastreamento
+        session = TracedGuiObject(automation.connect_to_sap(session_index))
+        export_prefix = f"{EXPORT_PREFIX}_S{session_index}"
+
+        for start in range(0, len(materials), batch_size):
+            batch = materials[start:start + batch_size]
+            label = batch[0] if len(batch) == 1 else f"LOTE{start // batch_size + 1}"
+            started = time.perf_counter()
+            with span("ME2M batch", label=label, materials=len(batch)):
+                result = automation.execute_transaction(session, batch, centers, export_prefix, label)
+            stats.add("sap: transaction", time.perf_counter() - started)
+
+            started = time.perf_counter()
+            work_queue.put((batch, result))
+            stats.add("sap: queue full", time.perf_counter() - started)
+            stats.sample_depth(work_queue.qsize())
+
+        # Tempo efetivamente esperado em cada etapa
+        automation.waits.log_summary()
+    finally:
+        pythoncom.CoUninitialize()
+
+
+def parse_results(work_queue, journal, stats):
+    """
+    Lê os resultados da fila até receber None: carrega a exportação, separa por material
+    e grava no diário. Retorna quantos materiais falharam.
+    """
+    failed = 0
+    while True:
+        started = time.perf_counter()
+        item = work_queue.get()
+        stats.add("parse: queue empty", time.perf_counter() - started)
+        if item is None:
+            return failed
+
+        batch, result = item
+        started = time.perf_counter()
+        # Um erro aqui não pode encerrar o leitor: sem leitores as sessões travariam na fila cheia
+        try:
+            failed += persist_result(batch, result, journal)
+        except Exception as e:
+            logging.error("Error persisting result for %s: %s", batch[0], e)
+            for material in batch:
+                try:
+                    journal.record_failed(material, f"persist error: {e}")
+                except Exception:
+                    pass
+            failed += len(batch)
+        stats.add("parse: read and persist", time.perf_counter() - started)
+
+
+def persist_result(batch, result, journal):
+    """Carrega o resultado de um lote, separa por material e grava no diário. Retorna quantos falharam."""
+    try:
+        df = load_result(result)
+    except Exception as e:
+        logging.error("Error reading result for %s: %s", batch[0], e)
+        df = None
+
+    if df is None:
+        for material in batch:
+            journal.record_failed(material, "execute_transaction returned None")
+        return len(batch)
+    if df.height == 0:
+        for material in batch:
+            journal.record_empty(material)
+        return 0
+
+    results = split_by_material(df, batch)
+
+    # Materiais ausentes da exportação só não têm pedidos se todas as linhas foram atribuídas;
+    # senão as linhas que sobraram podem ser deles e o lote precisa ser repetido
+    unattributed = df.height - sum(rows.height for rows in results.values())
+    if unattributed:
+        logging.error("%s of %s rows for %s could not be matched to a material of the batch.",
+                      unattributed, df.height, batch[0])
+    failed = 0
+    with span("persist batch", materials=len(batch)):
+        for material in batch:
+            if material in results:
+                journal.record_done(material, results[material])
+            elif unattributed:
+                journal.record_failed(material, f"{unattributed} rows not matched to a material")
+                failed += 1
+            else:
+                journal.record_empty(material)
+    return failed
+
+
+def history_from_odbc(excel=True):
+    """
+    Extrai o histórico de EKPO/EKKO com historico_odbc e grava HISTORY_FILE.
+    Retorna False quando o DSN nega alguma coluna da ME2M ou a consulta falha.
+    """
+    import historico_odbc
+
+    try:
+        df, denied = historico_odbc.extract_history(historico_odbc.read_materials(), CENTERS)
+    except Exception as e:
+        logging.error(f"ODBC order history failed, falling back to ME2M: {e}")
+        return False
+    if denied:
+        logging.info(f"ME2M columns denied by the DSN: {denied}. Falling back to ME2M.")
+        return False
+    historico_odbc.save_history(df, excel)
+    TRACER.finish("2_historico_de_pedidos", logging.info)
+    return True
+
+
+def history_from_file(path, excel=True):
+    """
+    Usa o histórico que historico_odbc.py gravou em path (no pipeline, numa etapa do DSN) como
+    HISTORY_FILE. Retorna False quando falta alguma coluna da ME2M, que então roda para a lista.
+    """
+    import historico_odbc
+
+    df = pd.read_parquet(path)
+    missing = historico_odbc.missing_me2m_columns(df)
+    if missing:
+        logging.info(f"ME2M columns missing from {path}: {missing}. Running ME2M.")
+        return False
+    historico_odbc.save_history(df, excel)
+    TRACER.finish("2_historico_de_pedidos", logging.info)
+    return True
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Histórico de pedidos (ME2M) para a lista de materiais.")
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS,
+                        help=f"sessões SAP GUI usadas em paralelo (padrão: {DEFAULT_SESSIONS})")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"materiais por execução da ME2M (padrão: {DEFAULT_BATCH_SIZE}; 1 = um por vez)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continuar a execução anterior: pula os materiais concluídos e repete os que falharam")
+    parser.add_argument("--export", action="store_true",
+                        help="sempre exportar a lista para .xlsx em vez de ler a grade ALV")
+    parser.add_argument("--parsers", type=int, default=DEFAULT_PARSERS,
+                        help=f"threads que leem e gravam os resultados (padrão: {DEFAULT_PARSERS})")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f"resultados aguardando leitura antes de as sessões pararem (padrão: {DEFAULT_QUEUE_SIZE})")
+    parser.add_argument("--no-excel", action="store_true",
+                        help=f"gravar só o {HISTORY_FILE}, sem gerar {HISTORY_EXCEL_FILE}")
+    parser.add_argument("--odbc", action="store_true",
+                        help="ler o histórico de EKPO/EKKO pelo DSN e usar a ME2M só se o DSN negar alguma coluna")
+    parser.add_argument("--odbc-file", default=None, metavar="PARQUET",
+                        help=f"usar o histórico já lido pelo historico_odbc.py (no pipeline, {HISTORY_ODBC_FILE}) "
+                             "e rodar a ME2M só se faltar alguma coluna nele")
+    args = parser.parse_args()
+
+    # Pelo DSN o histórico sai em poucas consultas; a ME2M fica para quando faltar alguma coluna
+    if args.odbc_file and history_from_file(args.odbc_file, not args.no_excel):
+        return
+    if args.odbc and not args.odbc_file and history_from_odbc(not args.no_excel):
+        return
+
     automation = SAPAutomation()
-    session = automation.connect_to_sap()
-    
+    automation.connect_to_sap()
+
     # Ler lista de materiais do arquivo Excel
     materials_file = os.path.join(os.getcwd(), "lista_de_NMs.xlsx")
     materials_df = pd.read_excel(materials_file)
     materials = materials_df["Minimum Lot Size[NM]"].astype(str).tolist()
-    
-    centers = ["2914", "2096", "2032", "20AI", "20AF"]  # Lista de centros
-    
-    merged_data = []
 
-    for material in materials:
-        temp_file = automation.execute_transaction(session, material, centers)
-        time.sleep(2)  # Pequena pausa para garantir que o sistema esteja pronto para o próximo material
-        
-        if temp_file and os.path.exists(temp_file):
-            df = pl.read_excel(temp_file)
-            df = df.with_columns(pl.lit(material).alias("Material"))
-            merged_data.append(df)
-            os.remove(temp_file)  # Remover arquivo temporário após leitura
-    
-    if merged_data:
-        final_df = pl.concat(merged_data)
-        final_path = os.path.join(os.getcwd(), "merged_data.xlsx")
-        final_df.write_excel(final_path)
-        logging.info(f"Merged data saved to {final_path}")
-    
-    input("Pressione Enter para encerrar o script e sair do SAP...")
+    centers = CENTERS
 
-if __name__ == "__main__":
-    main()
+    # O diário guarda cada material concluído; sem --resume começa do zero
+    journal = ProgressJournal()
+    if args.resume:
+        done = journal.completed()
+        pending = [material for material in materials if material not in done]
+        logging.info(f"Resuming: {len(materials) - len(pending)} materials already done, {len(pending)} pending.")
+    else:
+        journal.reset()
+        pending = materials
+
+    if pending:
+        # Dividir a lista de materiais entre as sessões disponíveis
+        sessions = automation.open_sessions(max(1, min(args.sessions, len(pending))))
+        shards = [pending[i::sessions] for i in range(sessions)]
+
+        work_queue = queue.Queue(maxsize=max(1, args.queue_size))
+        stats = PipelineStats()
+        parsers = max(1, args.parsers)
+
+        with ThreadPoolExecutor(max_workers=parsers) as parse_pool:
+            parse_futures = [parse_pool.submit(parse_results, work_queue, journal, stats) for _ in range(parsers)]
+            try:
+                with ThreadPoolExecutor(max_workers=sessions) as executor:
+                    futures = [executor.submit(harvest_materials, i, shard, centers, work_queue, stats,
+                                               max(1, args.batch_size), not args.export)
+                               for i, shard in enumerate(shards)]
+                    for future in futures:
+                        future.result()
+            finally:
+                # Um None por leitor encerra o pipeline depois do que já está na fila
+                for _ in parse_futures:
+                    work_queue.put(None)
+            failed = sum(future.result() for future in parse_futures)
 
+        stats.log_report()
+        if failed:
+            logging.warning(f"{failed} materials failed; run again with --resume to retry them.")
 
+    # Manter a ordem original da lista de materiais; um material por vez na memória
+    material_files = journal.files(materials)
 
+    if material_files:
+        history_path = os.path.join(os.getcwd(), HISTORY_FILE)
+        with span("parquet write"):
+            rows = write_dataset(material_files, history_path)
+        logging.info(f"Order history saved to {history_path} ({rows} rows).")
 
+        if not args.no_excel:
+            final_path = os.path.join(os.getcwd(), HISTORY_EXCEL_FILE)
+            with span("excel write"):
+                saved = parquet_to_excel(history_path, final_path)
+            if saved:
+                logging.info(f"Merged data saved to {final_path}")
+    
+    TRACER.finish("2_historico_de_pedidos", logging.info)
+
+    # Rodando pelo pipeline.py não há terminal para confirmar
+    if sys.stdin.isatty():
+        input("Pressione Enter para encerrar o script e sair do SAP...")
+
+if __name__ == "__main__":
+    main()
@@ -1,124 +1,246 @@
-import pyodbc
+import argparse
 import pandas as pd
 import os
 from datetime import datetime
 
-# Define a function to format the NM value.
-def format_nm(nm):
-    # Remove leading zeros.
-    s = str(nm).lstrip("0")
-    # If the remaining string is too short, return it as is.
-    if len(s) <= 6:
-        return s
-    prefix = s[:len(s)-6]
-    infix = s[len(s)-6:len(s)-3]
-    sufix = s[-3:]
-    return f"{prefix}.{infix}.{sufix}"
+from cache_local import SnapshotCache
+from catalogo_colunas import ColumnCatalog
+from extracao_odbc import (
+    DEFAULT_BATCH_SIZE,
+    MARC_COLUMNS,
+    MARC_WHERE,
+    PLANT_FILTER,
+    ExtractionStats,
+    LazyConnection,
+    build_select,
+    fetch_semijoin,
+    iter_batches,
+)
+from extracao_paralela import fetch_plants, parse_matnr_splits
+import motor_polars
+from motor_polars import DEFAULT_ENGINE, ENGINES
+from rastreamento import TRACER, span
+from relatorio_excel import ExcelStreamWriter, write_report
+from tipos_sap import DEFAULT_PRICE_DTYPE, PRICE_DTYPES, compact_frame, set_price_dtype
+from transformacoes import RENAME_MARC_MBEW, format_nm_series
 
-def main():
-    # Use the pre-configured DSN "TDVCPBIP" with an extra data source parameter.
-    connection_string = "DSN=TDVCPBIP;dataSource=S10231;"
-   
-    try:
-        conn = pyodbc.connect(connection_string)
-        print("Connected using DSN 'TDVCPBIP' with dataSource=S10231.")
-    except Exception as e:
-        print("Connection error:", e)
-        return
+# Columns of the MARC and MBEW extracts as read through the local cache.
+MARC_SELECTED = ['WERKS', 'MATNR', 'DISGR', 'DISMM', 'MINBE', 'MABST', 'VSPVB', 'PLIFZ', 'LGRAD']
+MBEW_COLUMNS = ['BWKEY', 'MATNR', 'VERPR', 'LFMON']
+MBEW_WHERE = f"BWKEY IN {PLANT_FILTER}"
+
+def marc_sql():
+    """MARC rows of the queried plants, with the columns the column catalog allows."""
+    return build_select("MARC", ColumnCatalog().usable_columns("MARC", MARC_SELECTED), MARC_WHERE)
 
-    # Define the SQL query for MARC table
-    sql_marc = """
-    SELECT
-        WERKS,
-        MATNR,
-        DISGR,
-        DISMM,
-        MINBE,
-        MABST,
-        VSPVB,
-        PLIFZ,
-        LGRAD
-    FROM MARC
-    WHERE WERKS IN ('2032','2096','2914')
+def mbew_sql(where=MBEW_WHERE):
     """
-   
-    try:
-        df_marc = pd.read_sql(sql_marc, conn)
-        print("Data retrieved from MARC table.")
-    except Exception as e:
-        print("Error retrieving data from MARC:", e)
-        conn.close()
-        return
-    
-    # Define the SQL query for MBEW table
-    sql_mbew = """
-    SELECT
-        BWKEY AS WERKS,
-        MATNR,
-        VERPR,
-        LFMON
-    FROM MBEW
-    WHERE BWKEY IN ('2032','2096','2914')
+    MBEW rows with BWKEY read as WERKS, with the columns the column catalog allows.
+    With where="" it is the base query of the streaming lookup, which appends its own filters.
     """
-    
-    try:
-        df_mbew = pd.read_sql(sql_mbew, conn)
-        print("Data retrieved from MBEW table.")
-    except Exception as e:
-        print("Error retrieving data from MBEW:", e)
-        conn.close()
-        return
-    finally:
-        conn.close()
-    
+    columns = ColumnCatalog().usable_columns("MBEW", MBEW_COLUMNS)
+    select_list = ", ".join("[BWKEY] AS WERKS" if col == "BWKEY" else f"[{col}]" for col in columns)
+    sql = f"SELECT {select_list} FROM MBEW"
+    if where:
+        sql += f" WHERE {where}"
+    return sql
+
+def transform(df_marc, df_mbew):
     # Merge MARC and MBEW dataframes on WERKS and MATNR
-    df = df_marc.merge(df_mbew, on=["WERKS", "MATNR"], how="left")
-    
+    with span("merge"):
+        df = df_marc.merge(df_mbew, on=["WERKS", "MATNR"], how="left")
+
     # Rename the columns as per the transformation.
-    df = df.rename(columns={
-        "MATNR": "NM",
-        "DISGR": "Grupo MRP",
-        "DISMM":"Tipo de MRP",
-        "MINBE": "PR",
-        "MABST": "EM",
-        "VSPVB": "SupM",
-        "PLIFZ": "Lead time",
-        "LGRAD": "Grau atend. (%)",
-        # "VERPR": "Preço médio móvel",
-        # "LFMON": "Mês de avaliação"
-    })
-    
+    df = df.rename(columns=RENAME_MARC_MBEW)
+
     # Apply the custom NM formatting function to the "NM" column.
-    df["NM"] = df["NM"].apply(format_nm)
-   
+    df["NM"] = format_nm_series(df["NM"])
+    return df
+
+def get_output_file():
     # Define output file path with today's date
     today_date = datetime.today().strftime('%Y-%m-%d')
     output_folder = "deliver"
     os.makedirs(output_folder, exist_ok=True)
-    output_file = os.path.join(output_folder, f"parametros_de_ressuprimento_{today_date}.xlsx")
-    
-    # Save the result to an Excel file with formatting.
-    writer = pd.ExcelWriter(output_file, engine="xlsxwriter")
-    df.to_excel(writer, sheet_name="Transformed", index=False)
-   
-    workbook = writer.book
-    worksheet = writer.sheets["Transformed"]
-    header_format = workbook.add_format({
-        "bold": True,
-        "text_wrap": True,
-        "valign": "top",
-        "fg_color": "#D7E4BC",
-        "border": 1
-    })
-   
-    # Apply formatting to the header and auto-adjust column widths.
-    for col_num, col_name in enumerate(df.columns):
-        worksheet.write(0, col_num, col_name, header_format)
-        max_width = max(df[col_name].astype(str).apply(len).max(), len(col_name))
-        worksheet.set_column(col_num, col_num, max_width + 2)
-   
-    writer.close()  # Use close() instead of save() to finalize the file.
+    return os.path.join(output_folder, f"parametros_de_ressuprimento_{today_date}.xlsx")
+
+def read_extracts(db, cache, refresh=False, workers=1, matnr_splits=()):
+    """
+    Reads MARC and MBEW, through the local cache unless cache is None, connecting only on a miss.
+    MARC is cached with the columns script 1 needs as well, so both scripts share it.
+    With workers > 1, each miss is split per plant over a connection pool.
+    Columns the column catalog knows to be unreadable are left out of the queries.
+    """
+    catalog = ColumnCatalog()
+    marc_columns = catalog.usable_columns("MARC", MARC_COLUMNS)
+    mbew_columns = catalog.usable_columns("MBEW", MBEW_COLUMNS)
+
+    def read(table, columns, where, fetch):
+        if cache is None:
+            return fetch()
+        return cache.read(table, columns, where, fetch, refresh)
+
+    def fetch_marc():
+        df = fetch_plants(db, "MARC", marc_columns, "WERKS", workers, matnr_splits)
+        print("Data retrieved from MARC table.")
+        return df
+
+    def fetch_mbew():
+        df = fetch_plants(db, "MBEW", mbew_columns, "BWKEY", workers, matnr_splits)
+        print("Data retrieved from MBEW table.")
+        return df
+
+    df_marc = read("MARC", marc_columns, MARC_WHERE, fetch_marc)
+    df_marc = df_marc[[col for col in MARC_SELECTED if col in df_marc.columns]]
+    df_mbew = read("MBEW", mbew_columns, MBEW_WHERE, fetch_mbew)
+    return df_marc, df_mbew.rename(columns={"BWKEY": "WERKS"})
+
+def run_polars(db, cache, refresh=False, workers=1, matnr_splits=()):
+    """
+    Polars engine: reads MARC and MBEW as Arrow tables (or scans their cached Parquet files)
+    and runs the MBEW join, the renames and the NM formatting as one lazy query plan.
+    """
+    catalog = ColumnCatalog()
+    marc_columns = catalog.usable_columns("MARC", MARC_COLUMNS)
+    mbew_columns = catalog.usable_columns("MBEW", MBEW_COLUMNS)
+
+    def fetch_marc():
+        result = motor_polars.fetch_plants_arrow(db, "MARC", marc_columns, "WERKS", workers, matnr_splits)
+        print("Data retrieved from MARC table.")
+        return result
+
+    def fetch_mbew():
+        result = motor_polars.fetch_plants_arrow(db, "MBEW", mbew_columns, "BWKEY", workers, matnr_splits)
+        print("Data retrieved from MBEW table.")
+        return result
+
+    marc = motor_polars.read_lazy(cache, "MARC", marc_columns, MARC_WHERE, fetch_marc, refresh)
+    marc = marc.select([col for col in MARC_SELECTED if col in marc_columns])
+    mbew = motor_polars.read_lazy(cache, "MBEW", mbew_columns, MBEW_WHERE, fetch_mbew, refresh)
+    return motor_polars.transform_marc_mbew(marc, mbew.rename({"BWKEY": "WERKS"}))
+
+def run_streaming(db, batch_size, output_file):
+    """
+    Fetches MARC in batches of batch_size rows and, for each batch, only the MBEW rows of its
+    materials (MATNR IN (...) batches on a second connection, as the first one is still reading
+    MARC). Each transformed batch is appended straight to the Excel output, so memory stays flat
+    on both sides of the join.
+    """
+    lookup = LazyConnection(db.connection_string)
+    sql_marc, sql_mbew = marc_sql(), mbew_sql(where="")
+    stats = ExtractionStats("MARC streaming extraction")
+    writer = ExcelStreamWriter(output_file, "Transformed")
+    try:
+        for batch in iter_batches(db.get(), sql_marc, batch_size):
+            keys = batch["MATNR"].dropna().unique().tolist()
+            with span("read_sql", table="MBEW", keys=len(keys)):
+                df_mbew = fetch_semijoin(lookup.get(), sql_mbew, "MATNR", keys, where=MBEW_WHERE)
+            writer.write_batch(transform(batch, df_mbew))
+            stats.add(len(batch))
+    finally:
+        writer.close()
+        lookup.close()
+    stats.report()
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract MARC/MBEW replenishment parameters.")
+    parser.add_argument("--stream", action="store_true",
+                        help="fetch MARC with cursor.fetchmany and write each batch as it arrives")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"rows per fetchmany call in streaming mode (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="query the DSN directly instead of reading through the local cache")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="ignore cached extracts and store fresh ones")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="split the MARC and MBEW queries per plant across this many parallel connections")
+    parser.add_argument("--matnr-splits", default="",
+                        help="comma-separated MATNR boundaries to further split each plant partition")
+    parser.add_argument("--price-dtype", choices=list(PRICE_DTYPES), default=DEFAULT_PRICE_DTYPE,
+                        help=f"how prices such as VERPR are held in memory (default: {DEFAULT_PRICE_DTYPE})")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="library doing the join and formatting; polars runs them as one "
+                             f"multi-threaded lazy query (default: {DEFAULT_ENGINE})")
+    args = parser.parse_args()
+    matnr_splits = parse_matnr_splits(args.matnr_splits)
+    set_price_dtype(args.price_dtype)
+    if args.engine == "polars" and motor_polars.pl is None:
+        parser.error("--engine polars needs the polars package")
+    if args.engine == "polars" and args.stream:
+        parser.error("--stream writes pandas batches; use it with --engine pandas")
+
+    db = LazyConnection()
+    output_file = get_output_file()
+
+    if args.engine == "polars":
+        try:
+            cache = None if args.no_cache else SnapshotCache()
+            lazy = run_polars(db, cache, args.refresh_cache, args.workers, matnr_splits)
+            df = motor_polars.collect(lazy)
+            print("Data retrieved from MARC and MBEW tables.")
+        except Exception as e:
+            print("Error retrieving data:", e)
+            return
+        finally:
+            db.close()
+        write_report(df, output_file, "Transformed")
+        print(f"Transformed MARC and MBEW data saved as '{output_file}'.")
+        TRACER.finish("3_parametros_de_ressuprimento_MARC_MBEW")
+        return
+
+    if args.stream:
+        # Streaming keeps memory flat, so it always reads MARC straight from the DSN.
+        try:
+            run_streaming(db, args.batch_size, output_file)
+        except Exception as e:
+            print("Error retrieving data:", e)
+            return
+        finally:
+            db.close()
+        print(f"Transformed MARC and MBEW data saved as '{output_file}'.")
+        TRACER.finish("3_parametros_de_ressuprimento_MARC_MBEW")
+        return
+
+    if not args.no_cache or args.workers > 1 or matnr_splits:
+        try:
+            cache = None if args.no_cache else SnapshotCache()
+            df_marc, df_mbew = read_extracts(db, cache, args.refresh_cache, args.workers, matnr_splits)
+        except Exception as e:
+            print("Error retrieving data:", e)
+            return
+        finally:
+            db.close()
+    else:
+        try:
+            conn = db.get()
+        except ConnectionError:
+            return
+
+        try:
+            with span("read_sql", table="MARC"):
+                df_marc = compact_frame(pd.read_sql(marc_sql(), conn))
+            print("Data retrieved from MARC table.")
+        except Exception as e:
+            print("Error retrieving data from MARC:", e)
+            conn.close()
+            return
+
+        try:
+            with span("read_sql", table="MBEW"):
+                df_mbew = compact_frame(pd.read_sql(mbew_sql(), conn))
+            print("Data retrieved from MBEW table.")
+        except Exception as e:
+            print("Error retrieving data from MBEW:", e)
+            conn.close()
+            return
+        finally:
+            conn.close()
+
+    df = transform(df_marc, df_mbew)
+
+    write_report(df, output_file, "Transformed")
     print(f"Transformed MARC and MBEW data saved as '{output_file}'.")
+    TRACER.finish("3_parametros_de_ressuprimento_MARC_MBEW")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,65 @@
+"""
+Compares the per-row format_nm with the vectorized pandas and Polars versions.
+
+Usage: python benchmarks/bench_format_nm.py [--sizes 10000,1000000,10000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformacoes import format_nm, format_nm_expr, format_nm_series, pl  # noqa: E402
+
+
+def make_matnrs(size, seed=0):
+    """
+    Builds MATNR values the way MARC returns them: 18 characters, zero padded, with a
+    share of short material numbers that must pass through unchanged.
+    """
+    rng = np.random.default_rng(seed)
+    numbers = rng.integers(1, 10 ** 11, size=size)
+    short = rng.random(size) < 0.1
+    numbers[short] = rng.integers(1, 10 ** 6, size=int(short.sum()))
+    return pd.Series(numbers.astype(str), dtype=object).str.zfill(18)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,1000000,10000000",
+                        help="comma-separated row counts (default: 10000,1000000,10000000)")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10}  {'apply (s)':>10}  {'pandas (s)':>10}  {'polars (s)':>10}  {'speedup':>8}")
+    for size in (int(value) for value in args.sizes.split(",")):
+        series = make_matnrs(size)
+
+        expected, apply_time = timed(lambda: series.apply(format_nm))
+        result, pandas_time = timed(lambda: format_nm_series(series))
+        if not result.equals(expected):
+            raise AssertionError(f"format_nm_series differs from format_nm at {size} rows")
+
+        polars_text = "n/a"
+        if pl is not None:
+            frame = pl.DataFrame({"NM": series.tolist()})
+            polars_result, polars_time = timed(lambda: frame.select(format_nm_expr("NM")))
+            if polars_result["NM"].to_list() != expected.tolist():
+                raise AssertionError(f"format_nm_expr differs from format_nm at {size} rows")
+            polars_text = f"{polars_time:10.3f}"
+
+        print(f"{size:>10}  {apply_time:10.3f}  {pandas_time:10.3f}  {polars_text:>10}  "
+              f"{apply_time / pandas_time:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+End-to-end benchmark of the extraction scripts against a fake DSN and a fake SAP GUI session.
+
+Builds synthetic MARC/MARA/MBEW/EKPO/EKKO tables in SQLite (benchmarks/fake_odbc.py), registers it
+as pyodbc together with a scriptable SAP GUI (benchmarks/fake_sap.py), then runs scripts 1 and 3,
+2_historico_de_pedidos, its ODBC counterpart historico_odbc, unificar_saidas and the column probe,
+each in its own empty folder.
+Reports wall time, the rows found in each target's output and the per-stage timings recorded by
+rastreamento. Fixtures (material lists, spreadsheets) are written before the timer starts.
+
+Usage: python benchmarks/bench_pipeline.py [--materials 20000] [--sap-materials 200]
+                                           [--targets script1,script3,historico,historico_odbc,unificar,probe]
+"""
+import argparse
+import builtins
+import contextlib
+import importlib
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_odbc  # noqa: E402
+import fake_sap  # noqa: E402
+
+TARGETS = ["script1", "script3", "historico", "historico_odbc", "unificar", "probe"]
+
+# Stages listed per target, slowest total first.
+TOP_STAGES = 8
+
+
+def run_script(module_name, argv, verbose=False):
+    """Imports a script and runs its main() with the given arguments; returns its console output."""
+    module = importlib.import_module(module_name)
+    output = io.StringIO()
+    sys.argv = [module_name + ".py"] + argv
+    with contextlib.redirect_stdout(sys.stdout if verbose else output):
+        module.main()
+    return output.getvalue()
+
+
+def bench_script1(args):
+    run_script("1_parametros_de_ressuprimento_MARC", ["--workers", str(args.workers)], args.verbose)
+    return "parametros_de_ressuprimento_MARC.xlsx"
+
+
+def bench_script3(args):
+    run_script("3_parametros_de_ressuprimento_MARC_MBEW", ["--workers", str(args.workers)], args.verbose)
+    folder = "deliver"
+    return os.path.join(folder, os.listdir(folder)[0]) if os.path.isdir(folder) else None
+
+
+def write_material_list(count):
+    materials = pd.read_sql(f"SELECT MATNR FROM MARA LIMIT {count}",
+                            fake_odbc.connect(None).db)["MATNR"].str.lstrip("0")
+    pd.DataFrame({"Minimum Lot Size[NM]": materials}).to_excel("lista_de_NMs.xlsx", index=False)
+
+
+def setup_historico(args):
+    write_material_list(args.sap_materials)
+
+
+def bench_historico(args):
+    original_input = builtins.input
+    builtins.input = lambda prompt="": ""
+    try:
+        argv = ["--sessions", str(args.sessions), "--batch-size", str(args.batch_size)]
+        if args.export:
+            argv.append("--export")
+        run_script("2_historico_de_pedidos", argv, args.verbose)
+    finally:
+        builtins.input = original_input
+    return "historico_de_pedidos.parquet"
+
+
+def setup_historico_odbc(args):
+    write_material_list(args.odbc_materials)
+
+
+def bench_historico_odbc(args):
+    run_script("historico_odbc", ["--workers", str(args.workers), "--no-excel"], args.verbose)
+    return "historico_de_pedidos.parquet"
+
+
+def setup_unificar(args):
+    os.makedirs("output", exist_ok=True)
+    for index in range(args.files):
+        frame = pd.DataFrame({
+            "Material": [f"{index:04d}{row:06d}" for row in range(args.rows_per_file)],
+            "Centro": "2032",
+            "Quantidade": range(args.rows_per_file),
+        })
+        frame.to_excel(os.path.join("output", f"arquivo_{index:03d}.xlsx"), index=False)
+
+
+def bench_unificar(args):
+    run_script("unificar_saidas", [], args.verbose)
+    folder = "deliver"
+    return os.path.join(folder, os.listdir(folder)[0]) if os.path.isdir(folder) else None
+
+
+def bench_probe(args):
+    run_script("verificacao_de_acesso_EKPO", ["EKPO", "--workers", str(args.workers)], args.verbose)
+    return os.path.join("cache", "catalogo_colunas.json")
+
+
+def count_rows(path):
+    """Rows in an output file; for the column catalog, the columns it records."""
+    if path.endswith(".parquet"):
+        return pq.read_metadata(path).num_rows
+    if path.endswith(".csv"):
+        with open(path, encoding="utf-8") as f:
+            return sum(1 for _ in f) - 1
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            return sum(len(entry["columns"]) for tables in json.load(f).values() for entry in tables.values())
+    return len(pd.read_excel(path))
+
+
+# target: (fixture builder run before the timer starts or None, timed run returning the output file)
+BENCHMARKS = {
+    "script1": (None, bench_script1),
+    "script3": (None, bench_script3),
+    "historico": (setup_historico, bench_historico),
+    "historico_odbc": (setup_historico_odbc, bench_historico_odbc),
+    "unificar": (setup_unificar, bench_unificar),
+    "probe": (None, bench_probe),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--materials", type=int, default=20000,
+                        help="materials in the synthetic tables (default: 20000)")
+    parser.add_argument("--orders-per-material", type=int, default=5,
+                        help="EKPO lines per material (default: 5)")
+    parser.add_argument("--targets", default=",".join(TARGETS),
+                        help=f"comma-separated targets to run (default: {','.join(TARGETS)})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="--workers passed to scripts 1 and 3, historico_odbc and the column probe (default: 1)")
+    parser.add_argument("--query-latency", type=float, default=0.0,
+                        help="seconds added to every fake ODBC query (default: 0)")
+    parser.add_argument("--forbidden", default="ZZ007,ZZ042,ZZ099",
+                        help="EKPO columns the fake DSN refuses (default: ZZ007,ZZ042,ZZ099)")
+    parser.add_argument("--sap-materials", type=int, default=200,
+                        help="materials in the lista_de_NMs.xlsx given to 2_historico (default: 200)")
+    parser.add_argument("--odbc-materials", type=int, default=5000,
+                        help="materials in the lista_de_NMs.xlsx given to historico_odbc (default: 5000)")
+    parser.add_argument("--rows-per-material", type=int, default=5,
+                        help="ME2M lines per material in the fake SAP GUI (default: 5)")
+    parser.add_argument("--gui-latency", type=float, default=1.0,
+                        help="multiplier applied to the fake SAP GUI latencies (default: 1.0)")
+    parser.add_argument("--sessions", type=int, default=4, help="SAP GUI sessions for 2_historico (default: 4)")
+    parser.add_argument("--batch-size", type=int, default=50, help="materials per ME2M run (default: 50)")
+    parser.add_argument("--export", action="store_true", help="run 2_historico with --export instead of the grid")
+    parser.add_argument("--files", type=int, default=20, help="spreadsheets in output/ for unificar_saidas (default: 20)")
+    parser.add_argument("--rows-per-file", type=int, default=5000,
+                        help="rows per spreadsheet for unificar_saidas (default: 5000)")
+    parser.add_argument("--keep", action="store_true", help="keep the work folder instead of deleting it")
+    parser.add_argument("--verbose", action="store_true", help="show the scripts' own output")
+    args = parser.parse_args()
+
+    targets = [target.strip() for target in args.targets.split(",") if target.strip()]
+    unknown = set(targets) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    database = os.path.join(work_dir, "fake_dsn.sqlite")
+    start = time.perf_counter()
+    counts = fake_odbc.build_database(database, args.materials, args.orders_per_material)
+    print(f"Synthetic DSN built in {time.perf_counter() - start:.1f} s: "
+          + ", ".join(f"{table} {rows}" for table, rows in counts.items()))
+
+    fake_odbc.install(database)
+    fake_odbc.QUERY_LATENCY = args.query_latency
+    fake_odbc.FORBIDDEN_COLUMNS = {col.strip() for col in args.forbidden.split(",") if col.strip()}
+    fake_sap.install({action: seconds * args.gui_latency for action, seconds in fake_sap.DEFAULT_LATENCIES.items()},
+                     args.rows_per_material)
+
+    # Imported after the fakes, so the scripts bind to them
+    from rastreamento import TRACER
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    # pandas warns about any DBAPI connection that is not sqlite3 itself, which the fake wraps
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+
+    results = []
+    original_dir = os.getcwd()
+    try:
+        for target in targets:
+            setup, bench = BENCHMARKS[target]
+            target_dir = os.path.join(work_dir, target)
+            os.makedirs(target_dir)
+            os.chdir(target_dir)
+            if setup is not None:
+                setup(args)
+            TRACER.reset()
+
+            started_at = time.time()
+            start = time.perf_counter()
+            output = bench(args)
+            elapsed = time.perf_counter() - start
+
+            # Only an output written by this run, with rows in it, counts as a success
+            ok = output is not None and os.path.exists(output) and os.path.getmtime(output) >= started_at
+            rows = count_rows(output) if ok else 0
+            ok = ok and rows > 0
+            os.chdir(original_dir)
+            results.append((target, ok, elapsed, rows))
+
+            print(f"\n{target}: {elapsed:.2f} s, {rows} rows, {rows / elapsed:,.0f} rows/s"
+                  + ("" if ok else "  (FAILED: no output produced, rerun with --verbose)"))
+            print(f"  {'stage':<38} {'count':>6} {'total s':>9} {'p50 s':>8} {'p95 s':>8}")
+            for name, (count, total, p50, p95, _) in list(TRACER.summary().items())[:TOP_STAGES]:
+                print(f"  {name[:38]:<38} {count:>6} {total:>9.2f} {p50:>8.3f} {p95:>8.3f}")
+    finally:
+        os.chdir(original_dir)
+        logging.disable(logging.NOTSET)
+
+    print(f"\n{'target':<14} {'ok':>4} {'seconds':>9} {'rows':>10} {'rows/s':>12}")
+    for target, ok, elapsed, rows in results:
+        print(f"{target:<14} {'yes' if ok else 'no':>4} {elapsed:>9.2f} {rows:>10} {rows / elapsed:>12,.0f}")
+
+    if args.keep:
+        print(f"\nWork folder kept at {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Checks that --engine polars produces the same deliverables as the pandas path in scripts 1 and 3.
+
+Runs both scripts with each engine against the fake DSN of benchmarks/fake_odbc.py, reading
+straight from the DSN, over parallel partitions and through the local cache (each engine reading
+an extract cached by the other), compares the Excel outputs cell by cell and reports wall times.
+Raises AssertionError on the first difference.
+
+Usage: python benchmarks/bench_polars_engine.py [--materials 20000] [--modes direct,parallel,cache]
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_odbc  # noqa: E402
+from bench_pipeline import run_script  # noqa: E402
+
+MODES = ["direct", "parallel", "cache"]
+
+SCRIPTS = {
+    "script1": "1_parametros_de_ressuprimento_MARC",
+    "script3": "3_parametros_de_ressuprimento_MARC_MBEW",
+}
+
+
+def output_file(script):
+    if script == "script1":
+        return "parametros_de_ressuprimento_MARC.xlsx"
+    return os.path.join("deliver", os.listdir("deliver")[0])
+
+
+def run(script, engine, argv, folder, verbose=False):
+    """Runs the script with the engine inside folder; returns (output DataFrame, seconds)."""
+    os.makedirs(folder, exist_ok=True)
+    original_dir = os.getcwd()
+    os.chdir(folder)
+    try:
+        start = time.perf_counter()
+        run_script(SCRIPTS[script], argv + ["--engine", engine], verbose)
+        elapsed = time.perf_counter() - start
+        path = output_file(script)
+        if os.path.exists(path):
+            df = pd.read_excel(path)
+            os.remove(path)
+        else:
+            df = None
+    finally:
+        os.chdir(original_dir)
+    return df, elapsed
+
+
+def compare(expected, result, label):
+    if expected is None or result is None:
+        raise AssertionError(f"{label}: no output produced, rerun with --verbose")
+    if list(expected.columns) != list(result.columns):
+        raise AssertionError(f"{label}: columns differ: {list(expected.columns)} != {list(result.columns)}")
+    if len(expected) != len(result):
+        raise AssertionError(f"{label}: {len(expected)} rows with pandas, {len(result)} with polars")
+    pd.testing.assert_frame_equal(expected, result, check_dtype=False, obj=label)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--materials", type=int, default=20000,
+                        help="materials in the synthetic tables (default: 20000)")
+    parser.add_argument("--modes", default=",".join(MODES),
+                        help=f"comma-separated read modes to compare (default: {','.join(MODES)})")
+    parser.add_argument("--workers", type=int, default=3, help="--workers of the parallel mode (default: 3)")
+    parser.add_argument("--keep", action="store_true", help="keep the work folder instead of deleting it")
+    parser.add_argument("--verbose", action="store_true", help="show the scripts' own output")
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+
+    work_dir = tempfile.mkdtemp(prefix="bench_polars_engine_")
+    database = os.path.join(work_dir, "fake_dsn.sqlite")
+    counts = fake_odbc.build_database(database, args.materials)
+    fake_odbc.install(database)
+    print("Synthetic DSN: " + ", ".join(f"{table} {rows}" for table, rows in counts.items()))
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+
+    # The MATNR boundary splits every plant partition in two
+    split = pd.read_sql("SELECT MATNR FROM MARC ORDER BY MATNR", fake_odbc.connect(None).db)["MATNR"]
+    parallel = ["--no-cache", "--workers", str(args.workers), "--matnr-splits", split.iloc[len(split) // 2]]
+
+    print(f"\n{'script':<8} {'mode':<10} {'rows':>8} {'pandas s':>9} {'polars s':>9} {'speedup':>8}")
+    try:
+        for script in SCRIPTS:
+            for mode in modes:
+                folder = os.path.join(work_dir, script, mode)
+                if mode == "cache":
+                    # pandas fills the cache polars scans, then the other way round in a second folder
+                    expected, pandas_time = run(script, "pandas", [], os.path.join(folder, "a"), args.verbose)
+                    result, polars_time = run(script, "polars", [], os.path.join(folder, "a"), args.verbose)
+                    compare(expected, result, f"{script} {mode} (cache written by pandas)")
+                    first, _ = run(script, "polars", [], os.path.join(folder, "b"), args.verbose)
+                    second, _ = run(script, "pandas", [], os.path.join(folder, "b"), args.verbose)
+                    compare(expected, first, f"{script} {mode} (polars filling the cache)")
+                    compare(expected, second, f"{script} {mode} (cache written by polars)")
+                else:
+                    argv = ["--no-cache"] if mode == "direct" else parallel
+                    expected, pandas_time = run(script, "pandas", argv, os.path.join(folder, "pandas"), args.verbose)
+                    result, polars_time = run(script, "polars", argv, os.path.join(folder, "polars"), args.verbose)
+                    compare(expected, result, f"{script} {mode}")
+                print(f"{script:<8} {mode:<10} {len(expected):>8} {pandas_time:>9.2f} {polars_time:>9.2f} "
+                      f"{pandas_time / polars_time:>7.2f}x")
+    finally:
+        logging.disable(logging.NOTSET)
+        if args.keep:
+            print(f"\nWork folder kept at {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("\nSame deliverables from both engines.")
+
+
+if __name__ == "__main__":
+    main()
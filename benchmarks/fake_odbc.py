@@ -0,0 +1,176 @@
+"""
+SQLite stand-in for the TDVCPBIP DSN, used by the offline benchmarks.
+
+install() registers this module as "pyodbc", so the scripts' pyodbc.connect() opens the
+synthetic database built by build_database() instead of the data-virtualization server.
+"""
+import datetime
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+
+# Database opened by connect(); set by install().
+DATABASE = None
+
+# Columns that fail with a permission error, extra seconds added to every query and extra
+# seconds added to the queries selecting a given column.
+FORBIDDEN_COLUMNS = set()
+QUERY_LATENCY = 0.0
+COLUMN_LATENCY = {}
+
+# Valuation areas / plants present in the synthetic tables (the extracts read the first three).
+PLANTS = ['2032', '2096', '2914', '9999']
+
+EKPO_COLUMNS = ['EBELN', 'EBELP', 'MATNR', 'WERKS', 'MENGE', 'NETPR', 'MEINS', 'AEDAT', 'TXZ01', 'MATKL', 'LGORT',
+                'PEINH', 'NETWR', 'LOEKZ']
+EKPO_EXTRA_COLUMNS = 120
+
+
+class Error(Exception):
+    pass
+
+
+class OperationalError(Error):
+    pass
+
+
+class Row(tuple):
+    pass
+
+
+class ColumnInfo:
+    def __init__(self, name):
+        self.column_name = name
+
+
+def translate(sql):
+    # SQLite has LIMIT instead of TOP.
+    match = re.match(r"\s*SELECT\s+TOP\s+(\d+)\s+(.*)", sql, re.S | re.I)
+    if match:
+        return f"SELECT {match.group(2)} LIMIT {match.group(1)}"
+    return sql
+
+
+class Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.db.cursor()
+        self.description = None
+
+    def execute(self, sql, *params):
+        select_list = re.split(r"\bFROM\b", sql, maxsplit=1, flags=re.I)[0]
+        requested = set(re.findall(r"\[?(\w+)\]?", select_list))
+        if requested & FORBIDDEN_COLUMNS:
+            raise Error("42000", f"Access denied to columns {sorted(requested & FORBIDDEN_COLUMNS)}")
+        latency = QUERY_LATENCY + sum(COLUMN_LATENCY.get(col, 0.0) for col in requested)
+        if latency:
+            time.sleep(latency)
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        self.cursor.execute(translate(sql), params)
+        self.description = self.cursor.description
+        return self
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def columns(self, table):
+        return [ColumnInfo(row[1]) for row in self.connection.db.execute(f"PRAGMA table_info({table})")]
+
+    def close(self):
+        self.cursor.close()
+
+
+class Connection:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.timeout = 0
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def connect(connection_string, **kwargs):
+    return Connection(DATABASE)
+
+
+def install(database):
+    """Makes "import pyodbc" return this module, connected to database."""
+    global DATABASE
+    DATABASE = database
+    sys.modules["pyodbc"] = sys.modules[__name__]
+
+
+def build_database(path, materials=20000, orders_per_material=5, seed=0):
+    """
+    Writes MARC, MARA, MBEW, EKPO and EKKO with the columns the scripts read. Every material exists
+    in MARA, in MARC/MBEW for each plant, and has orders_per_material EKPO lines, each on its own
+    purchase order dated within the last three years; about 5% of them are flagged for deletion.
+    Returns the row count per table.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE MARC (WERKS TEXT, MATNR TEXT, DISGR TEXT, DISMM TEXT, DISLS TEXT, MINBE REAL, "
+               "MABST REAL, VSPVB TEXT, PLIFZ INTEGER, LGRAD REAL)")
+    db.execute("CREATE TABLE MARA (MATNR TEXT, MEINS TEXT, MTART TEXT, MATKL TEXT)")
+    db.execute("CREATE TABLE MBEW (MANDT TEXT, MATNR TEXT, BWKEY TEXT, BWTAR TEXT, LVORM TEXT, SALK3 REAL, "
+               "VPRSV TEXT, VERPR REAL, STPRS REAL, PEINH INTEGER, BKLAS TEXT, LFGJA INTEGER, LFMON INTEGER, "
+               "TIMESTAMP INTEGER, VKSAL REAL)")
+    extra = ", ".join(f"ZZ{i:03d} TEXT" for i in range(EKPO_EXTRA_COLUMNS))
+    db.execute(f"CREATE TABLE EKPO (EBELN TEXT, EBELP TEXT, MATNR TEXT, WERKS TEXT, MENGE REAL, NETPR REAL, "
+               f"MEINS TEXT, AEDAT TEXT, TXZ01 TEXT, MATKL TEXT, LGORT TEXT, PEINH INTEGER, NETWR REAL, "
+               f"LOEKZ TEXT, {extra})")
+    db.execute("CREATE TABLE EKKO (EBELN TEXT, BSART TEXT, BSTYP TEXT, EKORG TEXT, EKGRP TEXT, LIFNR TEXT, "
+               "BEDAT TEXT, WAERS TEXT)")
+
+    matnrs = [str(rng.randrange(10 ** 7, 10 ** 11)).zfill(18) for _ in range(materials)]
+    db.executemany("INSERT INTO MARA VALUES (?, ?, ?, ?)",
+                   ((m, rng.choice(['UN', 'KG', 'M', 'PC']), 'ERSA', f"G{rng.randrange(100):03d}") for m in matnrs))
+    for plant in PLANTS:
+        db.executemany("INSERT INTO MARC VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       ((plant, m, f"G{rng.randrange(20):02d}", rng.choice(['PD', 'VB', 'ND']), 'EX',
+                         round(rng.random() * 100, 3), round(rng.random() * 500, 3), '', rng.randrange(1, 120),
+                         95.0) for m in matnrs))
+        db.executemany("INSERT INTO MBEW VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (('100', m, plant, '', '', round(rng.random() * 1e4, 2), 'V', round(rng.random() * 100, 2),
+                         0.0, 1, '3000', 2024, rng.randrange(1, 13), rng.randrange(20240101000000, 20241231000000),
+                         0.0) for m in matnrs))
+    placeholders = ", ".join("?" for _ in range(len(EKPO_COLUMNS) + EKPO_EXTRA_COLUMNS))
+    today = datetime.date.today()
+    items, headers = [], []
+    for i, m in enumerate(matnrs):
+        for j in range(orders_per_material):
+            ebeln = f"45{i * orders_per_material + j:08d}"
+            quantity, price = float(rng.randrange(1, 100)), round(rng.random() * 50, 2)
+            items.append((ebeln, "00010", m, rng.choice(PLANTS[:3]), quantity, price, 'UN', '2024-06-01',
+                          f"MATERIAL {m.lstrip('0')}", f"G{rng.randrange(100):03d}", "0001", 1,
+                          round(quantity * price, 2), 'L' if rng.random() < 0.05 else '',
+                          *([''] * EKPO_EXTRA_COLUMNS)))
+            bedat = today - datetime.timedelta(days=rng.randrange(3 * 365))
+            headers.append((ebeln, rng.choice(['NB', 'ZNB', 'UB']), 'F', '2000', f"P{rng.randrange(20):02d}",
+                            f"{rng.randrange(10 ** 5, 10 ** 6):010d}", bedat.strftime("%Y%m%d"), 'BRL'))
+    db.executemany(f"INSERT INTO EKPO VALUES ({placeholders})", items)
+    db.executemany("INSERT INTO EKKO VALUES (?, ?, ?, ?, ?, ?, ?, ?)", headers)
+    db.execute("CREATE INDEX EKKO_EBELN ON EKKO (EBELN)")
+    db.commit()
+    counts = {table: db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("MARC", "MARA", "MBEW", "EKPO", "EKKO")}
+    db.close()
+    return counts
@@ -0,0 +1,253 @@
+"""
+Scriptable fake of the SAP GUI Scripting objects used by 2_historico_de_pedidos, for the
+offline benchmarks.
+
+install() registers fake "win32com.client" and "pythoncom" modules. The session answers
+findById/press/sendVKey like the ME2M screens do: each action keeps session.Busy true for its
+configured latency, the export button writes a spreadsheet with rows for every material in the
+selection, and the ALV grid can be read through the GuiGridView calls.
+"""
+import datetime
+import sys
+import time
+import types
+
+import polars as pl
+
+# Seconds an action keeps the session busy, per kind of action.
+DEFAULT_LATENCIES = {
+    "press": 0.02,
+    "sendVKey": 0.02,
+    "doubleClickNode": 0.05,
+    "execute": 0.2,     # btn[8] on the selection screen: running the report
+    "export": 0.1,      # btn[11] in the export dialog: writing the file
+    "scroll": 0.005,    # grid firstVisibleRow / table scrollbar
+}
+
+GRID_ID = "cntlGRIDCONTROL/shellcont/shell"
+
+# Columns of the fake ME2M list: ABAP data type and displayed title.
+COLUMN_TYPES = {"EBELN": "CHAR", "MATNR": "CHAR", "WERKS": "CHAR", "MENGE": "QUAN", "BEDAT": "DATS"}
+COLUMN_TITLES = {"EBELN": "Documento de compras", "MATNR": "Material", "WERKS": "Centro", "MENGE": "Qtd.pedido",
+                 "BEDAT": "Data do documento"}
+
+
+class Config:
+    latencies = dict(DEFAULT_LATENCIES)
+    rows_per_material = 5
+    grid = True
+    visible_rows = 30
+
+
+class Collection:
+    def __init__(self, items):
+        self.items = items
+
+    def __call__(self, index):
+        return self.items[index]
+
+    @property
+    def Count(self):
+        return len(self.items)
+
+
+class Scrollbar:
+    def __init__(self, session):
+        object.__setattr__(self, "session", session)
+
+    def __setattr__(self, name, value):
+        self.session.busy_for("scroll")
+
+
+class Control:
+    def __init__(self, session, control_id):
+        object.__setattr__(self, "session", session)
+        object.__setattr__(self, "id", control_id)
+        object.__setattr__(self, "text", "")
+        object.__setattr__(self, "Text", "")
+        object.__setattr__(self, "MessageType", "")
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in ("text", "Text"):
+            self.session.on_text(self.id, value)
+
+    @property
+    def visibleRowCount(self):
+        return 8
+
+    @property
+    def verticalScrollbar(self):
+        return Scrollbar(self.session)
+
+    def press(self):
+        self.session.on_press(self.id)
+
+    def sendVKey(self, key):
+        self.session.busy_for("sendVKey")
+
+    def doubleClickNode(self, node):
+        self.session.busy_for("doubleClickNode")
+
+    def resizeWorkingPane(self, *args):
+        pass
+
+    def setFocus(self):
+        pass
+
+    SetFocus = setFocus
+
+    def select(self):
+        self.session.busy_for("press")
+
+
+class Grid:
+    """GuiGridView over the rows of the last executed selection."""
+
+    def __init__(self, session, rows):
+        self.session = session
+        self.rows = rows
+        self.RowCount = len(rows)
+        self.VisibleRowCount = Config.visible_rows
+        self._first = 0
+
+    @property
+    def ColumnOrder(self):
+        return Collection(list(COLUMN_TYPES))
+
+    def GetDisplayedColumnTitle(self, column):
+        return COLUMN_TITLES[column]
+
+    def GetColumnDataType(self, column):
+        return COLUMN_TYPES[column]
+
+    @property
+    def firstVisibleRow(self):
+        return self._first
+
+    @firstVisibleRow.setter
+    def firstVisibleRow(self, value):
+        self._first = value
+        self.session.busy_for("scroll")
+
+    def GetCellValue(self, row, column):
+        # Display text, as a user with decimal notation "1.234,56" and dates DD.MM.YYYY sees it
+        value = self.rows[row][column]
+        if COLUMN_TYPES[column] == "QUAN":
+            return f"{value:,.3f}".replace(",", " ").replace(".", ",").replace(" ", ".")
+        if COLUMN_TYPES[column] == "DATS":
+            return value.strftime("%d.%m.%Y")
+        return str(value)
+
+
+class Session:
+    def __init__(self, connection):
+        self.connection = connection
+        self.controls = {}
+        self.values = {}
+        self.busy_until = 0.0
+        self.mode = None
+        self.materials = []
+        self.result = None
+        # A popup (wnd[1]) is open until this time; it closes when the action closing it ends
+        self.popup_until = 0.0
+
+    @property
+    def Busy(self):
+        return time.perf_counter() < self.busy_until
+
+    def busy_for(self, action):
+        self.busy_until = time.perf_counter() + Config.latencies.get(action, 0.0)
+
+    def findById(self, control_id, raise_error=True):
+        if control_id.endswith(GRID_ID):
+            if not Config.grid or self.result is None:
+                return None
+            return Grid(self, self.result)
+        if control_id.endswith("btn[43]") and self.result is None:
+            return None
+        if control_id.startswith("wnd[1]") and time.perf_counter() >= self.popup_until:
+            return None
+        if control_id not in self.controls:
+            self.controls[control_id] = Control(self, control_id)
+        return self.controls[control_id]
+
+    def on_text(self, control_id, value):
+        self.values[control_id] = value
+        if control_id.endswith("EM_MATNR-LOW"):
+            self.materials = [value]
+        elif "SLOW_I" in control_id and self.mode == "materials":
+            self.materials.append(value)
+
+    def on_press(self, control_id):
+        if "EM_MATNR_%_APP" in control_id:
+            self.mode, self.materials = "materials", []
+        elif "EM_WERKS_%_APP" in control_id:
+            self.mode = "plants"
+        if "VALU_PUSH" in control_id or control_id.endswith("btn[43]"):
+            self.popup_until = float("inf")
+        if control_id == "wnd[0]/tbar[1]/btn[8]":
+            self.result = [
+                {"EBELN": f"45{index:08d}", "MATNR": material.lstrip("0"), "WERKS": "2032",
+                 "MENGE": (line + 1) * 1250.5, "BEDAT": datetime.date(2024, 1, 1) + datetime.timedelta(days=line)}
+                for index, material in enumerate(self.materials)
+                for line in range(Config.rows_per_material)
+            ] or None  # like ME2M, no orders leaves the selection screen without a list
+            status = self.findById("wnd[0]/sbar")
+            status.Text = "" if self.result else "Nenhum documento adequado selecionado"
+            status.MessageType = "" if self.result else "S"
+            self.busy_for("execute")
+        elif control_id.endswith("btn[11]"):
+            self.write_export()
+            self.busy_for("export")
+            self.popup_until = self.busy_until
+        else:
+            if control_id == "wnd[0]/tbar[0]/btn[3]":
+                self.result = None
+            self.busy_for("press")
+            if control_id == "wnd[1]/tbar[0]/btn[8]":
+                # The popup is still there while the session is busy closing it
+                self.popup_until = self.busy_until
+
+    def write_export(self):
+        file_name = self.values.get("wnd[1]/usr/ctxtDY_FILENAME")
+        rows = self.result or []
+        pl.DataFrame({title: [row[column] for row in rows] for column, title in COLUMN_TITLES.items()},
+                     schema={title: (pl.Float64 if COLUMN_TYPES[column] == "QUAN" else
+                                     pl.Date if COLUMN_TYPES[column] == "DATS" else pl.Utf8)
+                             for column, title in COLUMN_TITLES.items()}).write_excel(file_name)
+
+    def CreateSession(self):
+        self.connection.sessions.append(Session(self.connection))
+
+
+class GuiConnection:
+    def __init__(self):
+        self.sessions = [Session(self)]
+
+    @property
+    def Children(self):
+        return Collection(self.sessions)
+
+
+class ScriptingEngine:
+    def __init__(self):
+        self.Children = Collection([GuiConnection()])
+
+
+def install(latencies=None, rows_per_material=5, grid=True):
+    """Registers fake win32com.client and pythoncom modules; returns the scripting engine."""
+    Config.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+    Config.rows_per_material = rows_per_material
+    Config.grid = grid
+    engine = ScriptingEngine()
+
+    client = types.ModuleType("win32com.client")
+    client.GetObject = lambda name: types.SimpleNamespace(GetScriptingEngine=engine)
+    package = types.ModuleType("win32com")
+    package.client = client
+    pythoncom = types.ModuleType("pythoncom")
+    pythoncom.CoInitialize = lambda: None
+    pythoncom.CoUninitialize = lambda: None
+    sys.modules.update({"win32com": package, "win32com.client": client, "pythoncom": pythoncom})
+    return engine
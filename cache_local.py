@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from tipos_sap import compact_frame
+
+# Folder holding one Parquet file per cached extract plus the manifest describing them.
+CACHE_DIR = "cache"
+MANIFEST_FILE = "manifest.json"
+
+# Extracts older than this are fetched again. Long enough for a morning run of all scripts.
+DEFAULT_TTL_HOURS = 12
+
+# When the cache folder grows beyond this, the least recently used extracts are removed.
+DEFAULT_MAX_SIZE_MB = 2048
+
+
+def normalize_where(where):
+    """
+    Normalizes a WHERE filter so cosmetic differences ("[BWKEY]" vs "BWKEY", spacing)
+    don't produce different cache entries.
+    """
+    where = (where or "").replace("[", "").replace("]", "")
+    where = re.sub(r"\s*,\s*", ",", where)
+    return re.sub(r"\s+", " ", where).strip()
+
+
+def cache_key(table, columns, where):
+    payload = json.dumps([table.upper(), list(columns), normalize_where(where)])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class SnapshotCache:
+    """
+    Read-through cache of table extracts stored as Parquet files.
+
+    Entries are keyed by (table, column list, WHERE filter). A request for a subset of the
+    columns of a fresh entry with the same table and filter is served from that entry,
+    so scripts selecting different columns of the same extract share one query.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl_hours=DEFAULT_TTL_HOURS, max_size_mb=DEFAULT_MAX_SIZE_MB):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_bytes = max_size_mb * 1024 ** 2
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # A damaged manifest only costs a refetch.
+            return {}
+
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _is_fresh(self, entry, now):
+        return now - entry["created"] <= self.ttl_seconds and os.path.exists(
+            os.path.join(self.cache_dir, entry["file"]))
+
+    def _find(self, manifest, table, columns, where, now):
+        key = cache_key(table, columns, where)
+        entry = manifest.get(key)
+        if entry and self._is_fresh(entry, now):
+            return key, entry
+
+        wanted = set(columns)
+        where = normalize_where(where)
+        for other_key, other in manifest.items():
+            if (other["table"] == table.upper() and other["where"] == where
+                    and wanted.issubset(other["columns"]) and self._is_fresh(other, now)):
+                return other_key, other
+        return None, None
+
+    def locate(self, table, columns, where=""):
+        """
+        Returns the path of a fresh Parquet file holding the extract (possibly with more
+        columns than requested), or None on a miss. Counts as an access of the entry.
+        """
+        now = time.time()
+        manifest = self._load_manifest()
+        key, entry = self._find(manifest, table, columns, where, now)
+        if entry is None:
+            return None
+        entry["last_access"] = now
+        self._save_manifest(manifest)
+        return os.path.join(self.cache_dir, entry["file"])
+
+    def get(self, table, columns, where=""):
+        """
+        Returns the cached extract restricted to columns, or None on a miss.
+        """
+        path = self.locate(table, columns, where)
+        if path is None:
+            return None
+        # Extracts cached before the compact dtypes existed are converted on the way out
+        return compact_frame(pd.read_parquet(path, columns=list(columns)), stats=None)
+
+    def put(self, table, columns, where, df):
+        """Stores the extract, given as a DataFrame or a pyarrow Table."""
+        now = time.time()
+        key = cache_key(table, columns, where)
+        file_name = f"{table.lower()}_{key[:16]}.parquet"
+        path = os.path.join(self.cache_dir, file_name)
+        tmp_path = path + ".tmp"
+        if isinstance(df, pa.Table):
+            pq.write_table(df, tmp_path)
+        else:
+            df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+        manifest = self._load_manifest()
+        manifest[key] = {
+            "table": table.upper(),
+            "columns": list(columns),
+            "where": normalize_where(where),
+            "file": file_name,
+            "created": now,
+            "last_access": now,
+            "size": os.path.getsize(path),
+        }
+        self._evict(manifest, now)
+        self._save_manifest(manifest)
+
+    def read(self, table, columns, where, fetch, refresh=False):
+        """
+        Returns the extract from the cache, calling fetch() and storing its result on a miss.
+        fetch must return a DataFrame with exactly the requested columns.
+        """
+        if not refresh:
+            df = self.get(table, columns, where)
+            if df is not None:
+                print(f"{table} read from local cache.")
+                return df
+        df = fetch()
+        self.put(table, columns, where, df)
+        return df
+
+    def _evict(self, manifest, now):
+        # Drop expired entries first, then the least recently used until under the size limit.
+        for key, entry in list(manifest.items()):
+            if not self._is_fresh(entry, now):
+                self._remove(manifest, key)
+
+        total = sum(entry["size"] for entry in manifest.values())
+        for key, entry in sorted(manifest.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= entry["size"]
+            self._remove(manifest, key)
+
+    def _remove(self, manifest, key):
+        entry = manifest.pop(key)
+        try:
+            os.remove(os.path.join(self.cache_dir, entry["file"]))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,88 @@
+import json
+import os
+import time
+
+from cache_local import CACHE_DIR
+from extracao_odbc import CONNECTION_STRING
+from sondagem_colunas import OK
+
+# Probe results per (DSN, table), written by verificacao_de_acesso_EKPO.py.
+CATALOG_FILE = os.path.join(CACHE_DIR, "catalogo_colunas.json")
+
+# Folder, next to the catalog, with a copy of the last probe of each table (<TABLE>.json), so
+# whatever depends on one table's probe can watch that file instead of the whole catalog.
+TABLES_DIR = "sondagens"
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+class ColumnCatalog:
+    """
+    Local catalog of which columns each table lets us read, with the time of the probe
+    and the access latency measured for every column.
+
+    Layout: {connection_string: {TABLE: {"probed_at": ..., "columns": {col: {"status", "elapsed"}}}}}
+    """
+
+    def __init__(self, path=CATALOG_FILE):
+        self.path = path
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def table_path(self, table):
+        """File holding the last probe of table alone."""
+        return os.path.join(os.path.dirname(self.path), TABLES_DIR, f"{table.upper()}.json")
+
+    def record(self, table, results, connection_string=CONNECTION_STRING):
+        """
+        Stores the output of sondagem_colunas.probe_columns, replacing any earlier probe, in the
+        catalog and in the table's own file.
+        """
+        catalog = self._load()
+        entry = {
+            "probed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "columns": {col: {"status": result["status"], "elapsed": result["elapsed"]}
+                        for col, result in results.items()},
+        }
+        catalog.setdefault(connection_string, {})[table.upper()] = entry
+        write_json(self.path, catalog)
+        write_json(self.table_path(table), {connection_string: entry})
+
+    def entry(self, table, connection_string=CONNECTION_STRING):
+        """Returns the catalog entry for table, or None if it was never probed."""
+        return self._load().get(connection_string, {}).get(table.upper())
+
+    def accessible_columns(self, table, max_latency=None, connection_string=CONNECTION_STRING):
+        """
+        Readable columns of table in table order, leaving out the ones slower than max_latency
+        seconds when given. Returns None if the table was never probed.
+        """
+        entry = self.entry(table, connection_string)
+        if entry is None:
+            return None
+        return [col for col, info in entry["columns"].items()
+                if info["status"] == OK and (max_latency is None or info["elapsed"] <= max_latency)]
+
+    def usable_columns(self, table, columns, connection_string=CONNECTION_STRING):
+        """
+        Returns columns without the ones the catalog knows to be unreadable, printing what was
+        dropped. Columns the catalog has no record of are kept.
+        """
+        entry = self.entry(table, connection_string)
+        if entry is None:
+            return list(columns)
+        blocked = [col for col in columns
+                   if col in entry["columns"] and entry["columns"][col]["status"] != OK]
+        if blocked:
+            print(f"Skipping columns of {table} not accessible since {entry['probed_at']}: {blocked}")
+        return [col for col in columns if col not in blocked]
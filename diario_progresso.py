@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+DEFAULT_DIRECTORY = "progresso_ME2M"
+JOURNAL_FILE = "diario.jsonl"
+STORE_DIRECTORY = "materiais"
+
+# Statuses recorded in the journal; "failed" materials are retried by --resume
+DONE = "done"
+EMPTY = "empty"
+FAILED = "failed"
+
+
+class ProgressJournal:
+    """
+    ME2M progress journal: the rows of each finished material are written right away to a
+    Parquet file of its own (never rewritten) and a line is appended to the JSONL journal. The
+    last status recorded for a material wins; a line cut short by a crash is ignored.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.store_path = os.path.join(directory, STORE_DIRECTORY)
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """Starts a new run, discarding the journal and the stored rows."""
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.store_path, exist_ok=True)
+
+    def entries(self):
+        """Returns {material: last journal entry}."""
+        latest = {}
+        if not os.path.exists(self.journal_path):
+            return latest
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning("Ignoring truncated journal line in %s.", self.journal_path)
+                    continue
+                latest[entry["material"]] = entry
+        return latest
+
+    def completed(self):
+        """Materials that need no new lookup (with or without orders)."""
+        return {material for material, entry in self.entries().items() if entry["status"] in (DONE, EMPTY)}
+
+    def _append(self, entry):
+        entry["time"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.lock:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def record_done(self, material, df):
+        os.makedirs(self.store_path, exist_ok=True)
+        file_name = re.sub(r"[^\w.-]", "_", material) + ".parquet"
+        path = os.path.join(self.store_path, file_name)
+        # Written to a temporary file and renamed, so a Parquet file is never left half written
+        temp_path = path + ".tmp"
+        df.write_parquet(temp_path)
+        os.replace(temp_path, path)
+        self._append({"material": material, "status": DONE, "rows": df.height, "file": file_name})
+
+    def record_empty(self, material):
+        self._append({"material": material, "status": EMPTY, "rows": 0})
+
+    def record_failed(self, material, reason):
+        self._append({"material": material, "status": FAILED, "reason": reason})
+
+    def files(self, materials):
+        """Stored Parquet files in the order of materials; materials without rows are skipped."""
+        entries = self.entries()
+        return [os.path.join(self.store_path, entries[material]["file"])
+                for material in materials
+                if material in entries and entries[material]["status"] == DONE]
@@ -0,0 +1,245 @@
+import sys
+import time
+
+import pandas as pd
+import pyodbc
+
+from rastreamento import span
+from tipos_sap import compact_frame, concat_frames
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Use the pre-configured DSN "TDVCPBIP" with an extra data source parameter.
+CONNECTION_STRING = "DSN=TDVCPBIP;dataSource=S10231;"
+
+# Number of rows requested per cursor.fetchmany call in streaming mode.
+DEFAULT_BATCH_SIZE = 50000
+
+# Plants (WERKS) and valuation areas (BWKEY) covered by the extracts.
+PLANTS = ['2032', '2096', '2914']
+PLANT_FILTER = "({})".format(",".join(f"'{plant}'" for plant in PLANTS))
+
+# Union of the MARC columns used by scripts 1 and 3, so both read the same cached extract.
+MARC_COLUMNS = ['WERKS', 'MATNR', 'DISGR', 'DISMM', 'DISLS', 'MINBE', 'MABST', 'VSPVB', 'PLIFZ', 'LGRAD']
+MARC_WHERE = f"WERKS IN {PLANT_FILTER}"
+
+
+def connect(connection_string=CONNECTION_STRING):
+    """
+    Opens a connection to the DSN and reports it the same way the scripts always did.
+    Returns None when the connection fails.
+    """
+    try:
+        conn = pyodbc.connect(connection_string)
+        print("Connected using DSN 'TDVCPBIP' with dataSource=S10231.")
+        return conn
+    except Exception as e:
+        print("Connection error:", e)
+        return None
+
+
+class LazyConnection:
+    """
+    Opens the DSN connection on first use, so runs served entirely from the local
+    cache never connect.
+    """
+
+    def __init__(self, connection_string=CONNECTION_STRING):
+        self.connection_string = connection_string
+        self.conn = None
+
+    def get(self):
+        if self.conn is None:
+            self.conn = connect(self.connection_string)
+            if self.conn is None:
+                raise ConnectionError("Unable to connect to DSN 'TDVCPBIP'.")
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def to_matnr(material):
+    """
+    MATNR as stored in the tables: numeric material numbers zero padded to 18 characters.
+    """
+    material = str(material).strip()
+    return material.zfill(18) if material.isdigit() else material
+
+
+def build_select(table, columns, where=""):
+    """
+    Builds "SELECT [col], ... FROM table WHERE where".
+    """
+    query_columns = ", ".join(f"[{col}]" for col in columns)
+    sql = f"SELECT {query_columns} FROM {table}"
+    if where:
+        sql += f" WHERE {where}"
+    return sql
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB, or None if it can't be measured.
+    """
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        # peak_wset is only reported on Windows.
+        peak = getattr(info, "peak_wset", None)
+        if peak:
+            return peak / 1024 ** 2
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux.
+    if sys.platform == "darwin":
+        return maxrss / 1024 ** 2
+    return maxrss / 1024
+
+
+class ExtractionStats:
+    """
+    Accumulates row counts and timings for a streaming extraction.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.rows = 0
+        self.batches = 0
+        self.start = time.perf_counter()
+
+    def add(self, rows):
+        self.rows += rows
+        self.batches += 1
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def rows_per_sec(self):
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        peak = peak_rss_mb()
+        peak_text = f"{peak:.1f} MB" if peak is not None else "n/a"
+        print(
+            f"{self.label}: {self.rows} rows in {self.batches} batches, "
+            f"{self.elapsed:.2f} s ({self.rows_per_sec:.0f} rows/sec), peak RSS {peak_text}."
+        )
+
+
+def iter_batches(conn, sql, batch_size=DEFAULT_BATCH_SIZE, params=None):
+    """
+    Executes the query and yields the result as DataFrames of at most batch_size rows,
+    using cursor.fetchmany so the full result set is never held in memory.
+    Each batch gets the compact dtypes of tipos_sap.
+    """
+    cursor = conn.cursor()
+    try:
+        with span("execute"):
+            if params:
+                cursor.execute(sql, params)
+            else:
+                cursor.execute(sql)
+        columns = [column[0] for column in cursor.description]
+        while True:
+            with span("fetchmany", batch_size=batch_size):
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batch = compact_frame(pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns))
+            yield batch
+    finally:
+        cursor.close()
+
+
+# Join pushdown: with few distinct keys, MATNR IN (...) batches move the least data;
+# beyond this threshold a single server-side join is cheaper than many round trips.
+DEFAULT_MAX_SEMIJOIN_KEYS = 20000
+
+# Keys per IN (...) list. Kept well below the 2100 parameter limit of SQL Server drivers.
+SEMIJOIN_BATCH_SIZE = 1000
+
+
+def fetch_scalar(conn, sql):
+    """
+    Runs a query that returns a single value and returns it.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql)
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def fetch_column(conn, sql):
+    """
+    Runs a single-column query and returns its values as a list, skipping NULLs.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql)
+        return [row[0] for row in cursor.fetchall() if row[0] is not None]
+    finally:
+        cursor.close()
+
+
+def choose_join_strategy(key_count, max_semijoin_keys=DEFAULT_MAX_SEMIJOIN_KEYS):
+    """
+    Returns "semijoin" when the keys fit in a reasonable number of IN (...) batches,
+    otherwise "join" to let the server do the join in one query.
+    """
+    if key_count <= max_semijoin_keys:
+        return "semijoin"
+    return "join"
+
+
+def semijoin_sql(base_sql, key, key_count, where=""):
+    """
+    Appends "WHERE [where AND] key IN (?, ...)" with key_count placeholders to base_sql,
+    which must not have a WHERE clause of its own.
+    """
+    placeholders = ", ".join("?" for _ in range(key_count))
+    condition = f"{key} IN ({placeholders})"
+    if where:
+        condition = f"({where}) AND {condition}"
+    return f"{base_sql.rstrip()}\nWHERE {condition}"
+
+
+def iter_semijoin_batches(conn, base_sql, key, keys, batch_size=SEMIJOIN_BATCH_SIZE, where="", params=()):
+    """
+    Yields one DataFrame per batch of keys with the rows of base_sql whose key is in the batch.
+    where is an extra filter ANDed to every batch, with its own ? placeholders bound to params.
+    """
+    for start in range(0, len(keys), batch_size):
+        chunk = list(keys[start:start + batch_size])
+        sql = semijoin_sql(base_sql, key, len(chunk), where)
+        for batch in iter_batches(conn, sql, batch_size=len(chunk), params=list(params) + chunk):
+            yield batch
+
+
+def fetch_semijoin(conn, base_sql, key, keys, batch_size=SEMIJOIN_BATCH_SIZE, where="", params=()):
+    """
+    Fetches the rows of base_sql whose key is in keys (and matching where), using IN (...) batches.
+    """
+    batches = list(iter_semijoin_batches(conn, base_sql, key, keys, batch_size, where, params))
+    if not batches:
+        # Run the query with an always-false filter just to get the column layout.
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"{base_sql.rstrip()}\nWHERE 1 = 0")
+            columns = [column[0] for column in cursor.description]
+        finally:
+            cursor.close()
+        return pd.DataFrame(columns=columns)
+    return concat_frames(batches)
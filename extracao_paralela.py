@@ -0,0 +1,152 @@
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+import pyodbc
+
+from extracao_odbc import CONNECTION_STRING, PLANTS, SEMIJOIN_BATCH_SIZE, build_select, semijoin_sql
+from rastreamento import span
+from tipos_sap import compact_frame, concat_frames
+
+# Connections the data-virtualization DSN handles well at once.
+DEFAULT_WORKERS = 3
+
+
+class ConnectionPool:
+    """
+    Bounded pool of pyodbc connections. Connections are opened on first demand,
+    so a pool never holds more connections than partitions running at once.
+    A query_timeout (seconds) is set on every connection and enforced by the ODBC driver.
+    """
+
+    def __init__(self, size, connection_string=CONNECTION_STRING, query_timeout=0):
+        self.connection_string = connection_string
+        self.query_timeout = query_timeout
+        self.available = queue.Queue()
+        self.slots = queue.Queue()
+        for _ in range(size):
+            self.slots.put(None)
+        self.opened = []
+
+    @contextmanager
+    def connection(self):
+        self.slots.get()
+        try:
+            try:
+                conn = self.available.get_nowait()
+            except queue.Empty:
+                conn = pyodbc.connect(self.connection_string)
+                if self.query_timeout:
+                    conn.timeout = self.query_timeout
+                self.opened.append(conn)
+            try:
+                yield conn
+            finally:
+                self.available.put(conn)
+        finally:
+            self.slots.put(None)
+
+    def close(self):
+        for conn in self.opened:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self.opened = []
+
+
+def parse_matnr_splits(text):
+    """
+    Parses a comma-separated list of MATNR boundaries ("000000000010000000,...").
+    """
+    if not text:
+        return []
+    return sorted(value.strip() for value in text.split(",") if value.strip())
+
+
+def plant_partitions(table, columns, plant_column, plants=PLANTS, matnr_splits=(), where=""):
+    """
+    Returns one (label, sql, params) partition per plant and, when matnr_splits is given,
+    per MATNR range between consecutive boundaries. The order is fixed so the
+    concatenated result is deterministic.
+    """
+    bounds = [None] + list(matnr_splits) + [None]
+    partitions = []
+    for plant in plants:
+        for low, high in zip(bounds, bounds[1:]):
+            conditions = [f"[{plant_column}] = ?"]
+            params = [plant]
+            if low is not None:
+                conditions.append("[MATNR] >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append("[MATNR] < ?")
+                params.append(high)
+            if where:
+                conditions.append(f"({where})")
+            label = f"{table} {plant_column}={plant}"
+            if matnr_splits:
+                label += f" MATNR [{low or ''}, {high or ''})"
+            partitions.append((label, build_select(table, columns, " AND ".join(conditions)), params))
+    return partitions
+
+
+def semijoin_partitions(base_sql, key, keys, batch_size=SEMIJOIN_BATCH_SIZE, where="", params=()):
+    """
+    Returns one (label, sql, params) partition per batch of keys, with
+    "WHERE [where AND] key IN (?, ...)" appended to base_sql.
+    """
+    partitions = []
+    for number, start in enumerate(range(0, len(keys), batch_size), start=1):
+        chunk = list(keys[start:start + batch_size])
+        partitions.append((f"{key} batch {number}", semijoin_sql(base_sql, key, len(chunk), where),
+                           list(params) + chunk))
+    return partitions
+
+
+def fetch_partition(pool, partition):
+    """
+    Runs one partition on a pooled connection.
+    Returns a tuple (label, DataFrame, elapsed_time).
+    """
+    label, sql, params = partition
+    start = time.perf_counter()
+    with pool.connection() as conn, span("read_sql", partition=label):
+        df = compact_frame(pd.read_sql(sql, conn, params=params))
+    return (label, df, time.perf_counter() - start)
+
+
+def run_partitions(partitions, workers=DEFAULT_WORKERS, connection_string=CONNECTION_STRING):
+    """
+    Runs the partitions on a ThreadPoolExecutor backed by a pool of at most `workers`
+    connections and concatenates the results in partition order.
+    """
+    pool = ConnectionPool(workers, connection_string)
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(fetch_partition, pool, partition) for partition in partitions]
+            results = [future.result() for future in futures]
+    finally:
+        pool.close()
+
+    for label, df, elapsed in results:
+        print(f"{label}: {len(df)} rows in {elapsed:.2f} seconds")
+    print(f"{len(partitions)} partitions on {workers} connections in {time.perf_counter() - start:.2f} seconds.")
+    return concat_frames([df for _, df, _ in results])
+
+
+def fetch_plants(db, table, columns, plant_column, workers=1, matnr_splits=()):
+    """
+    Fetches the table rows for the configured plants: a single query on db's connection
+    when workers is 1, otherwise one partition per plant (and MATNR range) on a pool.
+    """
+    if workers <= 1 and not matnr_splits:
+        plant_list = ",".join(f"'{plant}'" for plant in PLANTS)
+        conn = db.get()
+        with span("read_sql", table=table):
+            return compact_frame(pd.read_sql(build_select(table, columns, f"{plant_column} IN ({plant_list})"), conn))
+    partitions = plant_partitions(table, columns, plant_column, PLANTS, matnr_splits)
+    return run_partitions(partitions, max(workers, 1), db.connection_string)
@@ -0,0 +1,254 @@
+import argparse
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from catalogo_colunas import ColumnCatalog
+from extracao_odbc import CONNECTION_STRING, SEMIJOIN_BATCH_SIZE, to_matnr
+from extracao_paralela import DEFAULT_WORKERS, run_partitions
+from rastreamento import TRACER, span
+from saida_parquet import HISTORY_EXCEL_FILE, HISTORY_FILE, HISTORY_ODBC_FILE, parquet_to_excel
+
+# Same plants as the ME2M selection in 2_historico_de_pedidos.py.
+PLANTS = ["2914", "2096", "2032", "20AI", "20AF"]
+
+# Columns of the ME2M "BEST ALV" export, in export order, and the EKPO/EKKO field behind each.
+ME2M_COLUMNS = [
+    ("Documento de compras", "EKPO", "EBELN"),
+    ("Item", "EKPO", "EBELP"),
+    ("Tipo de documento de compras", "EKKO", "BSART"),
+    ("Categoria do documento de compras", "EKKO", "BSTYP"),
+    ("Organização de compras", "EKKO", "EKORG"),
+    ("Grupo de compradores", "EKKO", "EKGRP"),
+    ("Fornecedor/centro fornecedor", "EKKO", "LIFNR"),
+    ("Data do documento", "EKKO", "BEDAT"),
+    ("Material", "EKPO", "MATNR"),
+    ("Texto breve", "EKPO", "TXZ01"),
+    ("Grupo de mercadorias", "EKPO", "MATKL"),
+    ("Centro", "EKPO", "WERKS"),
+    ("Depósito", "EKPO", "LGORT"),
+    ("Quantidade do pedido", "EKPO", "MENGE"),
+    ("Unidade de medida do pedido", "EKPO", "MEINS"),
+    ("Preço líquido", "EKPO", "NETPR"),
+    ("Moeda", "EKKO", "WAERS"),
+    ("Por", "EKPO", "PEINH"),
+    ("Valor líquido do pedido", "EKPO", "NETWR"),
+]
+
+# Fields the query itself filters and joins on; without them there is no set-based extract.
+KEY_FIELDS = [("EKPO", "EBELN"), ("EKPO", "MATNR"), ("EKPO", "WERKS"), ("EKKO", "EBELN"), ("EKKO", "BEDAT")]
+
+# Deletion indicator of the item (EKPO.LOEKZ). ME2M lists deleted and blocked items too, so
+# they are kept unless --skip-deleted asks to leave out the ones flagged DELETED.
+DELETION_FLAG = ("EKPO", "LOEKZ")
+DELETED = "L"
+
+# Document date (EKKO.BEDAT) range split into windows of this many days, one query per
+# window and batch of materials. Like the ME2M selection, the range is unbounded by default.
+DEFAULT_WINDOW_DAYS = 365
+
+MATERIALS_FILE = "lista_de_NMs.xlsx"
+MATERIALS_COLUMN = "Minimum Lot Size[NM]"
+
+
+def date_windows(since=None, until=None, window_days=DEFAULT_WINDOW_DAYS):
+    """
+    Splits [since, until] into consecutive (low, high) windows of window_days, as SAP DATS
+    strings (YYYYMMDD) for "BEDAT >= low AND BEDAT < high". A missing bound is None: without
+    since the whole range is one window, without until the windows run up to today and the
+    last one is open-ended.
+    """
+    high_limit = until + timedelta(days=1) if until else None
+    if since is None:
+        return [(None, high_limit.strftime("%Y%m%d") if high_limit else None)]
+    last = until or date.today()
+    windows = []
+    low = since
+    while low <= last:
+        high = min(low + timedelta(days=window_days), last + timedelta(days=1))
+        windows.append((low.strftime("%Y%m%d"), high.strftime("%Y%m%d")))
+        low = high
+    if until is None and windows:
+        windows[-1] = (windows[-1][0], None)
+    return windows
+
+
+def readable_fields(catalog=None):
+    """
+    Splits ME2M_COLUMNS by what the column catalog says the DSN lets us read.
+    Returns (readable [(title, table, field)], denied titles, deletion flag readable).
+    """
+    catalog = catalog or ColumnCatalog()
+    wanted = [(table, field) for _, table, field in ME2M_COLUMNS] + KEY_FIELDS + [DELETION_FLAG]
+    usable = {}
+    for table in ("EKPO", "EKKO"):
+        fields = list(dict.fromkeys(field for field_table, field in wanted if field_table == table))
+        usable[table] = set(catalog.usable_columns(table, fields))
+    readable = [column for column in ME2M_COLUMNS if column[2] in usable[column[1]]]
+    denied = [title for title, table, field in ME2M_COLUMNS if field not in usable[table]]
+    denied += [f"{table}.{field}" for table, field in KEY_FIELDS
+               if field not in usable[table] and f"{table}.{field}" not in denied]
+    return readable, denied, DELETION_FLAG[1] in usable[DELETION_FLAG[0]]
+
+
+def history_partitions(columns, materials, windows, plants=PLANTS, skip_deleted=False,
+                       batch_size=SEMIJOIN_BATCH_SIZE):
+    """
+    Returns one (label, sql, params) partition per document date window and batch of materials,
+    joining each EKPO item to its EKKO header.
+    """
+    select_list = ", ".join(f"{table}.[{field}]" for _, table, field in columns)
+    plant_list = ",".join(f"'{plant}'" for plant in plants)
+    base_conditions = [f"EKPO.[WERKS] IN ({plant_list})"]
+    if skip_deleted:
+        # Blocked items ('S') and a blank or NULL flag stay in
+        base_conditions.append(f"(EKPO.[LOEKZ] IS NULL OR EKPO.[LOEKZ] <> '{DELETED}')")
+
+    partitions = []
+    for low, high in windows:
+        date_conditions = [condition for condition, bound in (("EKKO.[BEDAT] >= ?", low), ("EKKO.[BEDAT] < ?", high))
+                           if bound is not None]
+        date_params = [bound for bound in (low, high) if bound is not None]
+        for number, start in enumerate(range(0, len(materials), batch_size), start=1):
+            chunk = list(materials[start:start + batch_size])
+            placeholders = ", ".join("?" for _ in chunk)
+            conditions = base_conditions + date_conditions + [f"EKPO.[MATNR] IN ({placeholders})"]
+            sql = (f"SELECT {select_list}\nFROM EKPO\nINNER JOIN EKKO ON EKKO.[EBELN] = EKPO.[EBELN]\n"
+                   f"WHERE {' AND '.join(conditions)}")
+            partitions.append((f"BEDAT {low or 'first'}-{high or 'last'} batch {number}", sql, date_params + chunk))
+    return partitions
+
+
+def parse_bedat(values):
+    """
+    Document dates as datetimes, whether the driver returns DATS strings ("20240101"),
+    datetime.date objects or ISO strings ("2024-01-01"). "00000000" and blanks become NaT.
+    """
+    text = values.map(lambda value: value.strftime("%Y%m%d") if isinstance(value, (date, datetime)) else value)
+    text = text.astype(str).str.strip().str.replace("-", "", regex=False).str[:8]
+    return pd.to_datetime(text, format="%Y%m%d", errors="coerce")
+
+
+def shape_like_me2m(df, columns, materials):
+    """
+    Renames the fields to the ME2M export titles, drops the leading zeros of Material as the
+    export does, turns the document date into a date and orders the rows by the material list,
+    then by document and item.
+    """
+    df = df.rename(columns={field: title for title, _, field in columns})
+    df = df[[title for title, _, _ in columns]]
+    if "Material" in df.columns:
+        df["Material"] = df["Material"].astype(str).str.lstrip("0")
+    if "Data do documento" in df.columns:
+        df["Data do documento"] = parse_bedat(df["Data do documento"])
+    order = {material: position for position, material in enumerate(materials)}
+    sort_keys = [title for title in ("Documento de compras", "Item") if title in df.columns]
+    df = df.assign(_order=df["Material"].map(order)).sort_values(["_order"] + sort_keys, kind="stable")
+    return df.drop(columns="_order").reset_index(drop=True)
+
+
+def extract_history(materials, plants=PLANTS, since=None, until=None, window_days=DEFAULT_WINDOW_DAYS,
+                    workers=DEFAULT_WORKERS, connection_string=CONNECTION_STRING, catalog=None,
+                    skip_deleted=False):
+    """
+    Pulls the purchase order items of the materials at the plants in bulk from EKPO/EKKO.
+    Returns (DataFrame shaped like the ME2M export, titles of the ME2M columns the DSN denies).
+    The DataFrame is None when a field the query depends on is denied.
+    With skip_deleted, items flagged for deletion are left out.
+    """
+    readable, denied, deletion_flag = readable_fields(catalog)
+    if any("." in title for title in denied):
+        print(f"Key fields denied by the DSN: {[title for title in denied if '.' in title]}.")
+        return None, denied
+    if skip_deleted and not deletion_flag:
+        print("EKPO.LOEKZ is not readable; items flagged for deletion are included.")
+
+    keys = list(dict.fromkeys(to_matnr(material) for material in materials))
+    if not keys:
+        print("No materials to look up.")
+        return pd.DataFrame(columns=[title for title, _, _ in readable]), denied
+
+    windows = date_windows(since, until, window_days)
+    partitions = history_partitions(readable, keys, windows, plants, skip_deleted and deletion_flag)
+    print(f"Order history for {len(keys)} materials, document dates from {since or 'the first'} "
+          f"to {until or 'the last'}: {len(windows)} date windows, {len(partitions)} queries.")
+
+    df = run_partitions(partitions, max(1, workers), connection_string)
+    with span("shape history", rows=len(df)):
+        df = shape_like_me2m(df, readable, [str(material).strip().lstrip("0") for material in materials])
+    return df, denied
+
+
+def missing_me2m_columns(df):
+    """Titles of the ME2M export columns that df lacks."""
+    return [title for title, _, _ in ME2M_COLUMNS if title not in df.columns]
+
+
+def save_history(df, excel=True, path=HISTORY_FILE):
+    """Writes the history as path (HISTORY_FILE) and, with excel, HISTORY_EXCEL_FILE, like 2_historico does."""
+    history_path = os.path.join(os.getcwd(), path)
+    with span("parquet write"):
+        df.to_parquet(history_path, index=False)
+    print(f"Order history saved to {history_path} ({len(df)} rows).")
+    if excel:
+        final_path = os.path.join(os.getcwd(), HISTORY_EXCEL_FILE)
+        with span("excel write"):
+            saved = parquet_to_excel(history_path, final_path)
+        if saved:
+            print(f"Merged data saved to {final_path}")
+
+
+def read_materials(path=MATERIALS_FILE):
+    return pd.read_excel(path)[MATERIALS_COLUMN].astype(str).tolist()
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the ME2M order history of the material list from EKPO/EKKO.")
+    parser.add_argument("--since", type=parse_date, default=None,
+                        help="first document date, YYYY-MM-DD (default: no limit, like ME2M)")
+    parser.add_argument("--until", type=parse_date, default=None,
+                        help="last document date, YYYY-MM-DD (default: no limit, like ME2M)")
+    parser.add_argument("--window-days", type=int, default=DEFAULT_WINDOW_DAYS,
+                        help=f"days of document dates per query with --since (default: {DEFAULT_WINDOW_DAYS})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"parallel connections running the queries (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--skip-deleted", action="store_true",
+                        help="leave out items flagged for deletion (EKPO.LOEKZ = 'L'), which ME2M lists")
+    parser.add_argument("--no-excel", action="store_true",
+                        help=f"write only {HISTORY_FILE}, without {HISTORY_EXCEL_FILE}")
+    parser.add_argument("--output", default=HISTORY_FILE,
+                        help=f"Parquet file to write (default: {HISTORY_FILE}; the pipeline writes {HISTORY_ODBC_FILE} "
+                             "for 2_historico_de_pedidos.py --odbc-file)")
+    parser.add_argument("--allow-denied", action="store_true",
+                        help="when a key field is denied, write an empty history with the readable columns "
+                             "instead of failing, so 2_historico_de_pedidos.py --odbc-file runs ME2M for it")
+    args = parser.parse_args()
+
+    materials = read_materials()
+    try:
+        df, denied = extract_history(materials, since=args.since, until=args.until,
+                                     window_days=max(1, args.window_days), workers=args.workers,
+                                     skip_deleted=args.skip_deleted)
+    except Exception as e:
+        print("Error retrieving the order history:", e)
+        sys.exit(1)
+
+    if denied:
+        print(f"ME2M columns the DSN denies: {denied}. Run 2_historico_de_pedidos.py for them.")
+    if df is None:
+        if not args.allow_denied:
+            sys.exit(1)
+        readable, _, _ = readable_fields()
+        df = pd.DataFrame(columns=[title for title, _, _ in readable])
+    save_history(df, not args.no_excel, args.output)
+    TRACER.finish("historico_odbc")
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1 @@
-pip install pywin32 pandas openpyxl
\ No newline at end of file
+pip install pywin32 pandas openpyxl psutil pyarrow
\ No newline at end of file
@@ -0,0 +1,163 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+
+from extracao_odbc import CONNECTION_STRING, DEFAULT_BATCH_SIZE, PLANTS, build_select
+from extracao_paralela import ConnectionPool, plant_partitions
+from rastreamento import span
+import tipos_sap
+from tipos_sap import FIELD_TYPES, PRICE, PRICE_SCALE
+from transformacoes import RENAME_MARC_MARA, RENAME_MARC_MBEW, format_nm_expr
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+ENGINES = ["pandas", "polars"]
+DEFAULT_ENGINE = "pandas"
+
+
+def price_type():
+    """Polars dtype matching tipos_sap.PRICE_DTYPE."""
+    return {
+        "float64": pl.Float64,
+        "float32": pl.Float32,
+        "decimal": pl.Decimal(15, PRICE_SCALE),
+    }[tipos_sap.PRICE_DTYPE]
+
+
+def fetch_arrow(conn, sql, params=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Executes the query and returns the result as a pyarrow Table built from RecordBatches of
+    at most batch_size rows, so no pandas frame is made on the way. Batches whose inferred
+    types differ (a column that is all NULL in one batch, ...) are promoted to a common type.
+    """
+    cursor = conn.cursor()
+    try:
+        with span("execute"):
+            if params:
+                cursor.execute(sql, params)
+            else:
+                cursor.execute(sql)
+        columns = [column[0] for column in cursor.description]
+        batches = []
+        while True:
+            with span("fetchmany", batch_size=batch_size):
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                values = list(zip(*rows))
+                batches.append(pa.table({col: pa.array(values[i]) for i, col in enumerate(columns)}))
+    finally:
+        cursor.close()
+    if not batches:
+        return pa.table({col: pa.array([], type=pa.null()) for col in columns})
+    return pa.concat_tables(batches, promote_options="permissive")
+
+
+def fetch_plants_arrow(db, table, columns, plant_column, workers=1, matnr_splits=()):
+    """
+    Arrow counterpart of extracao_paralela.fetch_plants: one query on db's connection when
+    workers is 1, otherwise one partition per plant (and MATNR range) on a connection pool.
+    """
+    if workers <= 1 and not matnr_splits:
+        plant_list = ",".join(f"'{plant}'" for plant in PLANTS)
+        with span("read_arrow", table=table):
+            return fetch_arrow(db.get(), build_select(table, columns, f"{plant_column} IN ({plant_list})"))
+    partitions = plant_partitions(table, columns, plant_column, PLANTS, matnr_splits)
+    return run_partitions_arrow(partitions, max(workers, 1), db.connection_string)
+
+
+def run_partitions_arrow(partitions, workers, connection_string=CONNECTION_STRING):
+    """
+    Runs the (label, sql, params) partitions on a pool of at most `workers` connections and
+    concatenates the Arrow results in partition order.
+    """
+    pool = ConnectionPool(workers, connection_string)
+
+    def fetch(partition):
+        label, sql, params = partition
+        start = time.perf_counter()
+        with pool.connection() as conn, span("read_arrow", partition=label):
+            result = fetch_arrow(conn, sql, params)
+        return label, result, time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(fetch, partitions))
+    finally:
+        pool.close()
+
+    for label, result, elapsed in results:
+        print(f"{label}: {result.num_rows} rows in {elapsed:.2f} seconds")
+    print(f"{len(partitions)} partitions on {workers} connections in {time.perf_counter() - start:.2f} seconds.")
+    return pa.concat_tables([result for _, result, _ in results], promote_options="permissive")
+
+
+def normalize(lf):
+    """
+    Casts an extract to the types the transformations expect, as a step of the lazy plan:
+    price fields to the PRICE_DTYPE of tipos_sap, DEC values read as Arrow decimals to
+    integers or floats (like compact_frame does for pandas) and categoricals, as stored by the
+    pandas path in the cache, back to strings so the join keys of both sides agree.
+    """
+    casts = []
+    for name, dtype in lf.collect_schema().items():
+        if FIELD_TYPES.get(name.upper()) == PRICE:
+            casts.append(pl.col(name).cast(price_type()).round(PRICE_SCALE))
+        elif isinstance(dtype, pl.Decimal):
+            casts.append(pl.col(name).cast(pl.Int64 if dtype.scale == 0 else pl.Float64))
+        elif isinstance(dtype, (pl.Categorical, pl.Enum)):
+            casts.append(pl.col(name).cast(pl.String))
+    return lf.with_columns(casts) if casts else lf
+
+
+def read_lazy(cache, table, columns, where, fetch, refresh=False):
+    """
+    Returns the extract as a LazyFrame: a Parquet scan of the cached file when it is fresh,
+    otherwise fetch() (a pyarrow Table with exactly the requested columns), which is stored
+    in the cache unless cache is None.
+    """
+    if cache is not None and not refresh:
+        path = cache.locate(table, columns, where)
+        if path is not None:
+            print(f"{table} read from local cache.")
+            return normalize(pl.scan_parquet(path).select(list(columns)))
+    result = fetch()
+    if cache is not None:
+        cache.put(table, columns, where, result)
+    return normalize(pl.from_arrow(result).lazy())
+
+
+def rename(lf, mapping):
+    # pandas' rename skips names that are missing, e.g. columns left out by the column catalog
+    names = lf.collect_schema().names()
+    return lf.rename({old: new for old, new in mapping.items() if old in names})
+
+
+def transform_marc_mara(marc, mara=None):
+    """Lazy counterpart of transform() in script 1."""
+    lf = marc
+    if mara is not None:
+        lf = lf.join(mara, on="MATNR", how="left", maintain_order="left")
+    return rename(lf, RENAME_MARC_MARA).with_columns(format_nm_expr("NM"))
+
+
+def transform_marc_mbew(marc, mbew):
+    """Lazy counterpart of transform() in script 3."""
+    lf = marc.join(mbew, on=["WERKS", "MATNR"], how="left", maintain_order="left")
+    return rename(lf, RENAME_MARC_MBEW).with_columns(format_nm_expr("NM"))
+
+
+def collect(lf):
+    """
+    Runs the query plan on Polars' thread pool and returns a pandas DataFrame for the
+    Excel writer.
+    """
+    with span("polars collect", threads=pl.thread_pool_size()):
+        df = lf.collect()
+    with span("to_pandas", rows=df.height):
+        return df.to_pandas()
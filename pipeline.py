@@ -0,0 +1,408 @@
+import argparse
+import ast
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from cache_local import CACHE_DIR
+from rastreamento import TRACER, span
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(threadName)s - %(levelname)s - %(message)s"
+)
+
+# Duration of each run, the command used and the stage logs
+STATE_FILE = os.path.join(CACHE_DIR, "pipeline", "execucoes.json")
+LOG_DIR = os.path.join(CACHE_DIR, "pipeline", "logs")
+
+# Runs kept per stage in the duration history
+HISTORY_RUNS = 30
+
+# DSN and SAP GUI extracts are good for one night; the column probes, for a week
+NIGHTLY_MAX_AGE_HOURS = 20
+PROBE_MAX_AGE_HOURS = 7 * 24
+
+# Resources that take one stage at a time: the DSN (with the local cache in cache/) and the
+# SAP GUI. A stage reserves every resource it may use
+ODBC = "odbc"
+SAP_GUI = "sapgui"
+
+# Stage statuses
+RAN = "ran"
+SKIPPED = "up to date"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+
+def probe_file(table):
+    """Copy of the table's last probe that ColumnCatalog writes next to the catalog."""
+    return os.path.join(CACHE_DIR, "sondagens", f"{table}.json")
+
+
+class Stage:
+    """
+    A pipeline stage: a script with arguments, the files or folders it reads (inputs) and the
+    ones it writes (outputs). "{hoje}" in a path becomes today's date (YYYY-MM-DD).
+    A stage depends on the stages writing any of its inputs and does not run alongside another
+    stage using any of its resources.
+    """
+
+    def __init__(self, name, script, args=(), inputs=(), outputs=(), resources=(), max_age_hours=None):
+        self.name = name
+        self.script = script
+        self.args = list(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.resources = set(resources)
+        self.max_age_hours = max_age_hours
+
+    def command(self):
+        return [os.path.basename(sys.executable), self.script] + self.args
+
+    def paths(self, paths):
+        today = datetime.today().strftime("%Y-%m-%d")
+        return [os.path.normpath(path.format(hoje=today)) for path in paths]
+
+
+STAGES = [
+    Stage("sondagem_MARC", "verificacao_de_acesso_EKPO.py", ["MARC"],
+          outputs=[probe_file("MARC")], resources=[ODBC], max_age_hours=PROBE_MAX_AGE_HOURS),
+    Stage("sondagem_MARA", "verificacao_de_acesso_EKPO.py", ["MARA"],
+          outputs=[probe_file("MARA")], resources=[ODBC], max_age_hours=PROBE_MAX_AGE_HOURS),
+    Stage("sondagem_MBEW", "verificacao_de_acesso_EKPO.py", ["MBEW"],
+          outputs=[probe_file("MBEW")], resources=[ODBC], max_age_hours=PROBE_MAX_AGE_HOURS),
+    Stage("sondagem_EKPO", "verificacao_de_acesso_EKPO.py", ["EKPO"],
+          outputs=[probe_file("EKPO")], resources=[ODBC], max_age_hours=PROBE_MAX_AGE_HOURS),
+    Stage("sondagem_EKKO", "verificacao_de_acesso_EKPO.py", ["EKKO"],
+          outputs=[probe_file("EKKO")], resources=[ODBC], max_age_hours=PROBE_MAX_AGE_HOURS),
+    Stage("parametros_MARC", "1_parametros_de_ressuprimento_MARC.py",
+          inputs=[probe_file("MARC"), probe_file("MARA")], outputs=["parametros_de_ressuprimento_MARC.xlsx"],
+          resources=[ODBC], max_age_hours=NIGHTLY_MAX_AGE_HOURS),
+    Stage("parametros_MARC_MBEW", "3_parametros_de_ressuprimento_MARC_MBEW.py",
+          inputs=[probe_file("MARC"), probe_file("MBEW")], outputs=["deliver/parametros_de_ressuprimento_{hoje}.xlsx"],
+          resources=[ODBC], max_age_hours=NIGHTLY_MAX_AGE_HOURS),
+    # The history comes from the DSN in a few queries; the SAP GUI stage only opens ME2M when the
+    # DSN denied a column, so it can run alongside the DSN extracts
+    Stage("historico_odbc", "historico_odbc.py",
+          ["--output", "historico_odbc.parquet", "--no-excel", "--allow-denied"],
+          inputs=["lista_de_NMs.xlsx", probe_file("EKPO"), probe_file("EKKO")],
+          outputs=["historico_odbc.parquet"], resources=[ODBC], max_age_hours=NIGHTLY_MAX_AGE_HOURS),
+    # merged_data.xlsx is not an output: parquet_to_excel skips it when the history has more rows
+    # than a sheet holds, and the stage is still correct then
+    Stage("historico_de_pedidos", "2_historico_de_pedidos.py", ["--odbc-file", "historico_odbc.parquet"],
+          inputs=["lista_de_NMs.xlsx", "historico_odbc.parquet"],
+          outputs=["historico_de_pedidos.parquet"],
+          resources=[SAP_GUI], max_age_hours=NIGHTLY_MAX_AGE_HOURS),
+    Stage("unificar_saidas", "unificar_saidas.py",
+          inputs=["output"], outputs=["deliver/historico_de_pedidos_CONSOLIDADO.csv"]),
+]
+
+
+def local_sources(script, base_dir="."):
+    """The script and the local modules it imports, directly or indirectly."""
+    sources = []
+    pending = [os.path.join(base_dir, script)]
+    while pending:
+        path = pending.pop()
+        if path in sources or not os.path.exists(path):
+            continue
+        sources.append(path)
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            pending.extend(os.path.join(base_dir, name.split(".")[0] + ".py") for name in names)
+    return sources
+
+
+def newest_mtime(path):
+    """mtime of a file, or the newest of a folder and everything in it; None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    newest = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                newest = max(newest, os.path.getmtime(os.path.join(root, name)))
+    return newest
+
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    temp_path = STATE_FILE + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, STATE_FILE)
+
+
+def dependencies(stages):
+    """Returns {stage: [stages writing any of its inputs]}."""
+    producers = {}
+    for stage in stages:
+        for path in stage.paths(stage.outputs):
+            producers.setdefault(path, []).append(stage.name)
+    return {stage.name: sorted({producer for path in stage.paths(stage.inputs)
+                                for producer in producers.get(path, []) if producer != stage.name})
+            for stage in stages}
+
+
+def stale_reason(stage, state, now=None):
+    """
+    Says why the stage needs to run, or None if it is up to date: every output exists and is
+    newer than the inputs, the script and the modules it imports, the command is the same as in
+    the last run and no output is older than max_age_hours.
+    """
+    now = now or time.time()
+    outputs = stage.paths(stage.outputs)
+    output_times = [newest_mtime(path) for path in outputs]
+    missing = [path for path, mtime in zip(outputs, output_times) if mtime is None]
+    if missing:
+        return f"missing output {missing[0]}"
+    oldest_output = min(output_times)
+
+    last = state.get(stage.name, {})
+    if last.get("command") != stage.command():
+        return "command changed"
+    if last.get("status") not in (None, RAN):
+        return f"last run {last['status']}"
+
+    for path in stage.paths(stage.inputs) + local_sources(stage.script):
+        mtime = newest_mtime(path)
+        if mtime is not None and mtime > oldest_output:
+            return f"{path} is newer than the outputs"
+
+    if stage.max_age_hours is not None and now - oldest_output > stage.max_age_hours * 3600:
+        return f"outputs older than {stage.max_age_hours} h"
+    return None
+
+
+def plan(stages, deps, state, force=()):
+    """
+    Returns {stage: reason to run} for the stages that are out of date. As in make, a stage
+    also runs when any stage it depends on will run.
+    """
+    reasons = {}
+    for stage in stages:
+        if stage.name in force or "all" in force:
+            reasons[stage.name] = "forced"
+        else:
+            reason = stale_reason(stage, state)
+            if reason:
+                reasons[stage.name] = reason
+
+    changed = True
+    while changed:
+        changed = False
+        for stage in stages:
+            if stage.name in reasons:
+                continue
+            upstream = [dep for dep in deps[stage.name] if dep in reasons]
+            if upstream:
+                reasons[stage.name] = f"{upstream[0]} runs first"
+                changed = True
+    return reasons
+
+
+def run_stage(stage):
+    """
+    Runs the stage's script with its output in cache/pipeline/logs/<stage>.log. Returns the exit
+    code, or -1 if the script exited with 0 without writing some output: the scripts print their
+    errors and exit normally, so only the outputs tell whether the stage worked.
+    """
+    os.makedirs(LOG_DIR, exist_ok=True)
+    missing = [path for path in stage.paths(stage.inputs) if not os.path.exists(path)]
+    if missing:
+        logging.error("Stage %s: input %s does not exist.", stage.name, missing[0])
+        return -1
+
+    log_path = os.path.join(LOG_DIR, f"{stage.name}.log")
+    logging.info("Starting %s (log in %s).", stage.name, log_path)
+    # mtime of each output before running: an output the stage wrote exists and has another mtime
+    before = {path: newest_mtime(path) for path in stage.paths(stage.outputs)}
+    with span(f"stage: {stage.name}", script=stage.script), open(log_path, "w", encoding="utf-8") as log:
+        # No terminal: the final input() of 2_historico does not wait for anyone
+        completed = subprocess.run([sys.executable, stage.script] + stage.args, stdout=log,
+                                   stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+    if completed.returncode != 0:
+        return completed.returncode
+
+    not_written = [path for path, mtime in before.items() if newest_mtime(path) in (None, mtime)]
+    if not_written:
+        logging.error("Stage %s: exited normally but did not write %s (see %s).",
+                      stage.name, not_written[0], log_path)
+        return -1
+    return 0
+
+
+def critical_path(timings, deps, resources):
+    """
+    Chain of stages that set the duration of the run: from the last one to finish, always steps
+    back to the dependency (or stage sharing a resource) that finished last before it started.
+    """
+    if not timings:
+        return []
+    path = [max(timings, key=lambda name: timings[name][1])]
+    while True:
+        name = path[-1]
+        start = timings[name][0]
+        before = [other for other in timings if other not in path
+                  and (other in deps[name] or resources[name] & resources[other])
+                  and timings[other][1] <= start + 0.5]
+        if not before:
+            return list(reversed(path))
+        path.append(max(before, key=lambda other: timings[other][1]))
+
+
+def run_pipeline(stages, reasons, deps, state, jobs):
+    """
+    Runs the stages in reasons in dependency order and one per resource, at most `jobs` at a time.
+    Returns {stage: (status, start, end)} with times relative to the start of the run.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    results = {name: (SKIPPED, None, None) for name in by_name if name not in reasons}
+    waiting = [stage.name for stage in stages if stage.name in reasons]
+    running = {}
+    origin = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="stage") as executor:
+        while waiting or running:
+            busy = {resource for name in running.values() for resource in by_name[name].resources}
+            for name in list(waiting):
+                stage = by_name[name]
+                if any(dep in waiting or dep in running.values() for dep in deps[name]):
+                    continue
+                failed_deps = [dep for dep in deps[name] if results[dep][0] in (FAILED, BLOCKED)]
+                if failed_deps:
+                    logging.warning("Skipping %s: %s did not finish.", name, failed_deps[0])
+                    waiting.remove(name)
+                    results[name] = (BLOCKED, None, None)
+                    continue
+                if len(running) >= jobs or stage.resources & busy:
+                    continue
+                waiting.remove(name)
+                busy |= stage.resources
+                future = executor.submit(run_stage, stage)
+                running[future] = name
+                results[name] = (None, time.perf_counter() - origin, None)
+
+            if not running:
+                if waiting:
+                    raise RuntimeError(f"Dependency cycle between stages: {', '.join(waiting)}")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                start = results[name][1]
+                end = time.perf_counter() - origin
+                code = future.result()
+                status = RAN if code == 0 else FAILED
+                results[name] = (status, start, end)
+                log = logging.info if status == RAN else logging.error
+                log("%s %s in %.1f s%s.", name, "finished" if status == RAN else "failed", end - start,
+                    "" if status == RAN else f" (exit code {code})")
+
+                entry = state.setdefault(name, {})
+                entry["command"] = by_name[name].command()
+                entry["status"] = status
+                entry["runs"] = (entry.get("runs", []) + [{
+                    "started_at": datetime.fromtimestamp(time.time() - (end - start)).isoformat(timespec="seconds"),
+                    "duration": round(end - start, 3),
+                    "status": status,
+                }])[-HISTORY_RUNS:]
+                save_state(state)
+    return results
+
+
+def report(stages, results, deps, state, wall_time):
+    timings = {name: (start, end) for name, (status, start, end) in results.items() if start is not None}
+    resources = {stage.name: stage.resources for stage in stages}
+    logging.info(f"{'stage':<24} {'status':<12} {'seconds':>9} {'median s':>9}")
+    for stage in stages:
+        status, start, end = results[stage.name]
+        runs = sorted(run["duration"] for run in state.get(stage.name, {}).get("runs", []) if run["status"] == RAN)
+        median = f"{runs[len(runs) // 2]:.1f}" if runs else "-"
+        seconds = f"{end - start:.1f}" if start is not None and end is not None else "-"
+        logging.info(f"{stage.name:<24} {status:<12} {seconds:>9} {median:>9}")
+
+    path = critical_path(timings, deps, resources)
+    if path:
+        logging.info("Critical path (%.1f s wall time): %s", wall_time,
+                     " -> ".join(f"{name} ({timings[name][1] - timings[name][0]:.1f} s)" for name in path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the extraction stages in dependency order, skipping the ones that are up to date.")
+    parser.add_argument("stages", nargs="*",
+                        help="stages to consider, with the stages they depend on (default: all)")
+    parser.add_argument("--force", nargs="*", default=None, metavar="STAGE",
+                        help="run these stages even if up to date (no names: all)")
+    parser.add_argument("--jobs", type=int, default=len(STAGES),
+                        help="stages running at the same time, on top of the limit of one per resource (default: all)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only show what would run and why")
+    parser.add_argument("--list", action="store_true", help="list the stages, their resources and dependencies")
+    args = parser.parse_args()
+
+    all_deps = dependencies(STAGES)
+    names = [stage.name for stage in STAGES]
+    unknown = [name for name in args.stages + (args.force or []) if name not in names]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)} (choose from {', '.join(names)})")
+
+    # The requested stages and, recursively, the ones they depend on
+    selected = set(args.stages or names)
+    pending = list(selected)
+    while pending:
+        for dep in all_deps[pending.pop()]:
+            if dep not in selected:
+                selected.add(dep)
+                pending.append(dep)
+    stages = [stage for stage in STAGES if stage.name in selected]
+    deps = {stage.name: all_deps[stage.name] for stage in stages}
+
+    if args.list:
+        for stage in stages:
+            logging.info("%s: %s %s [resources: %s] after: %s", stage.name, stage.script, " ".join(stage.args),
+                         ", ".join(sorted(stage.resources)) or "-", ", ".join(deps[stage.name]) or "-")
+        return
+
+    state = load_state()
+    force = {"all"} if args.force == [] else set(args.force or ())
+    reasons = plan(stages, deps, state, force)
+    for stage in stages:
+        if stage.name in reasons:
+            logging.info("%s: will run (%s).", stage.name, reasons[stage.name])
+        else:
+            logging.info("%s: up to date.", stage.name)
+    if args.dry_run or not reasons:
+        return
+
+    start = time.perf_counter()
+    results = run_pipeline(stages, reasons, deps, state, max(1, args.jobs))
+    report(stages, results, deps, state, time.perf_counter() - start)
+    TRACER.finish("pipeline", logging.info)
+
+    if any(status in (FAILED, BLOCKED) for status, _, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Folder receiving one JSON-lines and one Chrome trace file per run.
+TRACE_DIR = "traces"
+
+# GUI methods that cost a round trip to the SAP server and get a span of their own.
+TRACED_GUI_METHODS = ("findById", "press", "sendVKey", "select", "doubleClickNode", "resizeWorkingPane")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class Tracer:
+    """
+    Collects timing spans (name, start, duration, thread, attributes) from every thread of a run.
+    Spans nest naturally: a span opened inside another one simply starts and ends within it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **attrs):
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            end = time.perf_counter()
+            record = {
+                "name": name,
+                "start": start - self.origin,
+                "duration": end - start,
+                "thread": threading.current_thread().name,
+                "attrs": attrs,
+            }
+            with self.lock:
+                self.spans.append(record)
+
+    def traced(self, name=None):
+        """Decorator recording a span around each call of the function."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        """Discards the recorded spans and restarts the clock, e.g. between benchmark runs."""
+        with self.lock:
+            self.spans = []
+            self.origin = time.perf_counter()
+            self.started_at = time.time()
+
+    def summary(self):
+        """Returns {name: (count, total, p50, p95, max)} in seconds, slowest total first."""
+        durations = {}
+        with self.lock:
+            for record in self.spans:
+                durations.setdefault(record["name"], []).append(record["duration"])
+        result = {}
+        for name, values in durations.items():
+            values.sort()
+            result[name] = (len(values), sum(values), percentile(values, 0.5), percentile(values, 0.95), values[-1])
+        return dict(sorted(result.items(), key=lambda item: item[1][1], reverse=True))
+
+    def write_jsonl(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for record in self.spans:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def write_chrome_trace(self, path):
+        """Writes the spans in the Trace Event format read by chrome://tracing and Perfetto."""
+        threads = {}
+        events = []
+        for record in self.spans:
+            tid = threads.setdefault(record["thread"], len(threads) + 1)
+            events.append({
+                "name": record["name"],
+                "ph": "X",
+                "ts": round(record["start"] * 1e6),
+                "dur": round(record["duration"] * 1e6),
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {key: str(value) for key, value in record["attrs"].items()},
+            })
+        for thread, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": thread}})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def finish(self, run_name, log=print, trace_dir=TRACE_DIR):
+        """
+        Writes traces/<run_name>_<timestamp>.jsonl and .trace.json and logs the p50/p95 summary.
+        """
+        if not self.spans:
+            return
+        os.makedirs(trace_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started_at))
+        base = os.path.join(trace_dir, f"{run_name}_{stamp}")
+        self.write_jsonl(base + ".jsonl")
+        self.write_chrome_trace(base + ".trace.json")
+
+        log(f"Timing summary ({len(self.spans)} spans, trace in {base}.trace.json):")
+        log(f"{'step':<40} {'count':>6} {'total s':>9} {'p50 s':>8} {'p95 s':>8} {'max s':>8}")
+        for name, (count, total, p50, p95, longest) in self.summary().items():
+            log(f"{name[:40]:<40} {count:>6} {total:>9.2f} {p50:>8.3f} {p95:>8.3f} {longest:>8.3f}")
+
+
+# One tracer per process, shared by every module.
+TRACER = Tracer()
+span = TRACER.span
+traced = TRACER.traced
+
+
+class TracedGuiObject:
+    """
+    Wraps a SAP GUI Scripting object so the calls in TRACED_GUI_METHODS are recorded as spans
+    (with the control id). Objects returned by findById are wrapped as well; everything else,
+    including property writes such as .text, goes straight to the wrapped object.
+    """
+
+    def __init__(self, wrapped, control_id=""):
+        object.__setattr__(self, "_wrapped", wrapped)
+        object.__setattr__(self, "_control_id", control_id)
+
+    def __getattr__(self, name):
+        value = getattr(self._wrapped, name)
+        if name not in TRACED_GUI_METHODS or not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            control_id = args[0] if name == "findById" and args else self._control_id
+            with span(f"gui: {name}", id=control_id):
+                result = value(*args, **kwargs)
+            if name == "findById" and result is not None:
+                return TracedGuiObject(result, control_id)
+            return result
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._wrapped, name, value)
+
+
+def unwrap(obj):
+    """Returns the GUI object behind a TracedGuiObject (or obj itself)."""
+    return obj._wrapped if isinstance(obj, TracedGuiObject) else obj
@@ -0,0 +1,110 @@
+import math
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import xlsxwriter
+
+from rastreamento import span
+
+HEADER_FORMAT = {
+    "bold": True,
+    "text_wrap": True,
+    "valign": "top",
+    "fg_color": "#D7E4BC",
+    "border": 1
+}
+
+# Column widths are measured on at most this many rows per batch.
+DEFAULT_WIDTH_SAMPLE = 20000
+
+# Rows converted to Python objects at a time while writing.
+CHUNK_ROWS = 10000
+
+
+def column_width(series, sample_rows=DEFAULT_WIDTH_SAMPLE):
+    """
+    Returns the length of the longest value of series as text. Integer columns are measured
+    exactly from their min and max; other columns on a sample of sample_rows values,
+    using Arrow's length kernel instead of a per-value Python len().
+    """
+    if len(series) == 0:
+        return 0
+    if pd.api.types.is_integer_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return max(len(str(series.min())), len(str(series.max())))
+    if len(series) > sample_rows:
+        series = series.sample(n=sample_rows, random_state=0)
+    lengths = pc.utf8_length(pa.array(series.astype(str), type=pa.string()))
+    return pc.max(lengths).as_py() or 0
+
+
+def to_cell(value):
+    # Same cell values as DataFrame.to_excel: missing values empty, infinities as text.
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if math.isinf(value):
+            return "inf" if value > 0 else "-inf"
+    elif value is None or value is pd.NaT or value is pd.NA:
+        return None
+    return value
+
+
+class ExcelStreamWriter:
+    """
+    Appends DataFrame batches to a single worksheet using xlsxwriter's constant_memory mode,
+    so rows are flushed to disk as they are written. The header gets the usual green format
+    and column widths are tracked across batches.
+    """
+
+    def __init__(self, output_file, sheet_name, sample_rows=DEFAULT_WIDTH_SAMPLE):
+        self.output_file = output_file
+        self.sample_rows = sample_rows
+        self.workbook = xlsxwriter.Workbook(output_file, {
+            "constant_memory": True,
+            "default_date_format": "yyyy-mm-dd hh:mm:ss",
+        })
+        self.worksheet = self.workbook.add_worksheet(sheet_name)
+        self.header_format = self.workbook.add_format(HEADER_FORMAT)
+        self.columns = None
+        self.widths = []
+        self.next_row = 0
+
+    def write_batch(self, df):
+        with span("excel write batch", rows=len(df)):
+            self._write_batch(df)
+
+    def _write_batch(self, df):
+        if self.columns is None:
+            self.columns = list(df.columns)
+            self.worksheet.write_row(0, 0, self.columns, self.header_format)
+            self.widths = [len(str(col)) for col in self.columns]
+            self.next_row = 1
+
+        for col_num, col_name in enumerate(self.columns):
+            width = column_width(df[col_name], self.sample_rows)
+            self.widths[col_num] = max(self.widths[col_num], width)
+
+        # Only CHUNK_ROWS rows are converted to Python objects at a time.
+        for start in range(0, len(df), CHUNK_ROWS):
+            chunk = df.iloc[start:start + CHUNK_ROWS][self.columns].astype(object)
+            for row in chunk.itertuples(index=False, name=None):
+                self.worksheet.write_row(self.next_row, 0, [to_cell(value) for value in row])
+                self.next_row += 1
+
+    def close(self):
+        for col_num, width in enumerate(self.widths):
+            self.worksheet.set_column(col_num, col_num, width + 2)
+        self.workbook.close()
+
+
+def write_report(df, output_file, sheet_name, sample_rows=DEFAULT_WIDTH_SAMPLE):
+    """
+    Writes df to output_file with the green header and fitted column widths.
+    """
+    with span("excel write", file=output_file, rows=len(df)):
+        writer = ExcelStreamWriter(output_file, sheet_name, sample_rows)
+        try:
+            writer.write_batch(df)
+        finally:
+            writer.close()
@@ -0,0 +1,86 @@
+import logging
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from relatorio_excel import ExcelStreamWriter
+
+# Rows an Excel sheet holds, header included
+EXCEL_MAX_ROWS = 1048576
+
+# Full order history in Parquet; the spreadsheet is built from it
+HISTORY_FILE = "historico_de_pedidos.parquet"
+HISTORY_EXCEL_FILE = "merged_data.xlsx"
+
+# History read from the DSN by historico_odbc.py in the pipeline, before ME2M fills in what is missing
+HISTORY_ODBC_FILE = "historico_odbc.parquet"
+
+
+def _merge_types(types):
+    """Common type of a column across files: the same type, numbers widened to float64, or text."""
+    types = [t for t in types if not pa.types.is_null(t)]
+    if not types:
+        return pa.null()
+    if all(t == types[0] for t in types):
+        return types[0]
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return pa.string()
+
+
+def unify_schema(paths):
+    """
+    Single schema for all files, read from the Parquet footers only: columns in the order they
+    first appear, types reconciled by _merge_types.
+    """
+    columns = {}
+    for path in paths:
+        for field in pq.read_schema(path):
+            columns.setdefault(field.name, []).append(field.type)
+    return pa.schema([(name, _merge_types(types)) for name, types in columns.items()])
+
+
+def conform(table, schema):
+    """Fits the table to the schema: missing columns become nulls and types are cast."""
+    arrays = []
+    for field in schema:
+        if field.name in table.column_names:
+            arrays.append(table[field.name].cast(field.type))
+        else:
+            arrays.append(pa.nulls(table.num_rows, field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_dataset(paths, output_file):
+    """
+    Combines the Parquet files in paths into output_file, one row group per file, reading one
+    file at a time. Returns the total number of rows.
+    """
+    schema = unify_schema(paths)
+    rows = 0
+    with pq.ParquetWriter(output_file, schema) as writer:
+        for path in paths:
+            table = conform(pq.read_table(path), schema)
+            writer.write_table(table)
+            rows += table.num_rows
+    return rows
+
+
+def parquet_to_excel(parquet_file, output_file, sheet_name="Sheet1"):
+    """
+    Builds the spreadsheet from the Parquet file, one row group at a time. Returns False without
+    writing anything if the rows do not fit in one sheet.
+    """
+    parquet = pq.ParquetFile(parquet_file)
+    if parquet.metadata.num_rows >= EXCEL_MAX_ROWS:
+        logging.error("%s has %s rows, more than an Excel sheet holds; skipping %s.",
+                      parquet_file, parquet.metadata.num_rows, output_file)
+        return False
+
+    writer = ExcelStreamWriter(output_file, sheet_name)
+    try:
+        for index in range(parquet.num_row_groups):
+            writer.write_batch(parquet.read_row_group(index).to_pandas())
+    finally:
+        writer.close()
+    return True
@@ -0,0 +1,113 @@
+import logging
+import os
+import time
+from collections import defaultdict, deque
+
+from rastreamento import TracedGuiObject, span, unwrap
+
+
+class WaitEngine:
+    """
+    Event-driven waits for SAP GUI Scripting: instead of a fixed time.sleep, each step polls
+    session.Busy, the expected control (findById) or the exported file and returns as soon as
+    SAP is ready.
+
+    Each step's timeout is learned from its recent durations (factor x the longest of the
+    last `history` waits), bounded to [min_timeout, max_timeout].
+    """
+
+    def __init__(self, default_timeout=30.0, min_timeout=5.0, max_timeout=120.0,
+                 history=20, factor=3.0, poll_interval=0.1):
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.factor = factor
+        self.poll_interval = poll_interval
+        self.durations = defaultdict(lambda: deque(maxlen=history))
+        self.timeouts = defaultdict(int)
+
+    def timeout_for(self, step):
+        recent = self.durations[step]
+        if len(recent) < 3:
+            return self.default_timeout
+        return min(self.max_timeout, max(self.min_timeout, self.factor * max(recent)))
+
+    def _poll(self, step, condition, timeout, description):
+        """Calls condition() until it returns something truthy; records and returns (result, seconds)."""
+        timeout = timeout if timeout is not None else self.timeout_for(step)
+        start = time.monotonic()
+        with span(f"wait: {step}"):
+            while True:
+                result = condition()
+                elapsed = time.monotonic() - start
+                if result:
+                    self.durations[step].append(elapsed)
+                    logging.debug("Wait '%s' finished after %.2f s.", step, elapsed)
+                    return result, elapsed
+                if elapsed >= timeout:
+                    self.timeouts[step] += 1
+                    raise TimeoutError(f"Timed out after {timeout:.1f} s waiting for {description} ({step}).")
+                time.sleep(self.poll_interval)
+
+    def wait_idle(self, session, step, timeout=None):
+        """Waits until the session is no longer busy (session.Busy)."""
+        # Only the whole wait is traced, not the calls made on every poll
+        session = unwrap(session)
+        _, elapsed = self._poll(step, lambda: not session.Busy, timeout, "the session to be idle")
+        return elapsed
+
+    def wait_for_control(self, session, control_id, step, timeout=None):
+        """Waits until the session is idle and the control exists; returns the control."""
+        traced_session = isinstance(session, TracedGuiObject)
+        session = unwrap(session)
+
+        def ready():
+            if session.Busy:
+                return None
+            return session.findById(control_id, False)
+
+        control, _ = self._poll(step, ready, timeout, f"control '{control_id}'")
+        return TracedGuiObject(control, control_id) if traced_session else control
+
+    def wait_for_window_closed(self, session, step, window_id="wnd[1]", timeout=None):
+        """
+        Waits until the session is idle and the popup window is gone. The controls of wnd[0]
+        exist while a popup is still open over them, so waiting for one of them after closing
+        a popup returns too early.
+        """
+        session = unwrap(session)
+        _, elapsed = self._poll(step, lambda: not session.Busy and session.findById(window_id, False) is None,
+                                timeout, f"window '{window_id}' to close")
+        return elapsed
+
+    def wait_for_file(self, path, step, timeout=None, stable_for=0.5):
+        """Waits until the file exists and its size has stopped growing for `stable_for` seconds."""
+        state = {"size": -1, "since": None}
+
+        def stable():
+            if not os.path.exists(path):
+                return False
+            size = os.path.getsize(path)
+            now = time.monotonic()
+            if size != state["size"] or size == 0:
+                state["size"] = size
+                state["since"] = now
+                return False
+            return now - state["since"] >= stable_for
+
+        _, elapsed = self._poll(step, stable, timeout, f"file '{path}'")
+        return elapsed
+
+    def summary(self):
+        """Returns {step: (waits, mean, max, timeouts)} over the recent history."""
+        result = {}
+        for step in sorted(set(self.durations) | set(self.timeouts)):
+            recent = list(self.durations[step])
+            mean = sum(recent) / len(recent) if recent else 0.0
+            result[step] = (len(recent), mean, max(recent, default=0.0), self.timeouts[step])
+        return result
+
+    def log_summary(self):
+        for step, (count, mean, longest, timeouts) in self.summary().items():
+            logging.info("Wait '%s': %s waits, mean %.2f s, max %.2f s, %s timeouts.",
+                         step, count, mean, longest, timeouts)
@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyodbc
+
+from rastreamento import span
+
+# Seconds a probe query may run before the ODBC driver cancels it.
+DEFAULT_TIMEOUT = 30
+
+# Columns tested together in the first round; failing groups are split in half.
+DEFAULT_GROUP_SIZE = 64
+
+# Probe outcomes per column.
+OK = "ok"
+FORBIDDEN = "forbidden"
+TIMEOUT = "timeout"
+
+# SQLSTATE returned by the driver when the query timeout expires.
+TIMEOUT_SQLSTATE = "HYT00"
+
+
+def get_table_columns(conn, table):
+    """
+    Retrieves a list of candidate column names for the given table using ODBC metadata.
+    """
+    cursor = conn.cursor()
+    columns = []
+    for row in cursor.columns(table=table):
+        columns.append(row.column_name)
+    return columns
+
+
+def probe_query(pool, table, columns):
+    """
+    Runs SELECT TOP 1 over the given columns on a pooled connection.
+    Returns (success, elapsed_seconds, timed_out, error_message).
+    """
+    select_list = ", ".join(f"[{col}]" for col in columns)
+    with pool.connection() as conn, span("probe query", table=table, columns=len(columns)):
+        start = time.perf_counter()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT TOP 1 {select_list} FROM {table}")
+            cursor.fetchone()
+            cursor.close()
+            return True, time.perf_counter() - start, False, None
+        except pyodbc.Error as e:
+            timed_out = bool(e.args) and e.args[0] == TIMEOUT_SQLSTATE
+            return False, time.perf_counter() - start, timed_out, str(e)
+
+
+def probe_columns(pool, table, columns, group_size=DEFAULT_GROUP_SIZE, workers=1,
+                  slow_threshold=None):
+    """
+    Finds which columns of table can be read. Columns are tested group_size at a time in one
+    SELECT; a group that fails is split in half and retested, so k forbidden columns out of n
+    cost about k * log2(n) queries instead of n. With slow_threshold, a group that succeeds but
+    takes longer than that many seconds is split and re-timed the same way, down to single
+    columns, so only the slow columns themselves end up with a high latency; set it above the
+    usual time of a TOP 1 on the DSN, or every group is re-timed column by column. Each round of groups runs on
+    up to workers pooled connections.
+
+    Returns ({column: {"status", "elapsed", "error"}}, number_of_queries), with columns in
+    their original order. "elapsed" is the time of the smallest successful query covering
+    the column.
+    """
+    results = {}
+    queries = 0
+    # (columns, re-timing a group that already succeeded)
+    groups = [(columns[i:i + group_size], False) for i in range(0, len(columns), group_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while groups:
+            with span("probe round", table=table, groups=len(groups)):
+                outcomes = list(executor.map(lambda item: probe_query(pool, table, item[0]), groups))
+            queries += len(groups)
+            next_groups = []
+            for (group, retiming), (success, elapsed, timed_out, error) in zip(groups, outcomes):
+                middle = len(group) // 2
+                if success:
+                    for col in group:
+                        results[col] = {"status": OK, "elapsed": elapsed, "error": None}
+                    if slow_threshold is not None and elapsed > slow_threshold and len(group) > 1:
+                        next_groups.extend([(group[:middle], True), (group[middle:], True)])
+                elif retiming:
+                    # Part of a group that was read fine; keep the latency of the whole group.
+                    continue
+                elif len(group) == 1:
+                    results[group[0]] = {"status": TIMEOUT if timed_out else FORBIDDEN,
+                                         "elapsed": None, "error": error}
+                else:
+                    next_groups.extend([(group[:middle], False), (group[middle:], False)])
+            groups = next_groups
+    return {col: results[col] for col in columns}, queries
@@ -1,6 +1,14 @@
 import win32com.client
-import time
 import logging
+import pandas as pd
+import polars as pl
+
+from catalogo_colunas import ColumnCatalog
+from extracao_odbc import LazyConnection, build_select, fetch_semijoin, to_matnr
+from rastreamento import TRACER, TracedGuiObject, span, traced
+from relatorio_excel import write_report
+from sap_espera import WaitEngine
+from valores_exibidos import type_display_columns
 
 # Configure logging to write to a file and the console.
 logging.basicConfig(
@@ -12,8 +20,33 @@ logging.basicConfig(
     ]
 )
 
+# Abas da tela de material aberta a partir da MD04
+MATERIAL_TABS = "wnd[0]/usr/tabsTABSPR1"
+
+# Parâmetros resolvidos: tabela onde estão no ODBC e método que os lê na aba do SAP GUI
+PARAMETER_FIELDS = {
+    "MINBE": ("MARC", "extract_mrp1_data"),
+    "MABST": ("MARC", "extract_mrp1_data"),
+    "VSPVB": ("MARC", "extract_mrp2_data"),
+    "PLIFZ": ("MARC", "extract_mrp2_data"),
+    "VERPR": ("MBEW", "extract_financial_data"),
+}
+
+# Tipo ABAP de cada parâmetro, para converter o texto exibido nas abas ("1.234,000") nos
+# mesmos números que o ODBC devolve; VSPVB (área de abastecimento) é um código e fica como texto
+PARAMETER_TYPES = {"MINBE": "QUAN", "MABST": "QUAN", "VSPVB": "CHAR", "PLIFZ": "INT4", "VERPR": "CURR"}
+
+# Coluna de centro de cada tabela
+PLANT_COLUMNS = {"MARC": "WERKS", "MBEW": "BWKEY"}
+
+OUTPUT_FILE = "parametros_de_ressuprimento_MD04.xlsx"
+
 class SAPAutomation:
 
+    def __init__(self):
+        self.waits = WaitEngine()
+
+    @traced("connect_to_sap")
     def connect_to_sap(self):
         try:
             sap_gui = win32com.client.GetObject("SAPGUI")
@@ -37,16 +70,14 @@ class SAPAutomation:
             okcd_id.Text = "MD04"
             okcd_id.SetFocus()
             ID.sendVKey(0)  # Execute
-            time.sleep(2)
 
             # Input the material number
             material_field_id = "wnd[0]/usr/tabsTAB300/tabpF01/ssubINCLUDE300:SAPMM61R:0301/ctxtRM61R-MATNR"
-            material_field = session.findById(material_field_id)
+            material_field = self.waits.wait_for_control(session, material_field_id, "MD04 selection screen")
             material_field.Text = material_number
 
             # Set caret position
             material_field.SetFocus()
-            time.sleep(1)
 
             # Input the center
             center_field_id = "wnd[0]/usr/tabsTAB300/tabpF01/ssubINCLUDE300:SAPMM61R:0301/ctxtRM61R-WERKS"
@@ -55,24 +86,21 @@ class SAPAutomation:
 
             # Set focus and caret position for center field
             center_field.SetFocus()
-            time.sleep(1)
 
             # Execute the query
             ID.sendVKey(0)  # Execute
-            time.sleep(2)
 
             # Set caret position for the material field in the details screen
             detail_material_field_id = "wnd[0]/usr/subINCLUDE8XX:SAPMM61R:0800/ctxtRM61R-MATNR"
-            detail_material_field = session.findById(detail_material_field_id)
+            detail_material_field = self.waits.wait_for_control(session, detail_material_field_id, "MD04 stock/requirements list")
             detail_material_field.SetFocus()
-            time.sleep(1)
 
             # Set caret position
             detail_material_field.CaretPosition = 6
 
             # Send VKey to trigger the next action
             ID.sendVKey(2)  # Adjust according to the action needed
-            time.sleep(2)
+            self.waits.wait_for_control(session, MATERIAL_TABS, "material master tabs")
 
             logging.info("Transaction completed successfully.")
             return "MD04 processing completed successfully."
@@ -80,60 +108,74 @@ class SAPAutomation:
             logging.error("Error executing transaction for Material %s, Center %s: %s", material_number, center, e)
             return "Error"
 
+    def return_to_md04(self, session):
+        """Volta para a página de input de material."""
+        ID = session.findById("wnd[0]")
+        ID.resizeWorkingPane(99, 38, 0)  # Redimensionar o painel de trabalho
+        okcd_id = session.findById("wnd[0]/tbar[0]/okcd")
+        okcd_id.Text = "MD04"  # Definir a transação novamente
+        okcd_id.SetFocus()
+        ID.sendVKey(0)  # Executar
+        self.waits.wait_idle(session, "MD04 restart")  # Esperar a transação carregar
+
     def extract_mrp1_data(self, session):
-        """Extrai e imprime os dados específicos na aba MRP1."""
+        """Extrai os dados específicos na aba MRP1; retorna {campo: texto}."""
         try:
             # Tente mudar para a aba MRP1
             tab_mrp1_id = session.findById("wnd[0]/usr/tabsTABSPR1/tabpSP13")  # ID da aba MRP1
             tab_mrp1_id.select()  # Seleciona a aba MRP1
             logging.info("Changed to MRP1 tab successfully.")
-            time.sleep(1)  # Aguarda um pouco para garantir que a aba está totalmente carregada
+            self.waits.wait_idle(session, "MRP1 tab")  # Aguarda a aba estar totalmente carregada
 
             # Extrai os valores dos campos Ponto reabastec. e Estoque máximo
             ponto_reabastec = session.findById("wnd[0]/usr/tabsTABSPR1/tabpSP13/ssubTABFRA1:SAPLMGMM:2000/subSUB3:SAPLMGD1:2482/txtMARC-MINBE").Text
             estoque_maximo = session.findById("wnd[0]/usr/tabsTABSPR1/tabpSP13/ssubTABFRA1:SAPLMGMM:2000/subSUB4:SAPLMGD1:2483/txtMARC-MABST").Text
 
-            # Impressão minimalista
-            print(f"Ponto reabastec.: {ponto_reabastec}, Estoque máximo: {estoque_maximo}")
+            logging.info("Ponto reabastec.: %s, Estoque máximo: %s", ponto_reabastec, estoque_maximo)
+            return {"MINBE": ponto_reabastec, "MABST": estoque_maximo}
 
         except Exception as e:
             logging.error("Error extracting data from MRP1 tab: %s", e)
+            return {}
 
     def extract_mrp2_data(self, session):
-        """Extrai e imprime os dados específicos na aba MRP2."""
+        """Extrai os dados específicos na aba MRP2; retorna {campo: texto}."""
         try:
             # Tente mudar para a aba MRP2
             tab_mrp2_id = session.findById("wnd[0]/usr/tabsTABSPR1/tabpSP14")  # ID da aba MRP2
             tab_mrp2_id.select()  # Seleciona a aba MRP2
             logging.info("Changed to MRP2 tab successfully.")
-            time.sleep(1)  # Aguarda um pouco para garantir que a aba está totalmente carregada
+            self.waits.wait_idle(session, "MRP2 tab")  # Aguarda a aba estar totalmente carregada
 
             # Extrai os valores dos campos AAP proposta e Prz. entrg. prev.
             aap_proposta = session.findById("wnd[0]/usr/tabsTABSPR1/tabpSP14/ssubTABFRA1:SAPLMGMM:2000/subSUB2:SAPLMGD1:2484/ctxtMARC-VSPVB").Text
             prz_entrg_prev = session.findById("wnd[0]/usr/tabsTABSPR1/tabpSP14/ssubTABFRA1:SAPLMGMM:2000/subSUB3:SAPLMGD1:2485/txtMARC-PLIFZ").Text
 
-            # Impressão minimalista
-            print(f"AAP proposta: {aap_proposta}, Prz. entrg. prev.: {prz_entrg_prev}")
+            logging.info("AAP proposta: %s, Prz. entrg. prev.: %s", aap_proposta, prz_entrg_prev)
+            return {"VSPVB": aap_proposta, "PLIFZ": prz_entrg_prev}
 
         except Exception as e:
             logging.error("Error extracting data from MRP2 tab: %s", e)
+            return {}
 
     def extract_financial_data(self, session):
-        """Extrai o campo Preço médio móvel na aba Contabilidade fin.1."""
+        """Extrai o campo Preço médio móvel na aba Contabilidade fin.1; retorna {campo: texto}."""
         try:
             # Tente mudar para a aba Contabilidade fin.1
             tab_financial_id = session.findById("wnd[0]/usr/tabsTABSPR1/tabpSP25")  # ID da aba Contabilidade fin.1
             tab_financial_id.select()  # Seleciona a aba
             logging.info("Changed to Contabilidade fin.1 tab successfully.")
-            time.sleep(1)  # Aguarda um pouco para garantir que a aba está totalmente carregada
+            self.waits.wait_idle(session, "Contabilidade fin.1 tab")  # Aguarda a aba estar totalmente carregada
 
             # Extrai o valor do campo Preço médio móvel
             preco_medio_movel = session.findById("wnd[0]/usr/tabsTABSPR1/tabpSP25/ssubTABFRA1:SAPLMGMM:2000/subSUB2:SAPLMGD1:2800/subSUB1:SAPLCKMMAT:0010/tabsTABS/tabpPPLF/ssubSUBML:SAPLCKMMAT:0300/txtMBEW-VERPR").Text
 
-            print(f"Preço médio móvel: {preco_medio_movel}")
+            logging.info("Preço médio móvel: %s", preco_medio_movel)
+            return {"VERPR": preco_medio_movel}
 
         except Exception as e:
             logging.error("Error extracting data from Contabilidade fin.1 tab: %s", e)
+            return {}
 
     def extract_all_materials(self, session, center):
         """Extrai e imprime todos os números de material disponíveis no centro especificado."""
@@ -142,7 +184,7 @@ class SAPAutomation:
             tab_materials_id = session.findById("wnd[0]/usr/tabsTABSPR1/tabpSP14")  # ID da aba de lista de materiais
             tab_materials_id.select()  # Seleciona a aba de lista de materiais
             logging.info("Changed to materials tab successfully.")
-            time.sleep(1)  # Aguarda um pouco para garantir que a aba está totalmente carregada
+            self.waits.wait_idle(session, "materials tab")  # Aguarda a aba estar totalmente carregada
 
             # Aqui, você deve implementar a lógica específica para extrair os números de material do centro
             # Isso pode variar dependendo da estrutura da interface do SAP
@@ -183,41 +225,113 @@ class SAPAutomation:
 # if __name__ == "__main__":
 #     main()
 
+def fetch_sql_parameters(conn, materials, center, catalog=None):
+    """
+    Busca no ODBC, de uma vez para a lista toda, os parâmetros que o DSN permite ler.
+    Retorna {material: {campo: valor}} só com os materiais e campos encontrados.
+    """
+    catalog = catalog or ColumnCatalog()
+    keys = {to_matnr(material): material for material in materials}
+    values = {}
+    for table, plant_column in PLANT_COLUMNS.items():
+        fields = [field for field, (field_table, _) in PARAMETER_FIELDS.items() if field_table == table]
+        fields = catalog.usable_columns(table, fields)
+        if not fields:
+            continue
+        # O centro vai na consulta, para não trazer as linhas de todos os centros do material
+        with span("read_sql", table=table):
+            df = fetch_semijoin(conn, build_select(table, ["MATNR", plant_column] + fields), "MATNR", list(keys),
+                                where=f"[{plant_column}] = ?", params=[center])
+        for row in df.to_dict("records"):
+            material = keys.get(row["MATNR"])
+            if material is not None:
+                values.setdefault(material, {}).update({field: row[field] for field in fields})
+        logging.info("%s: %s of %s materials found over ODBC.", table, df["MATNR"].nunique(), len(materials))
+    return values
+
+
+def type_gui_parameters(gui_values):
+    """
+    Converte os textos lidos nas abas do SAP GUI ({material: {campo: texto}}) conforme
+    PARAMETER_TYPES, um campo por vez para todos os materiais, já que o separador decimal
+    só se revela nos valores com milhar ou decimais. Campos ausentes não são incluídos.
+    """
+    materials = list(gui_values)
+    df = pl.DataFrame({field: [gui_values[material].get(field) for material in materials]
+                       for field in PARAMETER_FIELDS},
+                      schema={field: pl.Utf8 for field in PARAMETER_FIELDS})
+    typed = type_display_columns(df, [PARAMETER_TYPES[field] for field in PARAMETER_FIELDS])
+    return {material: {field: typed[field][i] for field in PARAMETER_FIELDS if field in gui_values[material]}
+            for i, material in enumerate(materials)}
+
+
+def resolve_parameters(materials, center, db=None):
+    """
+    Resolve os parâmetros de PARAMETER_FIELDS para cada material: primeiro tudo o que o ODBC
+    serve em lote e, só para os materiais ou campos que faltarem, as abas do SAP GUI.
+    Retorna um DataFrame com uma linha por material e a origem dos valores.
+    """
+    values = {}
+    if db is not None:
+        try:
+            values = fetch_sql_parameters(db.get(), materials, center)
+        except Exception as e:
+            logging.warning("ODBC lookup failed, falling back to SAP GUI for every material: %s", e)
+    sources = {material: {"ODBC"} for material in values}
+
+    pending = {material: [field for field in PARAMETER_FIELDS if field not in values.get(material, {})]
+               for material in materials}
+    pending = {material: fields for material, fields in pending.items() if fields}
+    logging.info("%s of %s materials need SAP GUI.", len(pending), len(materials))
+
+    if pending:
+        gui_values = {}
+        automation = SAPAutomation()
+        session = TracedGuiObject(automation.connect_to_sap())
+        for material, fields in pending.items():
+            result = automation.execute_transaction(session, material, center)
+            if result != "Error":
+                # Só as abas que mostram os campos que faltam
+                for extractor in dict.fromkeys(PARAMETER_FIELDS[field][1] for field in fields):
+                    tab_values = getattr(automation, extractor)(session)
+                    found = {field: tab_values[field] for field in fields if field in tab_values}
+                    if found:
+                        gui_values.setdefault(material, {}).update(found)
+                        sources.setdefault(material, set()).add("SAP GUI")
+            automation.return_to_md04(session)
+
+        # Tempo efetivamente esperado em cada etapa
+        automation.waits.log_summary()
+
+        # As abas exibem texto; só entra no resultado depois de convertido como o ODBC
+        for material, found in type_gui_parameters(gui_values).items():
+            values.setdefault(material, {}).update(found)
+
+    rows = []
+    for material in materials:
+        row = {"Material": material, "Centro": center}
+        row.update({field: values.get(material, {}).get(field) for field in PARAMETER_FIELDS})
+        row["Origem"] = " + ".join(sorted(sources.get(material, ()))) or "não encontrado"
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
 def main():
     materials = ["11624543", "10001083"]  # Lista de números de materiais
     center = "2096"  # Centro
-    automation = SAPAutomation()
-
-    # Conectar ao SAP
-    session = automation.connect_to_sap()
 
-    for material_number in materials:
-        # Executar a transação
-        result = automation.execute_transaction(session, material_number, center)
+    db = LazyConnection()
+    try:
+        df = resolve_parameters(materials, center, db)
+    finally:
+        db.close()
 
-        # Extrair dados da aba MRP1
-        automation.extract_mrp1_data(session)
-
-        # Extrair dados da aba MRP2
-        automation.extract_mrp2_data(session)
-
-        # Extrair dados da aba Contabilidade fin.1
-        automation.extract_financial_data(session)
-
-        # Voltar para a página de input de material
-        # Ajuste o código abaixo conforme necessário para retornar à página correta
-        ID = session.findById("wnd[0]")
-        ID.resizeWorkingPane(99, 38, 0)  # Redimensionar o painel de trabalho
-        okcd_id = session.findById("wnd[0]/tbar[0]/okcd")
-        okcd_id.Text = "MD04"  # Definir a transação novamente
-        okcd_id.SetFocus()
-        ID.sendVKey(0)  # Executar
-        time.sleep(2)  # Esperar a transação carregar
+    write_report(df, OUTPUT_FILE, "Parametros")
+    logging.info("Replenishment parameters saved to %s.", OUTPUT_FILE)
+    TRACER.finish("parametros_MD04", logging.info)
 
     # Pausar a execução para que o usuário possa ver a tela
     input("Pressione Enter para encerrar o script e sair do SAP...")
 
 if __name__ == "__main__":
     main()
-
-
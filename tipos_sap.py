@@ -0,0 +1,230 @@
+import decimal
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Kinds of SAP fields with a compact pandas representation.
+CATEGORY = "category"
+INTEGER = "integer"
+PRICE = "price"
+
+# Plant, MRP and classification codes: few distinct values repeated on every row.
+CATEGORY_FIELDS = [
+    'WERKS', 'BWKEY', 'MANDT', 'BWTAR', 'LVORM', 'DISGR', 'DISMM', 'DISLS', 'VSPVB', 'MEINS',
+    'MTART', 'MATKL', 'VPRSV', 'BKLAS', 'VMBKL', 'VJBKL', 'BWTTY', 'KALKZ', 'KALKL', 'KALKV',
+    'KALSC', 'XLIFO', 'MYPOL', 'ABWKZ', 'PSTAT', 'HRKFT', 'KOSGR', 'EKALR', 'MLMAA', 'MLAST',
+    'HKMAT', 'SPERW', 'KZIWL', 'ABCIW', 'EKLAS', 'QKLAS', 'MTUSE', 'MTORG', 'OWNPR', 'XBEWM',
+    'OKLAS',
+]
+
+# NUMC/DEC fields without decimals (lead time, fiscal year and period, price units, ...).
+INTEGER_FIELDS = [
+    'PLIFZ', 'LFMON', 'LFGJA', 'PEINH', 'VMPEI', 'VJPEI', 'BWPEI', 'PPRDZ', 'PPRDL', 'PPRDV',
+    'PDATZ', 'PDATL', 'PDATV', 'TIMESTAMP',
+]
+
+# CURR fields, all with two decimals.
+PRICE_FIELDS = [
+    'VERPR', 'STPRS', 'SALK3', 'VKSAL', 'VMSAL', 'VMVER', 'VMSTP', 'VJSAL', 'VJVER', 'VJSTP',
+    'STPRV', 'LAEPR', 'ZKPRS', 'BWPRS', 'BWPRH', 'VJBWS', 'VJBWH', 'VVJSL', 'VVSAL', 'ZPLPR',
+    'ZPLP1', 'ZPLP2', 'ZPLP3', 'VPLPR', 'LPLPR', 'BWPH1', 'BWPS1', 'NETPR',
+]
+
+FIELD_TYPES = {
+    **{field: CATEGORY for field in CATEGORY_FIELDS},
+    **{field: INTEGER for field in INTEGER_FIELDS},
+    **{field: PRICE for field in PRICE_FIELDS},
+}
+
+PRICE_SCALE = 2
+
+# How prices are held: float64 (as read), float32 (half the memory, but values such as 12.34
+# reach Excel as 12.3400001525879) or decimal (exact fixed-point Arrow decimals, larger than
+# float64; for totals that must reconcile with SAP).
+PRICE_DTYPES = {
+    "float64": "float64",
+    "float32": "float32",
+    "decimal": pd.ArrowDtype(pa.decimal128(15, PRICE_SCALE)),
+}
+DEFAULT_PRICE_DTYPE = "float64"
+PRICE_DTYPE = DEFAULT_PRICE_DTYPE
+
+# Columns outside the schema become categoricals when at most this share of the values is distinct.
+MAX_CATEGORY_RATIO = 0.5
+
+# Object columns longer than this are measured (and checked for repeated values) on a sample
+# of this many values.
+MEMORY_SAMPLE = 10000
+
+# Integer dtypes tried in order; the first one holding the column's range is used.
+INTEGER_DTYPES = ["int8", "int16", "int32", "int64"]
+
+
+def set_price_dtype(name):
+    """Chooses how price fields are held from now on (one of PRICE_DTYPES)."""
+    global PRICE_DTYPE
+    if name not in PRICE_DTYPES:
+        raise ValueError(f"Unknown price dtype {name!r}; choose from {', '.join(PRICE_DTYPES)}.")
+    PRICE_DTYPE = name
+
+
+def to_category(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    return series.astype("category")
+
+
+def to_integer(series):
+    """
+    Smallest integer dtype holding the values, nullable (Int16, ...) when there are NULLs.
+    Returns the series unchanged if it is not numeric or has decimals.
+    """
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.isna().sum() > series.isna().sum():
+        return series
+    values = numeric.dropna()
+    if len(values) and not (values % 1 == 0).all():
+        return series
+    low, high = (values.min(), values.max()) if len(values) else (0, 0)
+    for name in INTEGER_DTYPES:
+        info = np.iinfo(name)
+        if info.min <= low and high <= info.max:
+            break
+    if numeric.isna().any():
+        name = name.capitalize()
+    return numeric.astype(name)
+
+
+def to_price(series, price_dtype=None):
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.isna().sum() > series.isna().sum():
+        return series
+    # Rounding to the CURR scale also clears float32 noise when a cached extract is converted back
+    numeric = numeric.astype("float64").round(PRICE_SCALE)
+    return numeric.astype(PRICE_DTYPES[price_dtype or PRICE_DTYPE])
+
+
+def infer_compact(series):
+    """
+    Compact dtype for a column outside the schema: whole numbers as integers, other numbers
+    (including the Decimal objects pyodbc returns for DEC fields) as float64, and text as a
+    categorical when it repeats enough.
+    """
+    if pd.api.types.is_float_dtype(series.dtype):
+        return to_integer(series)
+    if series.dtype != object or not len(series):
+        return series
+    values = series.dropna()
+    if not len(values):
+        return series
+    first = values.iloc[0]
+    if isinstance(first, (decimal.Decimal, int, float)) and not isinstance(first, bool):
+        numeric = pd.to_numeric(series, errors="coerce")
+        if numeric.isna().sum() > series.isna().sum():
+            return series
+        compact = to_integer(numeric)
+        return compact if compact is not numeric else numeric.astype("float64")
+    if not isinstance(first, str):
+        return series
+    # A sample rules out key-like columns (MATNR, ...) without hashing every value
+    if len(values) > MEMORY_SAMPLE:
+        sample = values.sample(n=MEMORY_SAMPLE, random_state=0)
+        if sample.nunique() > MAX_CATEGORY_RATIO * MEMORY_SAMPLE:
+            return series
+    if values.nunique() <= MAX_CATEGORY_RATIO * len(series):
+        return to_category(series)
+    return series
+
+
+def column_bytes(series):
+    """Memory used by the values of series; measured on a sample for long object columns."""
+    if series.dtype == object and len(series) > MEMORY_SAMPLE:
+        sample = series.sample(n=MEMORY_SAMPLE, random_state=0)
+        return int(sample.memory_usage(index=False, deep=True) * len(series) / MEMORY_SAMPLE)
+    return series.memory_usage(index=False, deep=True)
+
+
+class MemoryStats:
+    """
+    Bytes per column before and after compact_frame, summed over every frame compacted in this
+    run (partitions, batches), so the report covers the whole extract.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.columns = {}
+
+    def add(self, column, before, after, dtype_before, dtype_after):
+        with self.lock:
+            entry = self.columns.setdefault(column, [0, 0, str(dtype_before), str(dtype_after)])
+            entry[0] += before
+            entry[1] += after
+
+    def report(self, label, top=None):
+        """Prints the total saving and, with top, the columns that shrank the most."""
+        if not self.columns:
+            return
+        before = sum(entry[0] for entry in self.columns.values()) / 1024 ** 2
+        after = sum(entry[1] for entry in self.columns.values()) / 1024 ** 2
+        change = 100 * (after / before - 1) if before else 0.0
+        print(f"{label}: {len(self.columns)} columns, {before:.1f} MB as read, "
+              f"{after:.1f} MB with compact dtypes ({change:+.0f}%).")
+        if top:
+            print(f"{'column':<24} {'before':>10} {'after':>10} {'MB before':>10} {'MB after':>10}")
+            ranked = sorted(self.columns.items(), key=lambda item: item[1][0] - item[1][1], reverse=True)
+            for column, (col_before, col_after, dtype_before, dtype_after) in ranked[:top]:
+                print(f"{column[:24]:<24} {dtype_before[:10]:>10} {dtype_after[:10]:>10} "
+                      f"{col_before / 1024 ** 2:>10.2f} {col_after / 1024 ** 2:>10.2f}")
+
+
+# One accumulator per process, like rastreamento.TRACER.
+MEMORY = MemoryStats()
+
+
+def compact_frame(df, price_dtype=None, infer=True, stats=MEMORY):
+    """
+    Converts the columns of an extract to compact dtypes following FIELD_TYPES: categoricals for
+    codes, the smallest integer dtype for whole-number fields and PRICE_DTYPE for prices.
+    With infer, columns outside the schema are compacted by infer_compact. Returns a new frame.
+    """
+    columns = {}
+    for column in df.columns:
+        series = df[column]
+        kind = FIELD_TYPES.get(str(column).upper())
+        if kind == CATEGORY:
+            compact = to_category(series)
+        elif kind == INTEGER:
+            compact = to_integer(series)
+        elif kind == PRICE:
+            compact = to_price(series, price_dtype)
+        elif infer:
+            compact = infer_compact(series)
+        else:
+            compact = series
+        if stats is not None:
+            stats.add(column, column_bytes(series), column_bytes(compact), series.dtype, compact.dtype)
+        columns[column] = compact
+    return pd.DataFrame(columns, index=df.index)
+
+
+def concat_frames(frames):
+    """
+    pd.concat for compacted frames: categorical columns get the union of the categories first,
+    otherwise pandas would fall back to object for them. Columns whose inferred dtype differed
+    between frames are compacted again on the result.
+    """
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame()
+    # Empty partitions (a date window without documents, ...) would only blur the dtypes
+    frames = [df for df in frames if len(df)] or frames[:1]
+    for column in frames[0].columns:
+        dtypes = [df[column].dtype for df in frames if column in df.columns]
+        if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            categories = pd.api.types.union_categoricals(
+                [pd.Categorical([], categories=dtype.categories) for dtype in dtypes]).categories
+            frames = [df.assign(**{column: df[column].cat.set_categories(categories)})
+                      if column in df.columns else df for df in frames]
+    return compact_frame(pd.concat(frames, ignore_index=True), stats=None)
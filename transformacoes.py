@@ -0,0 +1,79 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# Column names used in the replenishment parameter deliverables.
+RENAME_MARC_MARA = {
+    "WERKS": "Centro",
+    "MATNR": "NM",
+    "DISGR": "Grupo MRP",
+    "DISMM": "Tipo de MRP",
+    "MEINS": "Unid.medida basica",
+    "DISLS": "RegraCalcTamLotes",
+    "MINBE": "PR",
+    "MABST": "EM",
+    "VSPVB": "SupM",
+    "PLIFZ": "Lead time",
+    "LGRAD": "Grau atend. (%)"
+}
+
+RENAME_MARC_MBEW = {
+    "MATNR": "NM",
+    "DISGR": "Grupo MRP",
+    "DISMM": "Tipo de MRP",
+    "MINBE": "PR",
+    "MABST": "EM",
+    "VSPVB": "SupM",
+    "PLIFZ": "Lead time",
+    "LGRAD": "Grau atend. (%)",
+    # "VERPR": "Preço médio móvel",
+    # "LFMON": "Mês de avaliação"
+}
+
+
+# Define a function to format the NM value.
+def format_nm(nm):
+    # Remove leading zeros.
+    s = str(nm).lstrip("0")
+    # If the remaining string is too short, return it as is.
+    if len(s) <= 6:
+        return s
+    prefix = s[:len(s)-6]
+    infix = s[len(s)-6:len(s)-3]
+    sufix = s[-3:]
+    return f"{prefix}.{infix}.{sufix}"
+
+
+def format_nm_series(series):
+    """
+    Vectorized format_nm for a pandas Series, built on Arrow string kernels.
+    Gives the same result as series.apply(format_nm).
+    """
+    # astype(str) keeps str() semantics for numbers and missing values.
+    s = pc.utf8_ltrim(pa.array(series.astype(str), type=pa.string()), characters="0")
+    dotted = pc.binary_join_element_wise(
+        pc.utf8_slice_codeunits(s, 0, -6),
+        pc.utf8_slice_codeunits(s, -6, -3),
+        pc.utf8_slice_codeunits(s, -3),
+        "."
+    )
+    formatted = pc.if_else(pc.greater(pc.utf8_length(s), 6), dotted, s)
+    return pd.Series(formatted.to_numpy(zero_copy_only=False), index=series.index, name=series.name, dtype=object)
+
+
+def format_nm_expr(column):
+    """
+    format_nm as a Polars expression on the given column. Null values stay null.
+    """
+    s = pl.col(column).cast(pl.Utf8).str.strip_chars_start("0")
+    return (
+        pl.when(s.str.len_chars() > 6)
+        .then(pl.concat_str([s.str.head(-6), pl.lit("."), s.str.slice(-6, 3), pl.lit("."), s.str.tail(3)]))
+        .otherwise(s)
+        .alias(column)
+    )
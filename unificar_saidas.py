@@ -1,32 +1,222 @@
+import argparse
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
+import pyarrow.parquet as pq
+
+from rastreamento import TRACER, span
 
 # Diretórios
 pasta_input = "output"
 pasta_output = "deliver"
 
-# Criar pasta de saída se não existir
-os.makedirs(pasta_output, exist_ok=True)
-
-# Listar arquivos Excel na pasta
-arquivos = [os.path.join(pasta_input, f) for f in os.listdir(pasta_input) if f.endswith(".xlsx")]
-
-# Lista para armazenar os DataFrames
-dataframes = []
-
-# Iterar sobre cada arquivo e carregar no Pandas
-for arquivo in arquivos:
-    try:
-        df = pd.read_excel(arquivo, engine="openpyxl")
-        dataframes.append(df)  # Adicionar ao conjunto de dados
-    except Exception as e:
-        print(f"Erro ao processar {arquivo}: {e}")
-
-# Se encontrou arquivos válidos, concatena e salva
-if dataframes:
-    df_final = pd.concat(dataframes, ignore_index=True)  # Concatenar todos os DataFrames
-    caminho_saida = os.path.join(pasta_output, "historico_de_pedidos_CONSOLIDADO.csv")
-    df_final.to_csv(caminho_saida, index=False, sep=";", encoding="utf-8")  # Salvar como CSV
-    print(f"Arquivo único salvo com sucesso: {caminho_saida}")
-else:
-    print("Nenhum arquivo válido encontrado para processar.")
+# Intermediários já lidos (um Parquet por conteúdo) e o manifesto que os relaciona aos arquivos
+pasta_cache = os.path.join("cache", "unificar_saidas")
+arquivo_manifesto = os.path.join(pasta_cache, "manifesto.json")
+
+nome_saida = "historico_de_pedidos_CONSOLIDADO.csv"
+
+
+def calcular_hash(arquivo):
+    """SHA-256 do conteúdo do arquivo, lido em blocos."""
+    h = hashlib.sha256()
+    with open(arquivo, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def carregar_manifesto():
+    if not os.path.exists(arquivo_manifesto):
+        return {}
+    with open(arquivo_manifesto, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def salvar_manifesto(manifesto):
+    temporario = arquivo_manifesto + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, indent=2, ensure_ascii=False)
+    os.replace(temporario, arquivo_manifesto)
+
+
+def ler_arquivo(arquivo, intermediario):
+    """
+    Lê um Excel e grava o intermediário em Parquet; roda em outro processo.
+    Colunas de texto com valores mistos viram texto, como já saem no CSV.
+    """
+    df = pd.read_excel(arquivo, engine="openpyxl")
+    # O Parquet só aceita nomes de coluna em texto; no CSV eles já saem como texto
+    df.columns = [str(coluna) for coluna in df.columns]
+    for coluna in df.columns[df.dtypes == object]:
+        df[coluna] = df[coluna].map(lambda valor: None if pd.isna(valor) else str(valor))
+    temporario = intermediario + ".tmp"
+    df.to_parquet(temporario, index=False)
+    os.replace(temporario, intermediario)
+    return len(df)
+
+
+def planejar(arquivos, manifesto):
+    """
+    Compara os arquivos com o manifesto (tamanho, data de modificação e, se mudaram, hash).
+    Retorna o manifesto atualizado dos arquivos em cache e a lista de (arquivo, entrada) a ler.
+    """
+    atual = {}
+    pendentes = []
+    for arquivo in arquivos:
+        info = os.stat(arquivo)
+        entrada = manifesto.get(arquivo)
+        intermediario_ok = entrada and os.path.exists(os.path.join(pasta_cache, entrada["intermediario"]))
+        if intermediario_ok and entrada["tamanho"] == info.st_size and entrada["mtime"] == info.st_mtime:
+            atual[arquivo] = entrada
+            continue
+
+        # Tamanho ou data mudaram: só o hash diz se o conteúdo é outro
+        conteudo = calcular_hash(arquivo)
+        nova = {"tamanho": info.st_size, "mtime": info.st_mtime, "hash": conteudo,
+                "intermediario": f"{conteudo}.parquet"}
+        if intermediario_ok and entrada["hash"] == conteudo:
+            atual[arquivo] = dict(nova, linhas=entrada.get("linhas"))
+        else:
+            pendentes.append((arquivo, nova))
+
+    # Conteúdo igual ao de um arquivo já em cache (uma cópia, por exemplo): usa o mesmo intermediário
+    em_cache = {entrada["hash"]: entrada for entrada in atual.values()}
+    for arquivo, nova in pendentes:
+        if nova["hash"] in em_cache:
+            atual[arquivo] = dict(nova, linhas=em_cache[nova["hash"]].get("linhas"))
+    pendentes = [(arquivo, nova) for arquivo, nova in pendentes if arquivo not in atual]
+    return atual, pendentes
+
+
+def colunas_unificadas(arquivos, atual, pendentes):
+    """
+    União das colunas de todos os arquivos, na ordem em que aparecem (como no pd.concat),
+    lida só dos cabeçalhos: do esquema do intermediário ou da primeira linha do Excel.
+    """
+    colunas = []
+    for arquivo in arquivos:
+        if arquivo in atual:
+            nomes = pq.read_schema(os.path.join(pasta_cache, atual[arquivo]["intermediario"])).names
+        elif arquivo in pendentes:
+            nomes = [str(coluna) for coluna in pd.read_excel(arquivo, engine="openpyxl", nrows=0).columns]
+        else:
+            continue
+        colunas.extend(nome for nome in nomes if nome not in colunas)
+    return colunas
+
+
+def gravar_em_fluxo(arquivos, atual, pendentes, aguardar, caminho_saida):
+    """
+    Grava o CSV arquivo por arquivo, assim que cada um é lido: só um DataFrame fica na memória.
+    aguardar(arquivo) espera a leitura de um arquivo pendente e diz se ela deu certo.
+    Retorna quantos arquivos foram gravados.
+    """
+    colunas = colunas_unificadas(arquivos, atual, pendentes)
+    gravados = 0
+    with open(caminho_saida, "w", encoding="utf-8", newline="") as saida:
+        pd.DataFrame(columns=colunas).to_csv(saida, index=False, sep=";")
+        for arquivo in arquivos:
+            if arquivo in pendentes and not aguardar(arquivo):
+                continue
+            if arquivo not in atual:
+                continue
+            df = pd.read_parquet(os.path.join(pasta_cache, atual[arquivo]["intermediario"]))
+            df.reindex(columns=colunas).to_csv(saida, index=False, header=False, sep=";")
+            gravados += 1
+    return gravados
+
+
+def consolidar(processos=None, recalcular=False, em_fluxo=False):
+    # Criar pastas de saída e de cache se não existirem
+    os.makedirs(pasta_output, exist_ok=True)
+    os.makedirs(pasta_cache, exist_ok=True)
+
+    # Listar arquivos Excel na pasta
+    arquivos = [os.path.join(pasta_input, f) for f in os.listdir(pasta_input) if f.endswith(".xlsx")]
+
+    manifesto = {} if recalcular else carregar_manifesto()
+    with span("planejar", arquivos=len(arquivos)):
+        atual, pendentes = planejar(arquivos, manifesto)
+    print(f"{len(atual)} arquivos já consolidados, {len(pendentes)} para ler.")
+
+    caminho_saida = os.path.join(pasta_output, nome_saida)
+    gravados = 0
+
+    # Ler os arquivos novos ou alterados em paralelo, uma vez por conteúdo: arquivos com o mesmo
+    # hash gravariam o mesmo intermediário ao mesmo tempo, então os repetidos esperam o primeiro
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        por_hash = {}
+        futuros = {}
+        for arquivo, entrada in pendentes:
+            if entrada["hash"] not in por_hash:
+                intermediario = os.path.join(pasta_cache, entrada["intermediario"])
+                por_hash[entrada["hash"]] = executor.submit(ler_arquivo, arquivo, intermediario)
+            futuros[arquivo] = (por_hash[entrada["hash"]], entrada)
+
+        def aguardar(arquivo):
+            futuro, entrada = futuros[arquivo]
+            try:
+                entrada["linhas"] = futuro.result()
+                atual[arquivo] = entrada
+                return True
+            except Exception as e:
+                print(f"Erro ao processar {arquivo}: {e}")
+                return False
+
+        if em_fluxo:
+            with span("ler e gravar csv", arquivos=len(futuros)):
+                gravados = gravar_em_fluxo(arquivos, atual, futuros, aguardar, caminho_saida)
+        else:
+            with span("ler arquivos", arquivos=len(futuros)):
+                for arquivo in futuros:
+                    aguardar(arquivo)
+
+    # Remover intermediários que nenhum arquivo usa mais
+    em_uso = {entrada["intermediario"] for entrada in atual.values()}
+    for nome in os.listdir(pasta_cache):
+        if nome.endswith(".parquet") and nome not in em_uso:
+            os.remove(os.path.join(pasta_cache, nome))
+    salvar_manifesto(atual)
+
+    if em_fluxo:
+        if gravados:
+            print(f"Arquivo único salvo com sucesso: {caminho_saida}")
+        else:
+            os.remove(caminho_saida)
+            print("Nenhum arquivo válido encontrado para processar.")
+        return
+
+    # Lista para armazenar os DataFrames, na ordem dos arquivos
+    dataframes = [pd.read_parquet(os.path.join(pasta_cache, atual[arquivo]["intermediario"]))
+                  for arquivo in arquivos if arquivo in atual]
+
+    # Se encontrou arquivos válidos, concatena e salva
+    if dataframes:
+        df_final = pd.concat(dataframes, ignore_index=True)  # Concatenar todos os DataFrames
+        with span("gravar csv", linhas=len(df_final)):
+            df_final.to_csv(caminho_saida, index=False, sep=";", encoding="utf-8")  # Salvar como CSV
+        print(f"Arquivo único salvo com sucesso: {caminho_saida}")
+    else:
+        print("Nenhum arquivo válido encontrado para processar.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consolida os .xlsx de output/ em um único CSV.")
+    parser.add_argument("--processos", type=int, default=None,
+                        help="processos usados para ler os arquivos (padrão: um por núcleo)")
+    parser.add_argument("--recalcular", action="store_true",
+                        help="ignorar o manifesto e ler todos os arquivos de novo")
+    parser.add_argument("--em-fluxo", action="store_true",
+                        help="gravar o CSV arquivo por arquivo, com memória limitada ao maior arquivo")
+    args = parser.parse_args()
+    consolidar(args.processos, args.recalcular, args.em_fluxo)
+    TRACER.finish("unificar_saidas")
+
+
+# Necessário para o ProcessPoolExecutor no Windows
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import logging
+
+import polars as pl
+
+# Column types (dictionary or ABAP internal) that SAP GUI shows formatted with the user's
+# settings; the others stay as text, like CHAR and NUMC.
+NUMBER_TYPES = {"QUAN", "CURR", "DEC", "FLTP", "INT1", "INT2", "INT4", "INT8", "P", "F", "I", "B", "S", "8"}
+INTEGER_TYPES = {"INT1", "INT2", "INT4", "INT8", "I", "B", "S", "8"}
+DATE_TYPES = {"DATS", "D"}
+
+# Decimal notation of the user profile (SU3) when the values do not reveal it ("1.234" or "1,234").
+DECIMAL_SEPARATOR = ","
+
+# Date formats the user profile (SU3) can use, in SAP's order.
+DATE_FORMATS = ["%d.%m.%Y", "%m/%d/%Y", "%m-%d-%Y", "%Y.%m.%d", "%Y/%m/%d", "%Y-%m-%d"]
+
+
+def display_decimal_separator(values):
+    """Decimal separator of displayed numbers: the last one in "1.234,50", or the one not repeated in "1.234.567"."""
+    for value in values:
+        if "," in value and "." in value:
+            return "," if value.rfind(",") > value.rfind(".") else "."
+        if value.count(",") > 1:
+            return "."
+        if value.count(".") > 1:
+            return ","
+    return DECIMAL_SEPARATOR
+
+
+def parse_display_numbers(series, integer=False):
+    """
+    Convert numbers as SAP GUI displays them ("1.234,000", "12,50-") to Float64 (Int64 with integer).
+    Returns None if a filled value is not a number.
+    """
+    text = series.str.strip_chars().str.replace_all(" ", "", literal=True)
+    filled = text.filter(text.is_not_null() & (text != ""))
+    decimal = display_decimal_separator(filled.to_list())
+    thousands = "." if decimal == "," else ","
+    cleaned = text.str.replace_all(thousands, "", literal=True).str.replace_all(decimal, ".", literal=True)
+    # SAP shows the minus sign after the number
+    negative = cleaned.str.ends_with("-")
+    cleaned = cleaned.str.strip_chars_end("-")
+    numbers = pl.select(pl.when(negative).then(-cleaned.cast(pl.Float64, strict=False))
+                        .otherwise(cleaned.cast(pl.Float64, strict=False))).to_series()
+    if numbers.is_not_null().sum() < len(filled):
+        return None
+    if integer and ((numbers.drop_nulls() % 1) == 0).all():
+        numbers = numbers.cast(pl.Int64)
+    return numbers.alias(series.name)
+
+
+def parse_display_dates(series):
+    """Convert dates displayed in the user's format; None if no single format fits them all."""
+    text = series.str.strip_chars()
+    filled = (text.is_not_null() & (text != "") & (text != "00.00.0000")).sum()
+    for date_format in DATE_FORMATS:
+        dates = text.str.strptime(pl.Date, date_format, strict=False)
+        if dates.is_not_null().sum() == filled:
+            return dates.alias(series.name)
+    return None
+
+
+def type_display_columns(df, data_types):
+    """
+    Convert text columns read from SAP GUI according to each column's type (GetColumnDataType),
+    so the outputs hold numbers and dates as the ODBC and export paths do.
+    Columns whose content does not match the type stay as text.
+    """
+    columns = []
+    for series, data_type in zip(df.get_columns(), data_types):
+        data_type = (data_type or "").strip().upper()
+        converted = None
+        if data_type in NUMBER_TYPES:
+            converted = parse_display_numbers(series, data_type in INTEGER_TYPES)
+        elif data_type in DATE_TYPES:
+            converted = parse_display_dates(series)
+        if converted is None and data_type in NUMBER_TYPES | DATE_TYPES:
+            logging.warning("Column '%s' (%s) kept as text: values do not match the type.",
+                            series.name, data_type)
+        columns.append(series if converted is None else converted)
+    return pl.DataFrame(columns)
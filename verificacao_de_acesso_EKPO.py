@@ -1,80 +1,62 @@
-import pyodbc
-import time
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
- 
-def get_table_columns(conn, table):
-    """
-    Retrieves a list of candidate column names for the given table using ODBC metadata.
-    """
-    cursor = conn.cursor()
-    columns = []
-    for row in cursor.columns(table=table):
-        columns.append(row.column_name)
-    return columns
- 
-def test_column_access(column, connection_string):
-    """
-    Attempts to query TOP 1 for a given column from EKPO.
-    Returns a tuple (column, success, elapsed_time).
-    """
-    start = time.time()
-    try:
-        conn = pyodbc.connect(connection_string)
-        cursor = conn.cursor()
-        # Use square brackets to safely delimit column names.
-        query = f"SELECT TOP 1 [{column}] FROM MARA"
-        cursor.execute(query)
-        cursor.fetchone()
-        elapsed = time.time() - start
-        conn.close()
-        return (column, True, elapsed)
-    except Exception as e:
-        try:
-            conn.close()
-        except Exception:
-            pass
-        return (column, False, None)
- 
+import argparse
+
+from catalogo_colunas import ColumnCatalog
+from extracao_odbc import CONNECTION_STRING, connect
+from extracao_paralela import ConnectionPool
+from sondagem_colunas import (DEFAULT_GROUP_SIZE, DEFAULT_TIMEOUT, OK, TIMEOUT, get_table_columns,
+                              probe_columns)
+
+
 def main():
-    connection_string = "DSN=TDVCPBIP;dataSource=S10231;"
-    try:
-        conn = pyodbc.connect(connection_string)
-        print("Connected using DSN 'TDVCPBIP' with dataSource=S10231.")
-    except Exception as e:
-        print("Connection error:", e)
+    parser = argparse.ArgumentParser(description="Checks which columns of a table the DSN lets us read.")
+    parser.add_argument("table", nargs="?", default="EKPO", help="table to probe (default: EKPO)")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT,
+                        help=f"per-query timeout in seconds, enforced by the ODBC driver (default: {DEFAULT_TIMEOUT})")
+    parser.add_argument("--group-size", type=int, default=DEFAULT_GROUP_SIZE,
+                        help=f"columns tested together before bisecting (default: {DEFAULT_GROUP_SIZE})")
+    parser.add_argument("--slow-threshold", type=float, default=None,
+                        help="re-time groups slower than this many seconds in smaller groups, so each slow "
+                             "column gets its own access time; use a value above the DSN's usual query time "
+                             "(default: off, every column of a group gets the group's time)")
+    parser.add_argument("--workers", type=int, default=5,
+                        help="pooled connections used for probing (default: 5)")
+    args = parser.parse_args()
+    table = args.table
+
+    conn = connect(CONNECTION_STRING)
+    if conn is None:
         return
- 
-    # Discover candidate columns in EKPO.
-    candidate_columns = get_table_columns(conn, "EKPO")
-    print("Discovered candidate columns in EKPO:")
+
+    # Discover candidate columns in the table.
+    candidate_columns = get_table_columns(conn, table)
+    print(f"Discovered candidate columns in {table}:")
     print(candidate_columns)
     conn.close()
-    accessible = []
-    inaccessible = []
-    # Use a ThreadPoolExecutor to test each candidate column with a 5-second timeout.
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_column = {executor.submit(test_column_access, col, connection_string): col 
-                            for col in candidate_columns}
-        for future in future_to_column:
-            col = future_to_column[future]
-            try:
-                result = future.result(timeout=5)
-                # result is a tuple: (column, success, elapsed_time)
-                if result[1]:
-                    accessible.append(result)
-                else:
-                    inaccessible.append(col)
-            except TimeoutError:
-                print(f"Column '{col}' timed out.")
-                inaccessible.append(col)
-            except Exception as e:
-                print(f"Column '{col}' raised exception: {e}")
-                inaccessible.append(col)
-    print("\nAccessible columns in EKPO (with access times in seconds):")
-    for col, success, elapsed in accessible:
+
+    pool = ConnectionPool(args.workers, CONNECTION_STRING, query_timeout=args.timeout)
+    try:
+        results, queries = probe_columns(pool, table, candidate_columns, max(1, args.group_size), args.workers,
+                                         args.slow_threshold)
+    finally:
+        pool.close()
+
+    accessible = [(col, result["elapsed"]) for col, result in results.items() if result["status"] == OK]
+    inaccessible = [col for col, result in results.items() if result["status"] != OK]
+    timed_out = [col for col, result in results.items() if result["status"] == TIMEOUT]
+
+    print(f"\nAccessible columns in {table} (with access times in seconds):")
+    for col, elapsed in accessible:
         print(f"{col}: {elapsed:.2f} seconds")
-    print("\nInaccessible columns in EKPO:")
+    print(f"\nInaccessible columns in {table}:")
     print(inaccessible)
- 
+    for col in timed_out:
+        print(f"Column '{col}' timed out.")
+    print(f"\n{queries} probe queries for {len(candidate_columns)} columns.")
+
+    catalog = ColumnCatalog()
+    catalog.record(table, results)
+    print(f"Results stored in the column catalog ({catalog.path}).")
+
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,82 +1,246 @@
-import pyodbc
+import argparse
+import json
+import os
 import pandas as pd
- 
-def main():
-    # List of accessible columns in MBEW (from your discovery)
-    accessible_columns = [
-        'MANDT', 'MATNR', 'BWKEY', 'BWTAR', 'LVORM', 'SALK3', 'VPRSV', 'VERPR',
-        'STPRS', 'PEINH', 'BKLAS', 'VMKUM', 'VMSAL', 'VMVPR', 'VMVER', 'VMSTP',
-        'VMPEI', 'VMBKL', 'VMSAV', 'VJKUM', 'VJSAL', 'VJVPR', 'VJVER', 'VJSTP',
-        'VJPEI', 'VJBKL', 'VJSAV', 'LFGJA', 'LFMON', 'BWTTY', 'STPRV', 'LAEPR',
-        'ZKPRS', 'ZKDAT', 'TIMESTAMP', 'BWPRS', 'BWPRH', 'VJBWS', 'VJBWH', 'VVJSL',
-        'VVJLB', 'VVMLB', 'VVSAL', 'ZPLPR', 'ZPLP1', 'ZPLP2', 'ZPLP3', 'ZPLD1',
-        'ZPLD2', 'ZPLD3', 'PPERZ', 'PPERL', 'PPERV', 'KALKZ', 'KALKL', 'KALKV',
-        'KALSC', 'XLIFO', 'MYPOL', 'BWPH1', 'BWPS1', 'ABWKZ', 'PSTAT', 'KALN1',
-        'KALNR', 'BWVA1', 'BWVA2', 'BWVA3', 'VERS1', 'VERS2', 'VERS3', 'HRKFT',
-        'KOSGR', 'PPRDZ', 'PPRDL', 'PPRDV', 'PDATZ', 'PDATL', 'PDATV', 'EKALR',
-        'VPLPR', 'MLMAA', 'MLAST', 'LPLPR', 'VKSAL', 'HKMAT', 'SPERW', 'KZIWL',
-        'WLINL', 'ABCIW', 'BWSPA', 'LPLPX', 'VPLPX', 'FPLPX', 'LBWST', 'VBWST',
-        'FBWST', 'EKLAS', 'QKLAS', 'MTUSE', 'MTORG', 'OWNPR', 'XBEWM', 'BWPEI',
-        'MBRUE', 'OKLAS', 'DUMMY_VAL_INCL_EEW_PS', 'OIPPINV', 'OICURVAL',
-        'OICURDATE', 'OICURQTY', 'OICURUT', 'OIFUTVAL', 'OIFUTDATE', 'OIFUTQTY',
-        'OIFUTUT', 'OINVALQTY', 'OIREQUAT', 'OITAXKEY', 'OIHANTYP', 'OIHMTXGR'
-    ]
-   
+
+from cache_local import SnapshotCache
+from catalogo_colunas import ColumnCatalog
+from extracao_odbc import LazyConnection
+from extracao_paralela import plant_partitions, run_partitions
+from rastreamento import TRACER, span
+from relatorio_excel import write_report
+from tipos_sap import (DEFAULT_PRICE_DTYPE, MEMORY, PRICE_DTYPES, compact_frame, concat_frames,
+                       set_price_dtype)
+
+# Valuation areas (plants) extracted from MBEW.
+BWKEYS = ['2032', '2096', '2914']
+# Add a WHERE clause to filter rows where BWKEY (the valuation area) is one of the desired values.
+MBEW_WHERE = "[BWKEY] IN ({})".format(",".join(f"'{bwkey}'" for bwkey in BWKEYS))
+
+# Incremental mode keeps a local copy of the filtered MBEW rows plus, per BWKEY,
+# the highest TIMESTAMP already loaded.
+SNAPSHOT_FILE = "MBEW_snapshot.parquet"
+STATE_FILE = "MBEW_delta_state.json"
+KEY_COLUMNS = ['MATNR', 'BWKEY', 'BWTAR']
+# Columns the upsert and the watermarks depend on, extracted whatever the catalog or --max-latency leave out.
+INCREMENTAL_COLUMNS = KEY_COLUMNS + ['TIMESTAMP']
+
+# Columns left out of the extract even when readable.
+EXCLUDED_COLUMNS = ('SALK3', 'VKSAL')
+
+# List of accessible columns in MBEW (from your discovery), used until MBEW is in the column catalog
+ACCESSIBLE_COLUMNS = [
+    'MANDT', 'MATNR', 'BWKEY', 'BWTAR', 'LVORM', 'SALK3', 'VPRSV', 'VERPR',
+    'STPRS', 'PEINH', 'BKLAS', 'VMKUM', 'VMSAL', 'VMVPR', 'VMVER', 'VMSTP',
+    'VMPEI', 'VMBKL', 'VMSAV', 'VJKUM', 'VJSAL', 'VJVPR', 'VJVER', 'VJSTP',
+    'VJPEI', 'VJBKL', 'VJSAV', 'LFGJA', 'LFMON', 'BWTTY', 'STPRV', 'LAEPR',
+    'ZKPRS', 'ZKDAT', 'TIMESTAMP', 'BWPRS', 'BWPRH', 'VJBWS', 'VJBWH', 'VVJSL',
+    'VVJLB', 'VVMLB', 'VVSAL', 'ZPLPR', 'ZPLP1', 'ZPLP2', 'ZPLP3', 'ZPLD1',
+    'ZPLD2', 'ZPLD3', 'PPERZ', 'PPERL', 'PPERV', 'KALKZ', 'KALKL', 'KALKV',
+    'KALSC', 'XLIFO', 'MYPOL', 'BWPH1', 'BWPS1', 'ABWKZ', 'PSTAT', 'KALN1',
+    'KALNR', 'BWVA1', 'BWVA2', 'BWVA3', 'VERS1', 'VERS2', 'VERS3', 'HRKFT',
+    'KOSGR', 'PPRDZ', 'PPRDL', 'PPRDV', 'PDATZ', 'PDATL', 'PDATV', 'EKALR',
+    'VPLPR', 'MLMAA', 'MLAST', 'LPLPR', 'VKSAL', 'HKMAT', 'SPERW', 'KZIWL',
+    'WLINL', 'ABCIW', 'BWSPA', 'LPLPX', 'VPLPX', 'FPLPX', 'LBWST', 'VBWST',
+    'FBWST', 'EKLAS', 'QKLAS', 'MTUSE', 'MTORG', 'OWNPR', 'XBEWM', 'BWPEI',
+    'MBRUE', 'OKLAS', 'DUMMY_VAL_INCL_EEW_PS', 'OIPPINV', 'OICURVAL',
+    'OICURDATE', 'OICURQTY', 'OICURUT', 'OIFUTVAL', 'OIFUTDATE', 'OIFUTQTY',
+    'OIFUTUT', 'OINVALQTY', 'OIREQUAT', 'OITAXKEY', 'OIHANTYP', 'OIHMTXGR'
+]
+
+def get_filtered_columns(max_latency=None, catalog=None):
+    # Prefer the columns the last probe found readable (optionally only the fast ones).
+    catalog = catalog or ColumnCatalog()
+    columns = catalog.accessible_columns("MBEW", max_latency)
+    if columns is None:
+        columns = ACCESSIBLE_COLUMNS
     # Exclude the columns SALK3 and VKSAL.
-    filtered_columns = [col for col in accessible_columns if col not in ('SALK3', 'VKSAL')]
-   
+    return [col for col in columns if col not in EXCLUDED_COLUMNS]
+
+def add_incremental_columns(columns, catalog=None):
+    """
+    Returns columns plus any of INCREMENTAL_COLUMNS they lack. Raises ValueError if the
+    catalog marks one of those as not accessible, since incremental mode cannot work without it.
+    """
+    catalog = catalog or ColumnCatalog()
+    usable = catalog.usable_columns("MBEW", INCREMENTAL_COLUMNS)
+    blocked = [col for col in INCREMENTAL_COLUMNS if col not in usable]
+    if blocked:
+        raise ValueError(f"--incremental needs MBEW columns {blocked}, which the column catalog "
+                         f"marks as not accessible; run without --incremental.")
+    return columns + [col for col in INCREMENTAL_COLUMNS if col not in columns]
+
+def get_query_columns(columns):
     # Build the SELECT clause (wrap each column name in square brackets to handle special characters).
-    query_columns = ", ".join(f'[{col}]' for col in filtered_columns)
-    # Add a WHERE clause to filter rows where BWKEY (the valuation area) is one of the desired values.
-    sql_query = f"SELECT {query_columns} FROM MBEW WHERE [BWKEY] IN ('2032','2096','2914')"
-   
+    return ", ".join(f'[{col}]' for col in columns)
+
+def load_state(path=STATE_FILE):
+    """
+    Returns the per-BWKEY TIMESTAMP high-water marks, or an empty dict if there are none yet.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_state(state, path=STATE_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def load_snapshot(path=SNAPSHOT_FILE):
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path)
+
+def save_snapshot(df, path=SNAPSHOT_FILE):
+    tmp_path = path + ".tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def compute_watermarks(df):
+    """
+    Returns {BWKEY: highest TIMESTAMP} for the rows in df. Timestamps are SAP's
+    YYYYMMDDhhmmss numbers and are kept as strings of integers in the state file.
+    """
+    watermarks = {}
+    timestamps = pd.to_numeric(df['TIMESTAMP'], errors='coerce')
+    for bwkey, value in timestamps.groupby(df['BWKEY'], observed=True).max().items():
+        if pd.notna(value):
+            watermarks[str(bwkey)] = str(int(value))
+    return watermarks
+
+def fetch_full(db, columns, workers=1):
+    if workers > 1:
+        # One partition per valuation area, run on a pool of connections.
+        return run_partitions(plant_partitions("MBEW", columns, "BWKEY", BWKEYS), workers, db.connection_string)
+    sql_query = f"SELECT {get_query_columns(columns)} FROM MBEW WHERE {MBEW_WHERE}"
     print("Executing query:", sql_query)
-   
-    connection_string = "DSN=TDVCPBIP;dataSource=S10231;"
-   
-    try:
-        conn = pyodbc.connect(connection_string)
-        print("Connected using DSN 'TDVCPBIP' with dataSource=S10231.")
-    except Exception as e:
-        print("Connection error:", e)
-        return
-   
+    conn = db.get()
+    with span("read_sql", table="MBEW"):
+        return compact_frame(pd.read_sql(sql_query, conn))
+
+def fetch_delta(db, columns, state, workers=1):
+    """
+    Fetches, per BWKEY, only the rows whose TIMESTAMP is at or after the stored watermark.
+    Valuation areas without a watermark are fetched in full.
+    Rows sharing the watermark second are fetched again and simply overwritten by the upsert.
+    """
+    query_columns = get_query_columns(columns)
+    partitions = []
+    for bwkey in BWKEYS:
+        watermark = state.get(bwkey)
+        if watermark is None:
+            sql_query = f"SELECT {query_columns} FROM MBEW WHERE [BWKEY] = ?"
+            params = [bwkey]
+        else:
+            sql_query = f"SELECT {query_columns} FROM MBEW WHERE [BWKEY] = ? AND [TIMESTAMP] >= ?"
+            params = [bwkey, int(watermark)]
+        label = f"BWKEY {bwkey} changed since {watermark or 'the beginning'}"
+        partitions.append((label, sql_query, params))
+
+    if workers > 1:
+        return run_partitions(partitions, workers, db.connection_string)
+
+    frames = []
+    for label, sql_query, params in partitions:
+        conn = db.get()
+        with span("read_sql", partition=label):
+            df = compact_frame(pd.read_sql(sql_query, conn, params=params))
+        print(f"{label}: {len(df)} rows.")
+        frames.append(df)
+    return concat_frames(frames)
+
+def upsert(snapshot, delta):
+    """
+    Replaces the snapshot rows that have the same (MATNR, BWKEY, BWTAR) as a delta row
+    and appends the new ones.
+    """
+    if snapshot is None or snapshot.empty:
+        return delta.reset_index(drop=True)
+    if delta.empty:
+        return snapshot
+    merged = concat_frames([snapshot, delta])
+    return merged.drop_duplicates(subset=KEY_COLUMNS, keep='last').reset_index(drop=True)
+
+def run_incremental(db, columns, full_reload, workers=1):
+    """
+    Brings the local MBEW snapshot up to date and returns it. A full reload replaces
+    the snapshot and the watermarks; use it to pick up deleted rows.
+    """
+    snapshot = None if full_reload else load_snapshot()
+    state = {} if snapshot is None else load_state()
+
+    if snapshot is None:
+        df = fetch_full(db, columns, workers)
+        print(f"Full reload: {len(df)} rows retrieved from MBEW.")
+    else:
+        delta = fetch_delta(db, columns, state, workers)
+        df = upsert(snapshot, delta)
+        print(f"Incremental load: {len(delta)} rows retrieved, snapshot has {len(df)} rows.")
+
+    save_snapshot(df)
+    state.update(compute_watermarks(df))
+    save_state(state)
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the accessible MBEW columns for the selected valuation areas.")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"fetch only rows changed since the last run and upsert them into {SNAPSHOT_FILE}")
+    parser.add_argument("--full-reload", action="store_true",
+                        help="with --incremental, discard the snapshot and watermarks and reload everything")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="query the DSN directly instead of reading through the local cache")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="ignore the cached MBEW extract and store a fresh one")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="split the query per valuation area across this many parallel connections")
+    parser.add_argument("--max-latency", type=float, default=None,
+                        help="leave out columns whose probed access time exceeded this many seconds")
+    parser.add_argument("--price-dtype", choices=list(PRICE_DTYPES), default=DEFAULT_PRICE_DTYPE,
+                        help=f"how prices such as VERPR and STPRS are held in memory (default: {DEFAULT_PRICE_DTYPE})")
+    parser.add_argument("--memory-report", action="store_true",
+                        help="list the columns whose compact dtypes saved the most memory")
+    args = parser.parse_args()
+    set_price_dtype(args.price_dtype)
+
+    columns = get_filtered_columns(args.max_latency)
+    if args.incremental:
+        try:
+            columns = add_incremental_columns(columns)
+        except ValueError as e:
+            parser.error(str(e))
+
+    db = LazyConnection()
+    cache = None if args.no_cache else SnapshotCache()
+
     try:
         # Execute the query and retrieve data into a DataFrame.
-        df = pd.read_sql(sql_query, conn)
+        if args.incremental:
+            df = run_incremental(db, columns, args.full_reload, args.workers)
+            if cache is not None:
+                # Share the refreshed snapshot with the other scripts reading MBEW.
+                cache.put("MBEW", columns, MBEW_WHERE, df)
+        elif cache is not None:
+            df = cache.read("MBEW", columns, MBEW_WHERE,
+                            lambda: fetch_full(db, columns, args.workers), args.refresh_cache)
+        else:
+            df = fetch_full(db, columns, args.workers)
         print("The data has been retrieved from MBEW.")
+        MEMORY.report("MBEW extract", top=15 if args.memory_report else None)
         # print(df.head())
     except Exception as e:
         print("Error executing query:", e)
-        conn.close()
         return
     finally:
-        conn.close()
-   
-    # Save the result to an Excel file with formatting.
+        db.close()
+
     output_file = "MBEW_filtered_query.xlsx"
-    writer = pd.ExcelWriter(output_file, engine="xlsxwriter")
-    df.to_excel(writer, sheet_name="Filtered", index=False)
-   
-    workbook = writer.book
-    worksheet = writer.sheets["Filtered"]
-    header_format = workbook.add_format({
-        "bold": True,
-        "text_wrap": True,
-        "valign": "top",
-        "fg_color": "#D7E4BC",
-        "border": 1
-    })
-   
-    # Auto-adjust column widths and format the header.
-    for col_num, col_name in enumerate(df.columns):
-        worksheet.write(0, col_num, col_name, header_format)
-        max_width = max(df[col_name].astype(str).apply(len).max(), len(col_name))
-        worksheet.set_column(col_num, col_num, max_width + 2)
-   
-    writer.close()
+    write_report(df, output_file, "Filtered")
     print(f"Filtered query result saved as '{output_file}'.")
- 
+    TRACER.finish("verificacao_de_acesso_MBEW")
+
 if __name__ == '__main__':
     main()
- 
\ No newline at end of file